@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+import sys
+from pathlib import Path
+
+
+def print_usage(msg=""):
+    print(
+        "garbage_collect.py <prebuilt budget GB> <unpack budget GB> "
+        "[<prebuilt path> [<unpack path>]] [--dry-run]"
+    )
+    print(
+        "Removes the least recently used prebuilds / unpacked algorithms "
+        "until they fit the budgets."
+    )
+    print("Anything used within the last 30 days is kept.")
+    print(
+        "Paths that are not given are taken from the default "
+        "PrebuildManager / ExternalAlgorithmStore"
+    )
+    if msg:
+        print(msg)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in sys.argv
+    args = [x for x in sys.argv[1:] if x != "--dry-run"]
+    try:
+        prebuilt_budget = float(args[0]) * 1024 ** 3
+        unpack_budget = float(args[1]) * 1024 ** 3
+    except (IndexError, ValueError):
+        print_usage()
+    if len(args) > 4:
+        print_usage("Too many arguments")
+    sys.path.insert(0, str((Path(__file__).parent.parent / "src").absolute()))
+    import mbf_externals
+
+    if len(args) > 2:
+        prebuilt_path = Path(args[2])
+        if not prebuilt_path.is_dir():
+            print_usage("%s was not a directory" % prebuilt_path)
+        manager = mbf_externals.PrebuildManager(prebuilt_path)
+    else:
+        manager = mbf_externals.get_global_manager()
+    if len(args) > 3:
+        unpack_path = Path(args[3])
+        if not unpack_path.is_dir():
+            print_usage("%s was not a directory" % unpack_path)
+        # garbage collection only ever touches the unpacked versions
+        store = mbf_externals.ExternalAlgorithmStore(unpack_path, unpack_path)
+    else:
+        store = mbf_externals.get_global_store()
+    if manager is None and store is None:
+        print_usage(
+            "No prebuilt path passed and no default "
+            "PrebuildManager/ExternalAlgorithmStore configured"
+        )
+    removed = []
+    if manager is not None:
+        removed += manager.garbage_collect(prebuilt_budget, dry_run=dry_run)
+    else:
+        print("No PrebuildManager - skipping prebuilds")
+    if store is not None:
+        removed += store.garbage_collect(unpack_budget, dry_run=dry_run)
+    else:
+        print("No ExternalAlgorithmStore - skipping unpacked algorithms")
+    for path, size in removed:
+        print("%s %s (%.2f GB)" % ("would remove" if dry_run else "removed", path, size / 1024 ** 3))
+    print("%.2f GB total" % (sum(x[1] for x in removed) / 1024 ** 3))
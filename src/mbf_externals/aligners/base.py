@@ -1,10 +1,61 @@
 from ..externals import ExternalAlgorithm
+from ..prebuild import get_global_manager
+from ..util import decompressing_feed, read_md5_sum
 from pathlib import Path
+import hashlib
+import json
+import os
 from abc import abstractmethod
 import pypipegraph as ppg
 
 
+def sample_fastq_reads(input_filenames, output_filenames, count, seed=500):
+    """Reservoir sample @count reads (or pairs, if multiple input_filenames
+    are given - they are read in lockstep) in one pass over the fastqs."""
+    import gzip
+    import random
+
+    def open_fastq(fn):
+        if str(fn).endswith(".gz"):
+            return gzip.open(fn, "rb")
+        return open(fn, "rb")
+
+    rng = random.Random(seed)
+    reservoir = []
+    handles = [open_fastq(fn) for fn in input_filenames]
+    try:
+        records = zip(*[zip(*[iter(h)] * 4) for h in handles])
+        for ii, record in enumerate(records):
+            if ii < count:
+                reservoir.append(record)
+            else:
+                jj = rng.randint(0, ii)
+                if jj < count:
+                    reservoir[jj] = record
+    finally:
+        for h in handles:
+            h.close()
+    for mate, fn in enumerate(output_filenames):
+        with open(fn, "wb") as op:
+            op.write(b"".join(b"".join(record[mate]) for record in reservoir))
+
+
 class Aligner(ExternalAlgorithm):
+    # name -> additional index building arguments.
+    # 'fast' is the historic default (full index, no memory limits)
+    index_profiles = {"fast": [], "balanced": [], "low_memory": []}
+    # feed .gz input through (multi threaded) pigz & named pipes
+    # instead of decompressing within the aligner.
+    # Opt-in: only for aligners that read their input exactly once
+    # (a fifo can not be reopened or seeked)
+    decompress_via_fifo = False
+    fifo_decompression_threads = 2
+    # aligner parameters that mean 'the aligner decompresses itself'
+    fifo_incompatible_parameters = ()
+    # aligner parameter -> it's 'read all input' value. Any other value
+    # lets the aligner stop reading early, which is then not a feeder error
+    fifo_early_stop_parameters = {}
+
     @abstractmethod
     def align_job(
         self,
@@ -13,13 +64,81 @@ class Aligner(ExternalAlgorithm):
         index_basename,
         output_bam_filename,
         parameters,
+        preview=None,
     ):
+        """@preview=n: see preview_align_job"""
         pass  # pragma: no cover
 
+    def preview_align_job(
+        self,
+        input_fastq,
+        paired_end_filename,
+        index_basename,
+        output_bam_filename,
+        parameters,
+        preview,
+    ):
+        """Align only a random sample of @preview reads (pairs)
+        to quickly check wether a library aligns sensibly.
+
+        Everything ends up in <output_bam_filename.parent>/preview_<n>/,
+        the aligner's stats (if available) in preview_stats.tsv there.
+        """
+        output_bam_filename = Path(output_bam_filename)
+        preview = int(preview)
+        preview_dir = output_bam_filename.parent / f"preview_{preview}"
+        preview_dir.mkdir(parents=True, exist_ok=True)
+        inputs = [input_fastq]
+        sampled = [preview_dir / "sample.fastq"]
+        if paired_end_filename:
+            inputs.append(paired_end_filename)
+            sampled.append(preview_dir / "sample_paired_end.fastq")
+
+        sample_job = ppg.MultiFileGeneratingJob(
+            sampled, lambda: sample_fastq_reads(inputs, sampled, preview)
+        ).depends_on(
+            ppg.ParameterInvariant(
+                str(preview_dir / "sample.fastq"),
+                ([str(x) for x in inputs], preview),
+            )
+        )
+        preview_bam_filename = preview_dir / output_bam_filename.name
+        job = self.align_job(
+            sampled[0],
+            sampled[1] if paired_end_filename else None,
+            index_basename,
+            preview_bam_filename,
+            parameters,
+        )
+        job.depends_on(sample_job)
+        job.output_bam_filename = preview_bam_filename
+        if hasattr(self, "get_alignment_stats"):
+
+            def write_stats():
+                stats = self.get_alignment_stats(preview_bam_filename)
+                with open(preview_dir / "preview_stats.tsv", "w") as op:
+                    for k, v in stats.items():
+                        op.write(f"{k}\t{v}\n")
+
+            job.stats_job = ppg.FileGeneratingJob(
+                preview_dir / "preview_stats.tsv", write_stats
+            ).depends_on(job)
+        return job
+
     @abstractmethod
-    def build_index_func(self, fasta_files, gtf_input_filename, output_prefix):
+    def build_index_func(
+        self, fasta_files, gtf_input_filename, output_prefix, profile="fast"
+    ):
         pass  # pragma: no cover
 
+    def get_index_profile_arguments(self, profile):
+        if profile not in self.index_profiles:
+            raise ValueError(
+                "Unknown index profile %s, available: %s"
+                % (profile, sorted(self.index_profiles))
+            )
+        return [str(x) for x in self.index_profiles[profile]]
+
     @abstractmethod
     def _aligner_build_cmd(self, output_dir, ncores, arguments):
         pass  # pragma: no cover
@@ -36,13 +155,64 @@ class Aligner(ExternalAlgorithm):
             )
         return self._aligner_build_cmd(output_dir, ncores, arguments[1:])
 
-    def build_index_job(self, fasta_files, gtf_input_filename, output_fileprefix):
+    def _fifo_inputs(
+        self, output_directory, input_fastq, paired_end_filename, parameters=None
+    ):
+        """Replace compressed input fastqs with named pipes in output_directory.
+
+        Returns input_fastq, paired_end_filename, input_fifos (for self.run).
+        The fifos of both mates are filled concurrently, so the aligner
+        reads them in lockstep.
+        Inputs are passed unchanged if the aligner was told to decompress
+        them itself (see fifo_incompatible_parameters).
+        """
+        input_fifos = []
+        if not self.decompress_via_fifo or any(
+            k in (parameters or {}) for k in self.fifo_incompatible_parameters
+        ):
+            return input_fastq, paired_end_filename, input_fifos
+        allow_early_close = any(
+            str(parameters[k]) != str(v)
+            for k, v in self.fifo_early_stop_parameters.items()
+            if k in (parameters or {})
+        )
+        output_directory = Path(output_directory)
+        result = []
+        for fn, fifo_name in [
+            (input_fastq, "input_fifo.fastq"),
+            (paired_end_filename, "input_fifo_paired_end.fastq"),
+        ]:
+            if fn and str(fn).endswith(".gz"):
+                fifo = (output_directory / fifo_name).absolute()
+                input_fifos.append(
+                    (
+                        fifo,
+                        decompressing_feed(
+                            Path(fn).absolute(),
+                            self.fifo_decompression_threads,
+                            allow_early_close,
+                        ),
+                    )
+                )
+                fn = fifo
+            result.append(fn)
+        return result[0], result[1], input_fifos
+
+    def build_index_job(
+        self, fasta_files, gtf_input_filename, output_fileprefix, profile="fast"
+    ):
+        """@profile selects one of index_profiles, trading index build memory
+        against build and alignment speed. The profile's arguments
+        end up in the build command and are therefore part of the job's identity.
+        """
         output_directory = Path(output_fileprefix)
         output_directory.mkdir(parents=True, exist_ok=True)
         sentinel = output_directory / "sentinel.txt"
         job = ppg.FileGeneratingJob(
             sentinel,
-            self.build_index_func(fasta_files, gtf_input_filename, output_directory),
+            self.build_index_func(
+                fasta_files, gtf_input_filename, output_directory, profile
+            ),
         ).depends_on(
             ppg.FileChecksumInvariant(
                 self.store.get_zip_file_path(self.name, self.version)
@@ -51,13 +221,166 @@ class Aligner(ExternalAlgorithm):
         if self.multi_core:
             job.cores_needed = -1
         job.index_path = output_fileprefix
+        job.index_profile = profile
         return job
 
-    def build_index(self, fasta_files, gtf_input_filename, output_fileprefix):
+    def build_index(
+        self, fasta_files, gtf_input_filename, output_fileprefix, profile="fast"
+    ):
         output_fileprefix = Path(output_fileprefix)
         output_fileprefix.mkdir(parents=True, exist_ok=True)
-        func = self.build_index_func(fasta_files, gtf_input_filename, output_fileprefix)
+        func = self.build_index_func(
+            fasta_files, gtf_input_filename, output_fileprefix, profile
+        )
         func()
 
+    def build_index_prebuild(
+        self,
+        genome_fasta,
+        gtf_input_filename,
+        name=None,
+        prebuild_manager=None,
+        profile="fast",
+    ):
+        """Build (or reuse) an index via the PrebuildManager.
+
+        Indices are stored below prebuilt/<host>/<name>/<aligner version>,
+        and any compatible version (see get_index_version_range) built on
+        any host is reused instead of rebuilding.
+
+        @name defaults to
+        aligner_indices/<aligner>/<fasta name>[_<gtf name>]_<md5 prefix>,
+        with _<profile> appended for non-'fast' profiles. The md5 prefix
+        (of the input files' contents) keeps genomes that ship identically
+        named files apart.
+        """
+        if prebuild_manager is None:
+            prebuild_manager = get_global_manager()
+        if prebuild_manager is None:  # pragma: no cover
+            raise ValueError("No PrebuildManager passed and no global manager set")
+        if isinstance(genome_fasta, (str, Path)):
+            genome_fasta = [genome_fasta]
+        genome_fasta = [Path(x) for x in genome_fasta]
+        input_files = list(genome_fasta)
+        if gtf_input_filename is not None:
+            gtf_input_filename = Path(gtf_input_filename)
+            input_files.append(gtf_input_filename)
+        if name is None:
+            inputs_md5 = hashlib.md5(
+                "".join(read_md5_sum(x) for x in input_files).encode("utf-8")
+            ).hexdigest()
+            name = "aligner_indices/%s/%s_%s" % (
+                self.name,
+                "_".join(x.name for x in input_files),
+                inputs_md5[:8],
+            )
+            if profile != "fast":
+                name += "_" + profile
+        self.get_index_profile_arguments(profile)  # fail early on unknown profiles
+        # the calculating function's closure is part of it's invariant -
+        # keep the (host specific, absolute) input paths out of it.
+        # They are covered by the prebuild's input file checksums instead
+        if not hasattr(self, "_prebuild_inputs"):
+            self._prebuild_inputs = {}
+        self._prebuild_inputs[name] = (genome_fasta, gtf_input_filename)
+
+        def build(output_path):
+            fasta_files, gtf_filename = self._prebuild_inputs[name]
+            self.build_index(fasta_files, gtf_filename, output_path, profile)
+
+        minimum_acceptable_version, maximum_acceptable_version = (
+            self.get_index_version_range()
+        )
+        job = prebuild_manager.prebuild(
+            name,
+            self.version,
+            input_files,
+            ["sentinel.txt", "stdout.txt", "stderr.txt", "cmd.txt"],
+            build,
+            minimum_acceptable_version=minimum_acceptable_version,
+            maximum_acceptable_version=maximum_acceptable_version,
+        )
+        if self.multi_core:
+            job.cores_needed = -1
+        job.index_path = job.output_path
+        job.index_profile = profile
+        if not hasattr(self, "_prebuilt_index_jobs"):
+            self._prebuilt_index_jobs = {}
+        self._prebuilt_index_jobs[Path(job.index_path).absolute()] = job
+        return job
+
+    def _depend_on_index_prefetch(self, job, index_basename):
+        """Have the alignment @job depend on the prefetch_job of it's index,
+        if that was declared by build_index_prebuild (in this pipegraph)"""
+        index_job = getattr(self, "_prebuilt_index_jobs", {}).get(
+            Path(index_basename).absolute()
+        )
+        if (
+            index_job is not None
+            and hasattr(index_job, "prefetch_job")
+            and ppg.util.global_pipegraph is not None
+            and ppg.util.global_pipegraph.jobs.get(index_job.job_id) is index_job
+        ):
+            job.depends_on(index_job.prefetch_job())
+        return job
+
     def get_index_version_range(self):  # pragma: no cover
         return None, None
+
+    def get_alignment_stats_filename(self, output_bam_filename):  # pragma: no cover
+        """The log file get_alignment_stats parses for output_bam_filename"""
+        raise NotImplementedError(f"{self.name} does not support alignment stats")
+
+    def parse_alignment_stats(self, raw):  # pragma: no cover
+        """Turn the contents of get_alignment_stats_filename into a dict"""
+        raise NotImplementedError(f"{self.name} does not support alignment stats")
+
+    def collect_alignment_stats(
+        self, output_bam_filenames, cache_filename=None, max_workers=8
+    ):
+        """Parse the alignment logs of many output bams into one DataFrame
+        (one row per bam, one int column per statistic).
+
+        Parsed logs are cached (in memory, and in @cache_filename if set)
+        keyed by log path and modification time, so only new or changed
+        logs are read again.
+        """
+        import pandas as pd
+        from concurrent.futures import ThreadPoolExecutor
+
+        if not hasattr(self, "_alignment_stats_cache"):
+            self._alignment_stats_cache = {}
+        cache = self._alignment_stats_cache
+        if cache_filename is not None:
+            cache_filename = Path(cache_filename)
+            if cache_filename.exists():
+                for k, v in json.loads(cache_filename.read_text()).items():
+                    cache.setdefault(k, tuple(v))
+
+        output_bam_filenames = [str(x) for x in output_bam_filenames]
+        log_filenames = [
+            str(self.get_alignment_stats_filename(x)) for x in output_bam_filenames
+        ]
+
+        def load(log_filename):
+            try:
+                mtime = os.stat(log_filename).st_mtime_ns
+            except OSError:
+                return None
+            cached = cache.get(log_filename)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(log_filename) as op:
+                stats = self.parse_alignment_stats(op.read())
+            cache[log_filename] = (mtime, stats)
+            return stats
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            stats = list(pool.map(load, log_filenames))
+        if cache_filename is not None:
+            cache_filename.write_text(json.dumps(cache))
+        df = pd.DataFrame(
+            [x if x is not None else {} for x in stats], index=output_bam_filenames
+        )
+        df.index.name = "output_bam_filename"
+        return df.astype("Int64")
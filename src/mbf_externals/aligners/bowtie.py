@@ -6,6 +6,13 @@ from ..externals import reproducible_tar
 
 
 class Bowtie(Aligner):
+    index_profiles = {
+        "fast": [],
+        "balanced": ["--packed"],
+        # no automatic memory fitting, small blocks & difference cover
+        "low_memory": ["--packed", "--noauto", "--bmaxdivn", "16", "--dcv", "2048"],
+    }
+
     def __init__(self, version="_last_used", store=None):
         super().__init__(version, store)
 
@@ -27,13 +34,25 @@ class Bowtie(Aligner):
         index_basename,
         output_bam_filename,
         parameters,
+        preview=None,
     ):
+        if preview:
+            return self.preview_align_job(
+                input_fastq,
+                paired_end_filename,
+                index_basename,
+                output_bam_filename,
+                parameters,
+                preview,
+            )
         cmd = [
             "FROM_ALIGNER",
             self.path / f"bowtie-{self.version}-linux-x86_64" / "bowtie",
             (Path(index_basename) / "bowtie_index").absolute(),
             "-S",
         ]
+        # no decompress_via_fifo: bowtie reads .gz input itself,
+        # and nobody checked that it reads its input exactly once
         if paired_end_filename:
             cmd.extend(
                 [
@@ -67,14 +86,17 @@ class Bowtie(Aligner):
             cmd,
             cwd=Path(output_bam_filename).parent,
             call_afterwards=sam_to_bam,
-            additional_files_created=output_bam_filename
+            additional_files_created=output_bam_filename,
         )
         job.depends_on(
             ppg.ParameterInvariant(output_bam_filename, sorted(parameters.items()))
         )
+        self._depend_on_index_prefetch(job, index_basename)
         return job
 
-    def build_index_func(self, fasta_files, gtf_input_filename, output_fileprefix):
+    def build_index_func(
+        self, fasta_files, gtf_input_filename, output_fileprefix, profile="fast"
+    ):
         if isinstance(fasta_files, (str, Path)):
             fasta_files = [fasta_files]
         if len(fasta_files) > 1:  # pragma: no cover
@@ -86,7 +108,7 @@ class Bowtie(Aligner):
             (Path(output_fileprefix) / "bowtie_index").absolute(),
             "--seed",
             "123123",
-        ]
+        ] + self.get_index_profile_arguments(profile)
         return self.get_run_func(output_fileprefix, cmd, cwd=output_fileprefix)
 
     def get_latest_version(self):
@@ -103,3 +125,25 @@ class Bowtie(Aligner):
         td = tempfile.TemporaryDirectory()
         subprocess.check_call(["unzip", str(Path(tf.name).absolute())], cwd=td.name)
         reproducible_tar(target_filename, '.', td.name)
+
+    def get_alignment_stats_filename(self, output_bam_filename):
+        return Path(output_bam_filename).parent / "stderr.txt"
+
+    def get_alignment_stats(self, output_bam_filename):
+        target = self.get_alignment_stats_filename(output_bam_filename)
+        return self.parse_alignment_stats(target.read_text())
+
+    def parse_alignment_stats(self, raw):
+        import re
+
+        found = dict(re.findall(r"^# reads (.+?): (\d+)", raw, re.MULTILINE))
+        # (pairs for paired end input)
+        result = {
+            "Aligned": int(found["with at least one reported alignment"]),
+            "Unmapped": int(found["that failed to align"]),
+        }
+        # only reported with -m
+        result["Suppressed (-m)"] = int(
+            found.get("with alignments suppressed due to -m", 0)
+        )
+        return result
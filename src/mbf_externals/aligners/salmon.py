@@ -1,8 +1,13 @@
 from ..externals import ExternalAlgorithm
 import pypipegraph as ppg
 from pathlib import Path
-from ..util import download_file
+from ..util import download_file, Version, checksum_file, read_md5_sum
+from ..prebuild import get_global_manager
 import hashlib
+import io
+import os
+import tempfile
+import json
 
 
 class Salmon(ExternalAlgorithm):
@@ -14,6 +19,11 @@ class Salmon(ExternalAlgorithm):
         super().__init__(version, store)
 
     latest_version = "1.0.0"
+    # cores claimed by run_quant_on_raw_lane / run_alevin_on_sample jobs
+    default_cores = 8
+    # stream the transcripts into salmon index via a named pipe,
+    # instead of writing (and reading) a temporary fasta
+    index_via_fifo = True
 
     @property
     def name(self):
@@ -33,8 +43,13 @@ class Salmon(ExternalAlgorithm):
     # def _aligner_build_cmd(self, output_dir, ncores, arguments):
     # return arguments + ["--runThreadN", str(ncores)]
 
-    def get_index_version_range(self):  # pragma: no cover
-        return None, None
+    def get_index_version_range(self):
+        """What minimum_acceptable_version, maximum_acceptable_version for the index is ok?"""
+        if Version(self.version) >= "1.0":
+            # 1.0 switched to pufferfish based indices
+            return "1.0", None
+        else:
+            return "0.1", "0.99.99"
 
     def get_genome_deps(self, genome):
         return [genome.job_transcripts()]
@@ -46,82 +61,208 @@ class Salmon(ExternalAlgorithm):
             ).hexdigest()
         return hashlib.md5("None".encode("utf-8")).hexdigest()
 
-    def build_index_from_genome(self, genome, output_fileprefix):
+    def _select_transcripts(self, genome):
+        """transcript_stable_id -> gene_stable_id Series of the transcripts
+        matching accepted_biotypes"""
+        df = genome.df_transcripts
+        if self.accepted_biotypes is not None:
+            df = df[df["biotype"].isin(self.accepted_biotypes)]
+        return df["gene_stable_id"].sort_index()
+
+    def _get_transcript_set_hash(self, genome, selected, kmer_size):
+        h = hashlib.md5()
+        h.update(genome.name.encode("utf-8"))
+        h.update(self.get_build_key().encode("utf-8"))
+        h.update(str(kmer_size).encode("utf-8"))
+        # the content, not just the size - a fixed sequence must trigger a rebuild
+        h.update(checksum_file(genome.find_file("cdna.fasta")).encode("utf-8"))
+        h.update("\n".join(selected.index).encode("utf-8"))
+        return h.hexdigest()
+
+    def _iter_transcript_sequences(self, genome, selected):
+        """Yield (transcript_stable_id, sequence) for every selected transcript,
+        in one pass over the cdna fasta, falling back to the genome's
+        .mrna for those not in the fasta"""
         import pysam
 
+        to_output = set(selected.index)
+        seen = set()
+        # iterating the fasta once is much faster than random accessing for each and every transcript
+        with pysam.FastxFile(genome.find_file("cdna.fasta")) as f:
+            for entry in f:
+                name = entry.name
+                if name not in to_output and "." in name:
+                    name = name[: name.rfind(".")]
+                if name in to_output and name not in seen:
+                    seen.add(name)
+                    yield name, entry.sequence
+        if not seen:
+            raise ValueError("non seen", genome.find_file("cdna.fasta"))
+        for transcript_stable_id in sorted(to_output.difference(seen)):
+            yield transcript_stable_id, genome.transcripts[transcript_stable_id].mrna
+
+    @staticmethod
+    def _write_fasta(records, file_object, buffer_size=4 * 1024 * 1024):
+        """Write (name, sequence) records in large blocks"""
+        buffer = []
+        buffered = 0
+        for name, seq in records:
+            entry = f">{name}\n{seq}\n"
+            buffer.append(entry)
+            buffered += len(entry)
+            if buffered >= buffer_size:
+                file_object.write("".join(buffer))
+                buffer = []
+                buffered = 0
+        file_object.write("".join(buffer))
+
+    def build_index_prebuild(self, genome, kmer_size=31, prebuild_manager=None):
+        """Build (or reuse) the index via the PrebuildManager.
+
+        Indices are keyed by genome, k-mer size, the accepted_biotypes and
+        the contents of the genome's cdna.fasta and genes.gtf,
+        versioned by the salmon version, and shared across projects and hosts
+        (any version within get_index_version_range is reused).
+        Pass the job as index_job to run_quant_on_raw_lane / run_alevin_on_sample.
+
+        Prebuilds can only depend on other prebuilds, so the index is built
+        from the genome's files (cdna.fasta, genes.gtf, genome.fasta),
+        which must exist when this is called - not from it's jobs.
+        """
+        if prebuild_manager is None:
+            prebuild_manager = get_global_manager()
+        if prebuild_manager is None:  # pragma: no cover
+            raise ValueError("No PrebuildManager passed and no global manager set")
+        kmer_size = int(kmer_size)
+        input_files = [
+            Path(genome.find_file(x))
+            for x in ("cdna.fasta", "genes.gtf", "genome.fasta")
+        ]
+        # cdna and gtf define the transcript selection
+        inputs_md5 = hashlib.md5(
+            "".join(read_md5_sum(x) for x in input_files[:2]).encode("utf-8")
+        ).hexdigest()
+        name = (
+            f"salmon_indices/{genome.name}/"
+            f"k{kmer_size}_{self.get_build_key()}_{inputs_md5[:8]}"
+        )
+        # the calculating function's closure is part of it's invariant -
+        # keep the genome object and the (host specific) paths out of it
+        if not hasattr(self, "_prebuild_inputs"):
+            self._prebuild_inputs = {}
+        self._prebuild_inputs[name] = (genome.name, input_files)
+
+        def build(output_path):
+            genome_name, (cdna, gtf, genome_fasta) = self._prebuild_inputs[name]
+            self.build_index_from_genome(
+                _GenomeFiles(genome_name, cdna, gtf, genome_fasta),
+                output_path,
+                kmer_size,
+            )
+
+        minimum_acceptable_version, maximum_acceptable_version = (
+            self.get_index_version_range()
+        )
+        job = prebuild_manager.prebuild(
+            name,
+            self.version,
+            input_files,
+            [
+                "sentinel.txt",
+                "gene_transcript.mapping",
+                "mt.genes",
+                "rrna.genes",
+                "transcripts.hash",
+            ],
+            build,
+            minimum_acceptable_version=minimum_acceptable_version,
+            maximum_acceptable_version=maximum_acceptable_version,
+        )
+        job.cores_needed = -1
+        job.index_path = job.output_path
+        return job
+
+    def build_index_from_genome(self, genome, output_fileprefix, kmer_size=31):
         output_dir = Path(output_fileprefix)
         output_key = self.get_build_key()
         output_dir.mkdir(parents=True, exist_ok=True)
-        temp_dir = Path("cache") / "salmon" / genome.name / output_key
-        temp_dir.mkdir(parents=True, exist_ok=True)
 
+        selected = self._select_transcripts(genome)
+        transcript_set_hash = self._get_transcript_set_hash(
+            genome, selected, kmer_size
+        )
+        hash_file = output_dir / "transcripts.hash"
+        if (
+            hash_file.exists()
+            and hash_file.read_text() == transcript_set_hash
+            and (output_dir / "sentinel.txt").exists()
+            and (output_dir / "index").exists()
+        ):
+            # same transcripts, same index - nothing to do
+            return
+        if hash_file.exists():
+            hash_file.unlink()
+
+        selected.to_csv(
+            output_dir / "gene_transcript.mapping", sep="\t", header=False
+        )
+        genes_out = set(selected.values)
+        df_genes = genome.df_genes
+        in_genes_out = df_genes.index.isin(genes_out)
+        with open(output_dir / "mt.genes", "w") as op:
+            for gene_stable_id in df_genes.index[
+                df_genes["name"].str.startswith("MT-") & in_genes_out
+            ]:
+                op.write(gene_stable_id + "\n")
+        with open(output_dir / "rrna.genes", "w") as op:
+            for gene_stable_id in df_genes.index[
+                (df_genes["biotype"] == "rRNA") & in_genes_out
+            ]:
+                op.write(gene_stable_id + "\n")
+
+        records = self._iter_transcript_sequences(genome, selected)
+        if self.index_via_fifo:
+            # salmon reads the transcripts while they are being generated,
+            # from a named pipe on local disk
+            temp_dir = Path(tempfile.mkdtemp(prefix="mbf_salmon_"))
+        else:
+            temp_dir = Path("cache") / "salmon" / genome.name / output_key
+            temp_dir.mkdir(parents=True, exist_ok=True)
+        tf_cdna = temp_dir / "transcripts.fasta"
         try:
-            tf_cdna = open(temp_dir / "transcripts.fasta", "w")
-            of_mapping = open(output_dir / "gene_transcript.mapping", "w")
-
-            to_output = set()
-            genes_out = set()
-
-            for transcript in genome.transcripts.values():
-                if (
-                    self.accepted_biotypes is None
-                    or transcript.biotype in self.accepted_biotypes
-                ):
-                    to_output.add(transcript.transcript_stable_id)
-                    genes_out.add(transcript.gene_stable_id)
-                    of_mapping.write(
-                        f"{transcript.transcript_stable_id}\t{transcript.gene_stable_id}\n"
-                    )
+            if self.index_via_fifo:
+
+                def feed(op):
+                    text = io.TextIOWrapper(op, encoding="utf-8")
+                    self._write_fasta(records, text)
+                    text.flush()
+                    text.detach()
 
-            seen = set()
-            # iterating the fasta once is much faster than random accessing for each and every transcript
-            with pysam.FastxFile(genome.find_file("cdna.fasta")) as f:
-                for entry in f:
-                    name = entry.name
-                    if not name in to_output and "." in name:
-                        name = name[: name.rfind(".")]
-                    if name in to_output:
-                        tf_cdna.write(f">{name}\n{entry.sequence}\n")
-                        seen.add(name)
-            if not seen:
-                raise ValueError("non seen", entry.name)
-            for transcript_stable_id in to_output.difference(seen):
-                mrna = genome.transcripts[transcript_stable_id].mrna
-                tf_cdna.write(f">{transcript_stable_id}\n{mrna}\n")
-
-            with open(output_fileprefix / "mt.genes", "w") as op:
-                for gene_stable_id in genome.df_genes.index[
-                    genome.df_genes["name"].str.startswith("MT-")
-                ]:
-                    if gene_stable_id in genes_out:
-                        op.write(gene_stable_id + "\n")
-            with open(output_fileprefix / "rrna.genes", "w") as op:
-                for gene_stable_id in genome.df_genes.index[
-                    genome.df_genes["biotype"] == "rRNA"
-                ]:
-                    if gene_stable_id in genes_out:
-                        op.write(gene_stable_id + "\n")
-
-            tf_cdna.flush()
-            of_mapping.close()
+                input_fifos = [(tf_cdna, feed)]
+            else:
+                with open(tf_cdna, "w") as op:
+                    self._write_fasta(records, op)
+                input_fifos = None
             run_func = self.get_run_func(
-                output_fileprefix,
+                output_dir,
                 [
                     "index",
                     "-i",
                     str((output_dir / "index").absolute()),
                     "-k",
-                    "31",
+                    str(kmer_size),
                     "--transcripts",
-                    str(Path(tf_cdna.name).absolute()),
+                    str(tf_cdna.absolute()),
                 ],
+                input_fifos=input_fifos,
             )
             run_func()
-
         finally:
-            tf_cdna.close()
-            # os.unlink(tf_cdna.name)
-            of_mapping.close()
+            if tf_cdna.exists():
+                tf_cdna.unlink()
+            if self.index_via_fifo:
+                temp_dir.rmdir()
+        hash_file.write_text(transcript_set_hash)
 
     def get_latest_version(self):
         return self.latest_version
@@ -140,7 +281,11 @@ class Salmon(ExternalAlgorithm):
         method,
         dumpMtx=False,
         dumpFeatures=True,
+        cores=None,
+        index_job=None,
     ):
+        """@cores: threads for alevin, see get_cores_to_use,
+        @index_job: see _get_index_job"""
         allowed_methods = (
             "chromium",
             "chromuimV3",
@@ -153,7 +298,7 @@ class Salmon(ExternalAlgorithm):
         if not method in allowed_methods:
             raise ValueError("method must be one of {allowed_methods}")
         output_path = Path(output_path)
-        index_path = genome.build_index(self).output_path
+        index_path = self._get_index_job(genome, index_job).output_path
         r1s = []
         r2s = []
         try:
@@ -200,21 +345,51 @@ class Salmon(ExternalAlgorithm):
         if dumpFeatures:
             cmd.append("--dumpFeatures")
 
-        self.get_run_func(output_path, cmd)()
+        self.get_run_func(output_path, cmd, ncores=cores)()
+
+    def _get_index_job(self, genome, index_job=None):
+        """The job providing the index - @index_job if passed
+        (e.g. build_index_prebuild(genome)), otherwise genome.build_index"""
+        if index_job is None:
+            index_job = genome.build_index(self)
+        return index_job
+
+    def _index_deps(self, index_job):
+        """index_job and (for prebuilt indices) it's prefetch_job"""
+        if hasattr(index_job, "prefetch_job"):
+            return [index_job, index_job.prefetch_job()]
+        return [index_job]
 
-    def run_alevin_on_sample(self, lane, genome, method):
+    def run_alevin_on_sample(
+        self, lane, genome, method, cores=None, memory_needed=None, index_job=None
+    ):
+        """@cores is the number of cores the job claims from ppg and passes
+        to alevin (default: default_cores, capped at the available cores),
+        @memory_needed is set on the job
+        if given, @index_job: see _get_index_job"""
         output = Path("results/alevin/") / lane.name
+        index_job = self._get_index_job(genome, index_job)
+        # ppg refuses jobs claiming more cores than the machine has
+        cores = self.get_cores_to_use(self.default_cores if cores is None else cores)
 
         def run_alevin():
             output.mkdir(exist_ok=True, parents=True)
             self.run_alevin(
-                output, [lane.get_aligner_input_filenames()], genome, method
+                output,
+                [lane.get_aligner_input_filenames()],
+                genome,
+                method,
+                cores=cores,
+                index_job=index_job,
             )
             (output / "sentinel.txt").write_text("done")
 
         job = ppg.FileGeneratingJob(output / "sentinel.txt", run_alevin).depends_on(
-            genome.build_index(self), lane.prepare_input()
+            self._index_deps(index_job), lane.prepare_input()
         )
+        job.cores_needed = cores
+        if memory_needed is not None:
+            job.memory_needed = memory_needed
 
         def run_qc():
             (output / "QC").mkdir(exist_ok=True)
@@ -236,25 +411,62 @@ class Salmon(ExternalAlgorithm):
         return job, qc_job
 
     def run_quant_on_raw_lane(
-        self, lane, genome, libtype, options=None, gene_level=False
+        self,
+        lane,
+        genome,
+        libtype,
+        options=None,
+        gene_level=False,
+        cores=None,
+        memory_needed=None,
+        index_job=None,
     ):
+        """@cores is the number of cores the job claims from ppg and passes
+        to salmon (default: default_cores, capped at the available cores),
+        @memory_needed is set on the job
+        if given, @index_job: see _get_index_job"""
         output = Path(f"results/{self.name}/quant/") / lane.name
+        index_job = self._get_index_job(genome, index_job)
+        # ppg refuses jobs claiming more cores than the machine has
+        cores = self.get_cores_to_use(self.default_cores if cores is None else cores)
 
         def run_quant():
             output.mkdir(exist_ok=True, parents=True)
-            self.run_quant(output, lane, genome, libtype, options, gene_level)
+            self.run_quant(
+                output,
+                lane,
+                genome,
+                libtype,
+                options,
+                gene_level,
+                cores=cores,
+                index_job=index_job,
+            )
             (output / "sentinel.txt").write_text("done")
 
         job = ppg.FileGeneratingJob(output / "sentinel.txt", run_quant).depends_on(
-            genome.build_index(self), lane.prepare_input()
+            self._index_deps(index_job), lane.prepare_input()
         )
+        job.cores_needed = cores
+        if memory_needed is not None:
+            job.memory_needed = memory_needed
         return job
 
     def run_quant(
-        self, outputpath, lane, genome, libtype, options=None, gene_level=False
+        self,
+        outputpath,
+        lane,
+        genome,
+        libtype,
+        options=None,
+        gene_level=False,
+        cores=None,
+        index_job=None,
     ):
+        """@cores: threads for salmon, see get_cores_to_use,
+        @index_job: see _get_index_job"""
         output_path = Path(outputpath)
-        index_path = genome.build_index(self).output_path
+        index_path = self._get_index_job(genome, index_job).output_path
         aligner_input = lane.get_aligner_input_filenames()
         cmd = ["quant", "-i", str(index_path / "index"), "-l", libtype]
         if gene_level:
@@ -275,4 +487,336 @@ class Salmon(ExternalAlgorithm):
                 cmd.extend([key, options[key]])
         print(" ".join(cmd))
         print(self.path)
-        self.get_run_func(output_path, cmd)()
+        self.get_run_func(output_path, cmd, ncores=cores)()
+
+
+class _GenomeFiles:
+    """Just enough of a genome for build_index_from_genome,
+    read from it's cdna.fasta, genes.gtf and genome.fasta"""
+
+    def __init__(self, name, cdna_fasta, gtf, genome_fasta):
+        self.name = name
+        self._files = {
+            "cdna.fasta": Path(cdna_fasta),
+            "genes.gtf": Path(gtf),
+            "genome.fasta": Path(genome_fasta),
+        }
+        self._df_genes = None
+        self._df_transcripts = None
+        self._exons = None
+        self._transcripts = None
+
+    def find_file(self, name):
+        return self._files[name]
+
+    def _parse_gtf(self):
+        import gzip
+        import re
+        import pandas as pd
+
+        attribute_re = re.compile(r'(\S+) "([^"]*)"')
+        genes = {}
+        transcripts = {}
+        exons = {}
+        fn = self._files["genes.gtf"]
+        opener = gzip.open if fn.name.endswith(".gz") else open
+        with opener(fn, "rt") as op:
+            for line in op:
+                if line.startswith("#"):
+                    continue
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) < 9 or parts[2] not in ("gene", "transcript", "exon"):
+                    continue
+                attributes = dict(attribute_re.findall(parts[8]))
+                if parts[2] == "gene":
+                    genes[attributes["gene_id"]] = (
+                        attributes.get("gene_name", attributes["gene_id"]),
+                        attributes.get("gene_biotype", attributes.get("gene_type")),
+                    )
+                elif parts[2] == "transcript":
+                    transcripts[attributes["transcript_id"]] = (
+                        attributes["gene_id"],
+                        attributes.get(
+                            "transcript_biotype", attributes.get("transcript_type")
+                        ),
+                    )
+                else:
+                    exons.setdefault(attributes["transcript_id"], []).append(
+                        # 0-based, half open, like pysam
+                        (parts[0], int(parts[3]) - 1, int(parts[4]), parts[6])
+                    )
+        self._df_genes = pd.DataFrame(
+            list(genes.values()), index=list(genes.keys()), columns=["name", "biotype"]
+        )
+        self._df_transcripts = pd.DataFrame(
+            list(transcripts.values()),
+            index=list(transcripts.keys()),
+            columns=["gene_stable_id", "biotype"],
+        )
+        self._exons = exons
+
+    @property
+    def df_genes(self):
+        if self._df_genes is None:
+            self._parse_gtf()
+        return self._df_genes
+
+    @property
+    def df_transcripts(self):
+        if self._df_transcripts is None:
+            self._parse_gtf()
+        return self._df_transcripts
+
+    @property
+    def transcripts(self):
+        """transcript_stable_id -> object with .mrna (spliced from genome.fasta)"""
+        if self._transcripts is None:
+            if self._exons is None:
+                self._parse_gtf()
+            self._transcripts = _SplicedTranscripts(
+                self._files["genome.fasta"], self._exons
+            )
+        return self._transcripts
+
+
+class _SplicedTranscripts:
+    def __init__(self, genome_fasta, exons):
+        self.genome_fasta = genome_fasta
+        self.exons = exons
+        self._fasta = None
+
+    def __getitem__(self, transcript_stable_id):
+        import types
+        import pysam
+
+        if self._fasta is None:
+            self._fasta = pysam.FastaFile(str(self.genome_fasta))
+        exons = sorted(self.exons[transcript_stable_id], key=lambda x: x[1])
+        seq = "".join(
+            self._fasta.fetch(chr, start, stop) for (chr, start, stop, _) in exons
+        )
+        if exons[0][3] == "-":
+            seq = seq[::-1].translate(str.maketrans("ACGTNacgtn", "TGCANtgcan"))
+        return types.SimpleNamespace(mrna=seq)
+
+
+_quant_sf_dtypes = {
+    "Name": str,
+    "Length": "int64",
+    "EffectiveLength": "float64",
+    "TPM": "float64",
+    "NumReads": "float64",
+}
+
+
+def read_quant_sf(filename, columns=("TPM", "NumReads")):
+    """Read a salmon quant.sf into a DataFrame indexed by transcript (or gene)"""
+    import pandas as pd
+
+    columns = list(columns)
+    return pd.read_csv(
+        filename,
+        sep="\t",
+        index_col=0,
+        usecols=["Name"] + columns,
+        dtype={k: _quant_sf_dtypes[k] for k in ["Name"] + columns},
+        engine="c",
+    )
+
+
+def collect_quant(
+    output_directories,
+    sample_names=None,
+    columns=("TPM", "NumReads"),
+    gene_transcript_mapping=None,
+    cache_filename=None,
+    max_workers=8,
+):
+    """Combine the quant.sf of many run_quant output directories into
+    one transcript x sample matrix per column.
+
+    Returns {column: DataFrame}. If @gene_transcript_mapping
+    (the index's gene_transcript.mapping) is passed, the values
+    are summed up per gene instead.
+
+    If @cache_filename is set, the matrices are kept in a parquet file
+    (needs pyarrow or fastparquet) and only samples whose quant.sf changed
+    (by mtime) are parsed again.
+    """
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor
+
+    columns = list(columns)
+    output_directories = [Path(x) for x in output_directories]
+    if sample_names is None:
+        sample_names = [x.name for x in output_directories]
+    if len(set(sample_names)) != len(sample_names):
+        raise ValueError("sample names must be unique")
+    quant_files = [x / "quant.sf" for x in output_directories]
+    mtimes = [os.stat(x).st_mtime_ns for x in quant_files]
+    meta = {
+        name: [str(qf), mtime]
+        for (name, qf, mtime) in zip(sample_names, quant_files, mtimes)
+    }
+
+    cached = {}
+    if cache_filename is not None:
+        cache_filename = Path(cache_filename)
+        meta_filename = cache_filename.with_name(cache_filename.name + ".json")
+        if cache_filename.exists() and meta_filename.exists():
+            old_meta = json.loads(meta_filename.read_text())
+            fresh = [
+                name
+                for name in sample_names
+                if old_meta.get(name) == meta[name]
+                and old_meta.get("_columns") == columns
+            ]
+            if fresh:
+                df_cache = pd.read_parquet(
+                    cache_filename,
+                    columns=[f"{c}|{name}" for name in fresh for c in columns],
+                )
+                for name in fresh:
+                    cached[name] = df_cache[
+                        [f"{c}|{name}" for c in columns]
+                    ].set_axis(columns, axis=1)
+
+    to_parse = [
+        (name, qf) for (name, qf) in zip(sample_names, quant_files) if name not in cached
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        parsed = pool.map(lambda x: read_quant_sf(x[1], columns), to_parse)
+        for (name, _), df in zip(to_parse, parsed):
+            cached[name] = df
+
+    wide = pd.concat(
+        [cached[name] for name in sample_names], axis=1, keys=sample_names
+    )
+    wide = wide.swaplevel(axis=1)
+    if cache_filename is not None and to_parse:
+        flat = wide.copy()
+        flat.columns = [f"{c}|{name}" for (c, name) in flat.columns]
+        flat.to_parquet(cache_filename)
+        meta["_columns"] = columns
+        meta_filename.write_text(json.dumps(meta))
+
+    result = {c: wide[c][sample_names] for c in columns}
+    if gene_transcript_mapping is not None:
+        mapping = pd.read_csv(
+            gene_transcript_mapping,
+            sep="\t",
+            header=None,
+            index_col=0,
+            names=["transcript_stable_id", "gene_stable_id"],
+            dtype=str,
+        )["gene_stable_id"]
+        result = {
+            c: df.groupby(mapping.reindex(df.index).values).sum()
+            for (c, df) in result.items()
+        }
+    return result
+
+
+def _read_alevin_quants_bin(quant_file, num_cells, num_genes, value_dtype="<f4"):
+    """Stream alevin's sparse binary quants_mat.gz (salmon >= 0.14) into
+    csr arrays. Each cell is stored as a bit vector of the expressed genes
+    (most significant bit first), followed by their values."""
+    import gzip
+    import numpy as np
+
+    value_dtype = np.dtype(value_dtype)
+    num_flag_bytes = (num_genes + 7) // 8
+    indptr = np.zeros(num_cells + 1, dtype=np.int64)
+    indices = []
+    data = []
+    with gzip.open(quant_file, "rb") as f:
+        for ii in range(num_cells):
+            flags = f.read(num_flag_bytes)
+            if len(flags) != num_flag_bytes:
+                raise ValueError(f"{quant_file} ended after {ii} of {num_cells} cells")
+            expressed = np.flatnonzero(
+                np.unpackbits(np.frombuffer(flags, dtype=np.uint8))[:num_genes]
+            )
+            values = np.frombuffer(
+                f.read(len(expressed) * value_dtype.itemsize), dtype=value_dtype
+            )
+            if len(values) != len(expressed):
+                raise ValueError(f"{quant_file} truncated in cell {ii}")
+            indices.append(expressed.astype(np.int32))
+            data.append(values.astype(np.float32))
+            indptr[ii + 1] = indptr[ii] + len(expressed)
+    if indices:
+        return np.concatenate(data), np.concatenate(indices), indptr
+    return np.zeros(0, np.float32), np.zeros(0, np.int32), indptr
+
+
+def read_alevin(output_path, use_cache=True):
+    """Load an alevin quantification (run_alevin's output_path) as
+    (scipy.sparse.csr_matrix cells x genes, barcodes, genes).
+
+    Reads quants_mat.mtx.gz if alevin was run with dumpMtx, the binary
+    quants_mat.gz otherwise. The csr arrays are cached as .npy files in
+    alevin/csr_cache, which are memory mapped on subsequent calls
+    (and invalidated when the quantification changes).
+    """
+    import numpy as np
+    import scipy.sparse
+
+    alevin_dir = Path(output_path) / "alevin"
+    mtx_file = alevin_dir / "quants_mat.mtx.gz"
+    quant_file = mtx_file if mtx_file.exists() else alevin_dir / "quants_mat.gz"
+    cache_dir = alevin_dir / "csr_cache"
+    meta_file = cache_dir / "meta.json"
+    source_key = [str(quant_file.name), os.stat(quant_file).st_mtime_ns]
+
+    if use_cache and meta_file.exists():
+        meta = json.loads(meta_file.read_text())
+        if meta["source"] == source_key:
+            arrays = {
+                name: np.load(cache_dir / f"{name}.npy", mmap_mode="r")
+                for name in ["data", "indices", "indptr"]
+            }
+            matrix = scipy.sparse.csr_matrix(
+                (arrays["data"], arrays["indices"], arrays["indptr"]),
+                shape=tuple(meta["shape"]),
+                copy=False,
+            )
+            barcodes = np.load(cache_dir / "barcodes.npy")
+            genes = np.load(cache_dir / "genes.npy")
+            return matrix, barcodes, genes
+
+    barcodes = np.array(
+        (alevin_dir / "quants_mat_rows.txt").read_text().split(), dtype=str
+    )
+    genes = np.array((alevin_dir / "quants_mat_cols.txt").read_text().split(), dtype=str)
+    if quant_file == mtx_file:
+        import gzip
+        import scipy.io
+
+        with gzip.open(mtx_file, "rb") as f:
+            matrix = scipy.sparse.csr_matrix(scipy.io.mmread(f), dtype=np.float32)
+        data, indices, indptr = matrix.data, matrix.indices, matrix.indptr
+    else:
+        data, indices, indptr = _read_alevin_quants_bin(
+            quant_file, len(barcodes), len(genes)
+        )
+    shape = (len(barcodes), len(genes))
+    # matching index dtypes - otherwise scipy copies one of them
+    index_dtype = np.int32 if max(len(data), len(genes)) < 2 ** 31 else np.int64
+    indices = indices.astype(index_dtype, copy=False)
+    indptr = indptr.astype(index_dtype, copy=False)
+    if use_cache:
+        cache_dir.mkdir(exist_ok=True)
+        if meta_file.exists():
+            meta_file.unlink()
+        for name, array in [
+            ("data", data),
+            ("indices", indices),
+            ("indptr", indptr),
+            ("barcodes", barcodes),
+            ("genes", genes),
+        ]:
+            np.save(cache_dir / f"{name}.npy", array)
+        meta_file.write_text(json.dumps({"source": source_key, "shape": shape}))
+    matrix = scipy.sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+    return matrix, barcodes, genes
@@ -5,6 +5,25 @@ from ..util import download_file
 
 
 class STAR(Aligner):
+    index_profiles = {
+        "fast": [],
+        # sparse suffix arrays trade alignment speed for index memory
+        "balanced": ["--genomeSAsparseD", "2"],
+        "low_memory": [
+            "--genomeSAsparseD",
+            "3",
+            "--genomeSAindexNbases",
+            "12",
+            "--limitGenomeGenerateRAM",
+            str(48 * 1024 ** 3),
+        ],
+    }
+    # STAR reads --readFilesIn exactly once
+    decompress_via_fifo = True
+    fifo_incompatible_parameters = ("--readFilesCommand", "readFilesCommand")
+    # --readMapNumber N stops after N reads
+    fifo_early_stop_parameters = {"--readMapNumber": "-1"}
+
     def __init__(self, version="_last_used", store=None):
         super().__init__(version, store)
 
@@ -26,7 +45,17 @@ class STAR(Aligner):
         index_basename,
         output_bam_filename,
         parameters,
+        preview=None,
     ):
+        if preview:
+            return self.preview_align_job(
+                input_fastq,
+                paired_end_filename,
+                index_basename,
+                output_bam_filename,
+                parameters,
+                preview,
+            )
         cmd = [
             "FROM_ALIGNER",
             str(
@@ -44,6 +73,12 @@ class STAR(Aligner):
         ]
         if ',' in str(input_fastq) or (paired_end_filename and ',' in str(paired_end_filename)):  # pragma: no cover
             raise ValueError("STAR does not handle fastq filenames with a comma")
+        input_fastq, paired_end_filename, input_fifos = self._fifo_inputs(
+            Path(output_bam_filename).parent,
+            input_fastq,
+            paired_end_filename,
+            parameters,
+        )
         if paired_end_filename:
             cmd.extend(
                 [
@@ -68,13 +103,17 @@ class STAR(Aligner):
             cwd=Path(output_bam_filename).parent,
             call_afterwards=rename_after_alignment,
             additional_files_created=[output_bam_filename],
+            input_fifos=input_fifos,
         )
         job.depends_on(
             ppg.ParameterInvariant(output_bam_filename, sorted(parameters.items()))
         )
+        self._depend_on_index_prefetch(job, index_basename)
         return job
 
-    def build_index_func(self, fasta_files, gtf_input_filename, output_fileprefix):
+    def build_index_func(
+        self, fasta_files, gtf_input_filename, output_fileprefix, profile="fast"
+    ):
         if isinstance(fasta_files, (str, Path)):
             fasta_files = [fasta_files]
         if len(fasta_files) > 1:
@@ -96,7 +135,7 @@ class STAR(Aligner):
             Path(fasta_files[0]).absolute(),
             "--sjdbOverhang",
             "100",
-        ]
+        ] + self.get_index_profile_arguments(profile)
         return self.get_run_func(output_fileprefix, cmd, cwd=output_fileprefix)
 
     def get_latest_version(self):
@@ -108,22 +147,28 @@ class STAR(Aligner):
         with open(target_filename, "wb") as op:
             download_file(url, op)
 
+    def get_alignment_stats_filename(self, output_bam_filename):
+        return Path(output_bam_filename).parent / "Log.final.out"
+
     def get_alignment_stats(self, output_bam_filename):
-        target = Path(output_bam_filename).parent / "Log.final.out"
+        target = self.get_alignment_stats_filename(output_bam_filename)
         if not target.exists():  # pragma: no cover
             return {"No data found": 1}
         else:
-            lines = target.read_text().split("\n")
-            lines = [x.split(" |", 1) for x in lines if " |" in x]
-            lookup = {x[0].strip(): x[1].strip() for x in lines}
-            result = {}
-            for k in [
-                "Number of reads mapped to too many loci",
-                "Uniquely mapped reads number",
-                "Number of reads mapped to multiple loci",
-            ]:
-                result[k] = int(lookup[k])
-            result["Unmapped"] = int(lookup["Number of input reads"]) - sum(
-                result.values()
-            )
-            return result
+            return self.parse_alignment_stats(target.read_text())
+
+    def parse_alignment_stats(self, raw):
+        import re
+
+        lookup = dict(re.findall(r"^\s*([^|\n]+?) \|\s*(\S*)", raw, re.MULTILINE))
+        result = {}
+        for k in [
+            "Number of reads mapped to too many loci",
+            "Uniquely mapped reads number",
+            "Number of reads mapped to multiple loci",
+        ]:
+            result[k] = int(lookup[k])
+        result["Unmapped"] = int(lookup["Number of input reads"]) - sum(
+            result.values()
+        )
+        return result
@@ -5,6 +5,13 @@ from ..util import download_file, Version
 
 
 class Subread(Aligner):
+    index_profiles = {
+        "fast": [],
+        # -M is the memory (in MB) subread-buildindex may use - default 8000
+        "balanced": ["-M", "4000"],
+        "low_memory": ["-M", "2000"],
+    }
+
     def __init__(self, version="_last_used", store=None):
         super().__init__(version, store)
 
@@ -29,7 +36,17 @@ class Subread(Aligner):
         index_basename,
         output_bam_filename,
         parameters,
+        preview=None,
     ):
+        if preview:
+            return self.preview_align_job(
+                input_fastq,
+                paired_end_filename,
+                index_basename,
+                output_bam_filename,
+                parameters,
+                preview,
+            )
         if not parameters.get("input_type") in ("dna", "rna"):
             raise ValueError("invalid parameters['input_type'], must be dna or rna")
 
@@ -38,6 +55,9 @@ class Subread(Aligner):
         else:
             input_type = "0"
         output_bam_filename = Path(output_bam_filename)
+        input_fastq, paired_end_filename, input_fifos = self._fifo_inputs(
+            output_bam_filename.parent, input_fastq, paired_end_filename
+        )
         cmd = [
             "FROM_ALIGNER",
             str(
@@ -85,13 +105,17 @@ class Subread(Aligner):
                 # output_bam_filename.with_name(output_bam_filename.name + ".bai"),
             ],
             call_afterwards=remove_bai,
+            input_fifos=input_fifos,
         )
         job.depends_on(
             ppg.ParameterInvariant(output_bam_filename, sorted(parameters.items()))
         )
+        self._depend_on_index_prefetch(job, index_basename)
         return job
 
-    def build_index_func(self, fasta_files, gtf_input_filename, output_fileprefix):
+    def build_index_func(
+        self, fasta_files, gtf_input_filename, output_fileprefix, profile="fast"
+    ):
         cmd = [
             "FROM_ALIGNER",
             str(
@@ -102,7 +126,7 @@ class Subread(Aligner):
             ),
             "-o",
             str((output_fileprefix / "subread_index").absolute()),
-        ]
+        ] + self.get_index_profile_arguments(profile)
         if not hasattr(fasta_files, "__iter__"):
             fasta_files = [fasta_files]
         cmd.extend([str(Path(x).absolute()) for x in fasta_files])
@@ -123,15 +147,22 @@ class Subread(Aligner):
         with open(target_filename, "wb") as op:
             download_file(url, op)
 
+    def get_alignment_stats_filename(self, output_bam_filename):
+        return Path(output_bam_filename).parent / "stderr.txt"
+
     def get_alignment_stats(self, output_bam_filename):
+        target = self.get_alignment_stats_filename(output_bam_filename)
+        return self.parse_alignment_stats(target.read_text())
+
+    def parse_alignment_stats(self, raw):
         import re
 
-        output_bam_filename = Path(output_bam_filename)
-        target = output_bam_filename.parent / "stderr.txt"
-        raw = target.read_text()
         raw = raw[raw.find("= Summary =") :]
+        found = dict(
+            re.findall(r"(Uniquely mapped|Multi-mapping|Unmapped) : (\d+)", raw)
+        )
         result = {}
         keys = "Uniquely mapped", "Multi-mapping", "Unmapped"
         for k in keys:
-            result[k] = int(re.findall(f"{k} : (\\d+)", raw)[0])
+            result[k] = int(found[k])
         return result
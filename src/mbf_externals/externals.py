@@ -5,7 +5,13 @@ import os
 import stat
 from abc import ABC, abstractmethod
 import pypipegraph as ppg
-from .util import lazy_property, sort_versions
+from .util import (
+    lazy_property,
+    sort_versions,
+    FIFOFeeder,
+    touch_last_access,
+    evict_least_recently_used,
+)
 
 _global_store = None
 
@@ -136,11 +142,14 @@ class ExternalAlgorithm(ABC):
         cwd=None,
         call_afterwards=None,
         additional_files_created=None,
+        input_fifos=None,
     ):
         """Return a job that runs the algorithm and puts the
         results in output_directory.
         Note that assigning different ouput_directories to different
         versions is your problem.
+
+        @input_fifos: see get_run_func
         """
         output_directory = Path(output_directory)
         output_directory.mkdir(parents=True, exist_ok=True)
@@ -154,7 +163,11 @@ class ExternalAlgorithm(ABC):
         job = ppg.MultiFileGeneratingJob(
             filenames,
             self.get_run_func(
-                output_directory, arguments, cwd=cwd, call_afterwards=call_afterwards
+                output_directory,
+                arguments,
+                cwd=cwd,
+                call_afterwards=call_afterwards,
+                input_fifos=input_fifos,
             ),
         ).depends_on(
             ppg.FileChecksumInvariant(
@@ -172,7 +185,23 @@ class ExternalAlgorithm(ABC):
             job.cores_needed = -1
         return job
 
-    def get_run_func(self, output_directory, arguments, cwd=None, call_afterwards=None):
+    def get_run_func(
+        self,
+        output_directory,
+        arguments,
+        cwd=None,
+        call_afterwards=None,
+        input_fifos=None,
+        ncores=None,
+    ):
+        """@input_fifos is a list of (fifo_path, feed) - the named pipes are
+        created before the algorithm starts, and filled by calling
+        feed(file_object) in a background thread while it runs
+        (see util.FIFOFeeder). They are removed once the algorithm is done.
+
+        @ncores: cores to pass to build_cmd, see get_cores_to_use
+        """
+
         def do_run():
             self.store.unpack_version(self.name, self.version)
             sentinel = output_directory / "sentinel.txt"
@@ -185,23 +214,30 @@ class ExternalAlgorithm(ABC):
             cmd = [
                 str(x)
                 for x in self.build_cmd(
-                    output_directory,
-                    ppg.util.global_pipegraph.rc.cores_available
-                    if self.multi_core
-                    else 1,
-                    arguments,
+                    output_directory, self.get_cores_to_use(ncores), arguments
                 )
             ]
             cmd_out.write_text(repr(cmd))
             start_time = time.time()
             print(" ".join(cmd))
-            p = subprocess.Popen(cmd, stdout=op_stdout, stderr=op_stderr, cwd=cwd)
-            p.communicate()
-            op_stdout.close()
-            op_stderr.close()
+            feeders = [
+                FIFOFeeder(fifo_path, feed).start()
+                for (fifo_path, feed) in (input_fifos or [])
+            ]
+            try:
+                p = subprocess.Popen(cmd, stdout=op_stdout, stderr=op_stderr, cwd=cwd)
+                p.communicate()
+            finally:
+                op_stdout.close()
+                op_stderr.close()
+                for feeder in feeders:
+                    feeder.finish()
             ok = self.check_success(
                 p.returncode, stdout.read_bytes(), stderr.read_bytes()
             )
+            for feeder in feeders:
+                if ok is True and feeder.exception is not None:
+                    ok = f"Feeding {feeder.fifo_path} failed: {feeder.exception}"
             if ok is True:
                 runtime = time.time() - start_time
                 sentinel.write_text(
@@ -216,6 +252,22 @@ class ExternalAlgorithm(ABC):
 
         return do_run
 
+    def get_cores_to_use(self, cores_needed=None):
+        """Translate a job's cores_needed into the thread count for build_cmd.
+
+        None (the default) means 'all available' for multi_core algorithms,
+        -1 means all available, anything else is capped at the available cores.
+        """
+        if not self.multi_core:
+            return 1
+        if ppg.util.global_pipegraph is not None:
+            available = ppg.util.global_pipegraph.rc.cores_available
+        else:  # e.g. PrebuildManager.build
+            available = os.cpu_count()
+        if cores_needed is None or cores_needed < 0:
+            return available
+        return max(1, min(cores_needed, available))
+
     def check_success(self, return_code, stdout, stderr):
         if return_code == 0:
             return True
@@ -293,11 +345,28 @@ class ExternalAlgorithmStore:
         target_path = self.get_unpacked_path(algorithm_name, version)
         sentinel = target_path / "unpack_done.txt"
         if sentinel.exists():
+            touch_last_access(target_path)
             return
         target_path.mkdir(parents=True, exist_ok=True)
         gzip_path = self.get_zip_file_path(algorithm_name, version)
         subprocess.check_call(["tar", "-xf", gzip_path], cwd=target_path)
         sentinel.write_text("Done")
+        touch_last_access(target_path)
+
+    def garbage_collect(self, size_budget, min_age=30 * 24 * 3600, dry_run=False):
+        """Remove the least recently used unpacked versions until the unpack
+        tree fits @size_budget bytes. The tar.gz in zip_path are kept,
+        so they will simply be unpacked again when needed.
+
+        Versions used within the last @min_age seconds are kept regardless.
+        Returns [(path, size)] of the removed ones.
+        """
+        unpacked = [
+            x.parent for x in self.unpack_path.glob("*/*/unpack_done.txt")
+        ]
+        return evict_least_recently_used(
+            unpacked, size_budget, min_age=min_age, dry_run=dry_run
+        )
 
     def get_unpacked_path(self, algorithm_name, version):
         return self.unpack_path / algorithm_name / version
@@ -5,13 +5,69 @@ experiment and need to be versioned,
 but they can often be shared among versions."""
 
 import socket
-from .util import Version, sort_versions, UpstreamChangedError, write_md5_sum
+from .util import (
+    Version,
+    sort_versions,
+    UpstreamChangedError,
+    write_md5_sums,
+    md5_sum_is_current,
+    prefetch_files,
+    checksum_file,
+    checksum_algorithm,
+    copy_tree,
+    verify_md5_sums,
+    touch_last_access,
+    get_last_access,
+    evict_least_recently_used,
+    get_directory_size,
+)
 import pypipegraph as ppg
 from pathlib import Path
 import time
 import stat
 import os
 import json
+import shutil
+
+
+_function_hash_cache = {}
+_stored_function_hash_cache = {}
+
+
+def _hash_function_cached(function):
+    """ppg.FunctionInvariant._hash_function, memoized for the process.
+
+    Source and disassembly only depend on the code object and are cached,
+    the (cheap) closure is extracted on every call - so closures created
+    per genome share one cache entry"""
+    code = function.__code__
+    key = (code, code.co_filename, getattr(function, "__qualname__", None))
+    if key not in _function_hash_cache:
+        _function_hash_cache[key] = ppg.FunctionInvariant._get_func_hash(
+            id(code), function
+        )
+    source, func_hash = _function_hash_cache[key]
+    return source, func_hash, ppg.FunctionInvariant.extract_closure(function)
+
+
+def _read_stored_function_hash(storage_filename):
+    """Read (and cache by mtime) a stored prebuild function hash.
+    Returns (hash, is_old_format) or None if not stored"""
+    import copy
+
+    stf = Path(storage_filename)
+    stf2 = stf.with_name(stf.name + "2")
+    for fn, old_format in ((stf2, False), (stf, True)):
+        try:
+            st = fn.stat()
+        except OSError:
+            continue
+        key = (str(fn.absolute()), st.st_mtime_ns, st.st_size)
+        if key not in _stored_function_hash_cache:
+            text = fn.read_text()
+            _stored_function_hash_cache[key] = text if old_format else json.loads(text)
+        return copy.deepcopy(_stored_function_hash_cache[key]), old_format
+    return None
 
 
 class PrebuildFunctionInvariantFileStoredExploding(ppg.FunctionInvariant):
@@ -19,75 +75,95 @@ class PrebuildFunctionInvariantFileStoredExploding(ppg.FunctionInvariant):
         self.is_prebuild = True
         super().__init__(storage_filename, func)
 
+    @classmethod
+    def _hash_function(cls, function):
+        return _hash_function_cached(function)
+
     @classmethod
     def hash_function(cls, function):
         new_source, new_funchash, new_closure = cls._hash_function(function)
         return cls._compare_new_and_old(new_source, new_funchash, new_closure, False)
 
     def _get_invariant(self, old, all_invariant_stati):
-        stf = Path(
-            self.job_id
-        )  # the old file format - using just the function's dis-ed code.
-        stf2 = Path(self.job_id).with_name(
-            stf.name + "2"
-        )  # the new style, dict based storage just like FunctionInvariant after 0.190
-        new_source, new_func_hash, new_closure = self._hash_function(self.function)
-        if stf2.exists():
-            old_hash = json.loads(stf2.read_text())
-        elif stf.exists():
-            old_hash = stf.read_text()
-            new_closure = ""
-        else:
-            new_value = self._compare_new_and_old(
-                new_source, new_func_hash, new_closure, False
-            )
-            stf2.write_text(json.dumps(new_value))
-            return old  # signal no change necessary.
-
-        try:
-            new_hash = self._compare_new_and_old(
-                new_source, new_func_hash, new_closure, old_hash
-            )
-            if new_hash != old_hash:
-                self.complain_about_hash_changes(new_hash)
-            else:
-                return old
-        except ppg.NothingChanged as e:
-            # we accept the stuff there as no change.
-            # and we write out the new value, because it might be a format change.
-            try:
-                stf2.write_text(json.dumps(e.new_value))
-            except OSError as e2:
-                if "Read-only file system" in str(e2):
-                    import warnings
-
-                    warnings.warn(
-                        "PrebuildFunctionInvariantFileStoredExploding: Could not update %s to newest version - read only file system"
-                        % stf
-                    )
-            raise e
-        raise NotImplementedError("Should not happen")
+        new_hash, status = _compare_stored_function_hash(self.job_id, self.function)
+        if status == "changed":
+            self.complain_about_hash_changes(new_hash)
+        elif status == "updated":
+            # we accept the stuff there as no change,
+            # but ppg should store the new value (format change)
+            raise ppg.NothingChanged(new_hash)
+        return old  # signal no change necessary.
 
     def complain_about_hash_changes(self, invariant_hash):
-        stf = Path(self.job_id)
+        _raise_function_changed(self.job_id, invariant_hash)
+
+
+def _compare_stored_function_hash(storage_filename, function):
+    """Compare function's hash with the one stored in storage_filename
+    (the old file format - using just the function's dis-ed code)
+    or storage_filename + '2' (the new style, dict based storage just like
+    FunctionInvariant after 0.190). Stores it if there was none.
+
+    Returns (new_hash, status) - status being 'unchanged', 'changed' or
+    'updated' (no change, but the stored value was rewritten in a newer format)
+    """
+    stf = Path(storage_filename)
+    stf2 = stf.with_name(stf.name + "2")
+    new_source, new_func_hash, new_closure = _hash_function_cached(function)
+    stored = _read_stored_function_hash(stf)
+    if stored is None:
+        new_value = ppg.FunctionInvariant._compare_new_and_old(
+            new_source, new_func_hash, new_closure, False
+        )
+        stf2.write_text(json.dumps(new_value))
+        return new_value, "unchanged"
+    old_hash, old_format = stored
+    if old_format:
+        new_closure = ""
+    try:
+        new_hash = ppg.FunctionInvariant._compare_new_and_old(
+            new_source, new_func_hash, new_closure, old_hash
+        )
+    except ppg.NothingChanged as e:
+        # we write out the new value, because it might be a format change.
         try:
-            of = stf.with_name(stf.name + ".changed")
-            of.write_text(json.dumps(invariant_hash))
-        except IOError:  # noqa: E722 pragma: no cover
-            # fallback if the stf directory is not writeable.
-            of = Path(stf.name + ".changed")  # pragma: no cover
-            of.write_text(json.dumps(invariant_hash))  # pragma: no cover
-        raise UpstreamChangedError(
-            (
-                "Calculating function changed.\n"
-                "If you are actively working on it, you need to bump the version:\n"
-                "If not, you need to figure out what's causing the change.\n"
-                "Do not nuke the job info (%s) light heartedly\n"
-                "To compare, run \n"
-                "icdiff %s %s"
-            )
-            % (self.job_id, Path(self.job_id).absolute(), of.absolute())
+            stf2.write_text(json.dumps(e.new_value))
+        except OSError as e2:
+            if "Read-only file system" in str(e2):
+                import warnings
+
+                warnings.warn(
+                    "PrebuildFunctionInvariantFileStoredExploding: Could not update %s to newest version - read only file system"
+                    % stf
+                )
+        return e.new_value, "updated"
+    if new_hash != old_hash:
+        return new_hash, "changed"
+    return new_hash, "unchanged"
+
+
+def _raise_function_changed(storage_filename, invariant_hash):
+    """Store the changed hash next to storage_filename for comparison,
+    and raise UpstreamChangedError"""
+    stf = Path(storage_filename)
+    try:
+        of = stf.with_name(stf.name + ".changed")
+        of.write_text(json.dumps(invariant_hash))
+    except IOError:  # noqa: E722 pragma: no cover
+        # fallback if the stf directory is not writeable.
+        of = Path(stf.name + ".changed")  # pragma: no cover
+        of.write_text(json.dumps(invariant_hash))  # pragma: no cover
+    raise UpstreamChangedError(
+        (
+            "Calculating function changed.\n"
+            "If you are actively working on it, you need to bump the version:\n"
+            "If not, you need to figure out what's causing the change.\n"
+            "Do not nuke the job info (%s) light heartedly\n"
+            "To compare, run \n"
+            "icdiff %s %s"
         )
+        % (storage_filename, stf.absolute(), of.absolute())
+    )
 
 
 class _PrebuildFileInvariantsExploding(ppg.MultiFileInvariant):
@@ -104,31 +180,33 @@ class _PrebuildFileInvariantsExploding(ppg.MultiFileInvariant):
             if not (isinstance(f, str) or isinstance(f, Path)):  # pragma: no cover
                 raise ValueError(f"filenames must be str/path. Was {repr(f)}")
         self.is_prebuild = True
+        self.checksums = None
         ppg.Job.__init__(self, job_id)
 
+    # hash algorithm for changed input files (see util.get_hasher)
+    # md5 keeps the checksums compatible with ppg.util.checksum_file
+    checksum_algorithm = "md5"
+    checksum_workers = 8
+
     def calc_checksums(self, old):
         """return a list of tuples
         (filename, filetime, filesize, checksum)"""
-        result = []
-        if old:
-            old_d = {x[0]: x[1:] for x in old}
-        else:
-            old_d = {}
-        for fn in self.filenames:
-            if not os.path.exists(fn):
-                result.append((fn, None, None, None))
-            else:
-                st = os.stat(fn)
-                filetime = st[stat.ST_MTIME]
-                filesize = st[stat.ST_SIZE]
-                if (
-                    fn in old_d
-                    and (old_d[fn][0] == filetime)
-                    and (old_d[fn][1] == filesize)
-                ):  # we can reuse the checksum
-                    result.append((fn, filetime, filesize, old_d[fn][2]))
-                else:
-                    result.append((fn, filetime, filesize, ppg.util.checksum_file(fn)))
+        result, self.checksum_report = calc_input_checksums(
+            self.filenames, old, self.checksum_algorithm, self.checksum_workers
+        )
+        self.checksums = result  # for the build manifest
+        if self.checksum_report[1] > 200 * 1024 * 1024:
+            import warnings
+
+            warnings.warn(
+                "Checksummed %i prebuild input files (%.1f MB) in %.1fs for %s"
+                % (
+                    self.checksum_report[0],
+                    self.checksum_report[1] / 1024 / 1024,
+                    self.checksum_report[2],
+                    self.job_id,
+                )
+            )
         return result
 
     def _get_invariant(self, old, all_invariant_stati):
@@ -140,18 +218,158 @@ class _PrebuildFileInvariantsExploding(ppg.MultiFileInvariant):
         # elif old is None: # not sure when this would ever happen
         # return checksums
         else:
-            old_d = {x[0]: x[1:] for x in old}
-            checksums_d = {x[0]: x[1:] for x in checksums}
-            for fn in self.filenames:
-                if old_d[fn][2] != checksums_d[fn][2] and old_d[fn][2] is not None:
-                    raise UpstreamChangedError(
-                        """Upstream file changed for job, bump version or rollback.
+            compare_input_checksums(self.filenames, old, checksums, self)
+            raise ppg.ppg_exceptions.NothingChanged(checksums)
+
+
+def calc_input_checksums(filenames, old, algorithm="md5", workers=8):
+    """return a list of tuples
+    (filename, filetime, filesize, checksum),
+    and (files hashed, bytes hashed, seconds taken).
+
+    Checksums in @old (same format) are reused for unchanged
+    (mtime, size) files, all others are hashed in parallel.
+    """
+    result = []
+    if old:
+        old_d = {x[0]: x[1:] for x in old}
+    else:
+        old_d = {}
+    to_hash = []
+    for fn in filenames:
+        if not os.path.exists(fn):
+            result.append((fn, None, None, None))
+        else:
+            st = os.stat(fn)
+            filetime = st[stat.ST_MTIME]
+            filesize = st[stat.ST_SIZE]
+            if (
+                fn in old_d
+                and (old_d[fn][0] == filetime)
+                and (old_d[fn][1] == filesize)
+            ):  # we can reuse the checksum
+                result.append((fn, filetime, filesize, old_d[fn][2]))
+            else:
+                to_hash.append(len(result))
+                result.append((fn, filetime, filesize, None))
+    if not to_hash:
+        return result, (0, 0, 0.0)
+    from concurrent.futures import ThreadPoolExecutor
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        checksums = list(
+            pool.map(lambda ii: checksum_file(result[ii][0], algorithm), to_hash)
+        )
+    for ii, checksum in zip(to_hash, checksums):
+        result[ii] = result[ii][:3] + (checksum,)
+    total_size = sum(result[ii][2] for ii in to_hash)
+    return result, (len(to_hash), total_size, time.time() - start)
+
+
+def compare_input_checksums(filenames, old, new, job):
+    """Raise UpstreamChangedError if any of the files changed between
+    two calc_input_checksums results"""
+    old_d = {x[0]: x[1:] for x in old}
+    new_d = {x[0]: x[1:] for x in new}
+    for fn in filenames:
+        old_checksum = old_d[fn][2] if fn in old_d else None
+        new_checksum = new_d[fn][2]
+        if (
+            old_checksum is not None
+            and new_checksum is not None
+            and checksum_algorithm(old_checksum) != checksum_algorithm(new_checksum)
+        ):
+            # stored with another algorithm - compare like with like
+            new_checksum = checksum_file(fn, checksum_algorithm(old_checksum))
+        if old_checksum != new_checksum and old_checksum is not None:
+            raise UpstreamChangedError(
+                """Upstream file changed for job, bump version or rollback.
 Job: %s
 File: %s"""
-                        % (self, fn)
-                    )
-                    # return checksums
-            raise ppg.ppg_exceptions.NothingChanged(checksums)
+                % (job, fn)
+            )
+
+
+def _run_calculation(
+    calc_function, output_path, output_files, lease, input_checksums=None
+):
+    """Call calc_function, write md5 sidecars, the build manifest
+    and mbf.done (=output_files[-1])"""
+    import resource
+
+    built_elsewhere = None
+    if lease is not None:
+        built_elsewhere = lease.wait_or_acquire(output_path)
+    success = False
+    try:
+        if built_elsewhere is not None and _finished_build_matches(
+            built_elsewhere, calc_function, input_checksums
+        ):
+            # another host built it meanwhile - copy instead of building again
+            _copy_finished_build(built_elsewhere, output_path)
+            output_files[-1].write_text(str(time.time()))
+            return
+        # (if it was built from other code or inputs, we build it ourselves -
+        # without the lease, it's holder is done)
+        start = time.time()
+        usage_self = resource.getrusage(resource.RUSAGE_SELF)
+        usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        calc_function(output_path)
+        wall_time = time.time() - start
+        cpu_time = 0
+        max_rss = {}
+        for who, before in (
+            ("self", usage_self),
+            ("children", usage_children),
+        ):
+            after = resource.getrusage(
+                resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN
+            )
+            cpu_time += (after.ru_utime - before.ru_utime) + (
+                after.ru_stime - before.ru_stime
+            )
+            # getrusage only knows lifetime maxima: of the building process
+            # (including what it did before the build) and of the largest
+            # child process waited for (e.g. the external tool)
+            max_rss[who] = after.ru_maxrss * 1024  # linux: kb
+        # files written via util.HashingWriter already have their sidecar,
+        # the rest is hashed in parallel
+        write_md5_sums(
+            [
+                fn
+                for fn in output_files[:-1]
+                if os.path.exists(fn) and not md5_sum_is_current(fn, start)
+            ]
+        )
+        new_source, new_funchash, new_closure = _hash_function_cached(calc_function)
+        manifest = {
+            "build_host": socket.gethostname(),
+            "built": time.time(),
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "max_rss_self": max_rss["self"],
+            "max_rss_children": max_rss["children"],
+            # the whole tree - declared output_files are often just
+            # sentinels next to the actual index
+            "outputs": _output_tree_sizes(output_path),
+            "output_size": get_directory_size(output_path),
+            "input_checksums": [[str(x[0])] + list(x[1:]) for x in input_checksums]
+            if input_checksums is not None
+            else None,
+            "function_hash": ppg.FunctionInvariant._compare_new_and_old(
+                new_source, new_funchash, new_closure, False
+            ),
+        }
+        (Path(output_path) / "mbf_manifest.json").write_text(
+            json.dumps(manifest, indent=2)
+        )
+        # mbf.done must come last - it signals 'complete' to other hosts
+        output_files[-1].write_text(str(time.time()))
+        success = True
+    finally:
+        if lease is not None:
+            lease.release(output_path if success else None)
 
 
 class PrebuildJob(ppg.MultiFileGeneratingJob):
@@ -186,16 +404,67 @@ class PrebuildJob(ppg.MultiFileGeneratingJob):
         self.real_callback = calc_function
         self.is_prebuild = True
 
+        self.lease = None  # see PrebuildManager.prebuild
+
+        self.input_invariant = None  # see PrebuildManager.prebuild
+
+        # copy another host's build into the local cache instead of building,
+        # see PrebuildManager.prebuild
+        self.replicate = None
+
         def calc():
-            self.real_callback(output_path)
-            output_files[-1].write_text(str(time.time()))
-            for fn in output_files[:-1]:
-                if os.path.exists(fn):
-                    write_md5_sum(fn)
+            if self.replicate is not None:
+                self.replicate()
+                return
+            input_checksums = None
+            if self.input_invariant is not None:
+                input_checksums = self.input_invariant.checksums
+            _run_calculation(
+                self.real_callback,
+                output_path,
+                output_files,
+                self.lease,
+                input_checksums,
+            )
 
         super().__init__(output_files, calc, rename_broken=True, empty_ok=True)
         self.output_path = output_path
 
+    def prefetch(self, max_bytes=None):
+        """Read ahead the prebuild's files into the page cache in the
+        background. Returns the thread, or None if the prebuild is not done yet
+        (in which case the freshly written files are cached anyway).
+        Within a pipegraph, have consumers depend on prefetch_job() instead"""
+        return _prefetch_output_path(self.output_path, max_bytes)
+
+    def prefetch_job(self, max_bytes=None):
+        """A job prefetching this prebuild - make the consumers depend on it.
+
+        It is a TempFileGeneratingJob: it only runs if a consumer needs to run,
+        and it is ready to run as soon as the prebuild is done - so the index
+        is read ahead while the consumers' other inputs are still being
+        prepared. posix_fadvise only schedules the reads, so it's quick.
+        """
+        import hashlib
+
+        sentinel = (
+            Path("cache")
+            / "prebuild_prefetch"
+            / hashlib.md5(str(self.output_path.absolute()).encode("utf-8")).hexdigest()
+        )
+
+        def prefetch():
+            sentinel.parent.mkdir(parents=True, exist_ok=True)
+            thread = self.prefetch(max_bytes)
+            if thread is not None:
+                thread.join()
+            sentinel.write_text(str(self.output_path))
+
+        job = ppg.TempFileGeneratingJob(sentinel, prefetch)
+        job.ignore_code_changes()  # never a reason to rerun the consumers
+        job.depends_on(self)
+        return job
+
     def depends_on_func(self, name, func):
         job = PrebuildFunctionInvariantFileStoredExploding(
             self.output_path / ("%s.md5sum" % (name,)), func
@@ -246,45 +515,565 @@ class PrebuildJob(ppg.MultiFileGeneratingJob):
             raise KeyError("file not found: %s" % output_filename)
 
 
+class _BuildLease:
+    """A lock file (prebuilt_path/.leases/name/version.lease) announcing
+    that one host is building name/version, so others wait for it instead of
+    building it again - whatever output path they resolved to.
+
+    Acquisition is an O_EXCL create of the lock file. The holder keeps
+    touching it, leases not touched for @expiry seconds are considered
+    abandoned and broken by renaming them away (which only one host can do).
+    After a successful build, version.built records where it was built.
+    """
+
+    poll_interval = 10
+
+    def __init__(self, prebuilt_path, hostname, name, version, expiry=900):
+        self.filename = Path(prebuilt_path) / ".leases" / name / (version + ".lease")
+        self.built_filename = self.filename.with_name(version + ".built")
+        self.hostname = hostname
+        self.expiry = expiry
+        self.held = False
+        self.nonce = None
+        self._stop_heartbeat = None
+
+    def read(self):
+        """The current lease as dict(host, pid, output_path, nonce) - None if
+        there is no lease or it expired"""
+        try:
+            if time.time() - os.stat(self.filename).st_mtime > self.expiry:
+                return None
+            return json.loads(self.filename.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _break_stale(self):
+        """Remove an expired lease. Renaming is atomic, so of several hosts
+        breaking the same lease only one succeeds"""
+        try:
+            if time.time() - os.stat(self.filename).st_mtime <= self.expiry:
+                return
+        except OSError:
+            return
+        grave = self.filename.with_name(
+            self.filename.name + ".stale_%s_%i" % (self.hostname, os.getpid())
+        )
+        try:
+            os.rename(self.filename, grave)
+        except OSError:  # someone else broke it
+            return
+        try:
+            if time.time() - os.stat(grave).st_mtime <= self.expiry:
+                # raced with a fresh lease - put it back (unless replaced already)
+                try:
+                    os.link(grave, self.filename)
+                except OSError:  # pragma: no cover
+                    pass
+        finally:
+            os.unlink(grave)
+
+    def acquire(self, output_path):
+        import threading
+        import uuid
+
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self._break_stale()
+        try:
+            fd = os.open(str(self.filename), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        self.nonce = uuid.uuid4().hex
+        with os.fdopen(fd, "w") as op:
+            op.write(
+                json.dumps(
+                    {
+                        "host": self.hostname,
+                        "pid": os.getpid(),
+                        "output_path": str(Path(output_path).absolute()),
+                        "nonce": self.nonce,
+                    }
+                )
+            )
+        self.held = True
+        self._stop_heartbeat = threading.Event()
+
+        def heartbeat(stop):
+            while not stop.wait(self.expiry / 4):
+                try:
+                    os.utime(self.filename)
+                except OSError:  # pragma: no cover
+                    pass
+
+        threading.Thread(
+            target=heartbeat, args=(self._stop_heartbeat,), daemon=True
+        ).start()
+        return True
+
+    def release(self, built_path=None):
+        """Give up the lease - recording @built_path as finished build if set"""
+        if self.held:
+            self._stop_heartbeat.set()
+            if built_path is not None:
+                temp = self.built_filename.with_name(
+                    self.built_filename.name + ".%s_%i" % (self.hostname, os.getpid())
+                )
+                temp.write_text(
+                    json.dumps({"output_path": str(Path(built_path).absolute())})
+                )
+                os.replace(temp, self.built_filename)
+            current = self.read()
+            if current is not None and current.get("nonce") == self.nonce:
+                try:
+                    self.filename.unlink()
+                except OSError:  # pragma: no cover
+                    pass
+            self.held = False
+
+    def built_elsewhere(self, output_path):
+        """Path of a finished build of name/version in another directory, or None"""
+        try:
+            built = Path(json.loads(self.built_filename.read_text())["output_path"])
+        except (OSError, ValueError, KeyError):
+            return None
+        if built != Path(output_path).absolute() and (built / "mbf.done").exists():
+            return built
+        return None
+
+    def wait_or_acquire(self, output_path):
+        """Either acquire the lease (returns None - go and build),
+        or wait for the current holder to finish and return the path
+        it built into. Should the holder fail, we try to acquire it again."""
+        while True:
+            built = self.built_elsewhere(output_path)
+            if built is not None:
+                return built
+            if self.acquire(output_path):
+                # it might have been finished just before we got the lease
+                built = self.built_elsewhere(output_path)
+                if built is not None:
+                    self.release()
+                    return built
+                return None
+            time.sleep(self.poll_interval)
+
+
+def _finished_build_matches(source, calc_function, input_checksums):
+    """Was the finished prebuild in source built by the same calculating
+    function from the same input files (according to it's manifest)?"""
+    try:
+        manifest = json.loads((Path(source) / "mbf_manifest.json").read_text())
+    except (OSError, ValueError):
+        return False
+    if manifest.get("function_hash") is None:
+        return False
+    new_source, new_funchash, new_closure = _hash_function_cached(calc_function)
+    try:
+        ppg.FunctionInvariant._compare_new_and_old(
+            new_source, new_funchash, new_closure, manifest["function_hash"]
+        )
+        return False
+    except ppg.NothingChanged:
+        pass
+    if input_checksums is None:
+        return True
+    stored = manifest.get("input_checksums")
+    if stored is None or len(stored) != len(input_checksums):
+        return False
+    # by position - paths and mtimes may well differ between hosts
+    for (_, _, _, old_checksum), (fn, _, _, new_checksum) in zip(
+        stored, input_checksums
+    ):
+        if (
+            old_checksum is not None
+            and new_checksum is not None
+            and checksum_algorithm(old_checksum) != checksum_algorithm(new_checksum)
+        ):
+            new_checksum = checksum_file(fn, checksum_algorithm(old_checksum))
+        if old_checksum != new_checksum:
+            return False
+    return True
+
+
+def _is_function_storage(filename):
+    """The stored hash of a calculating function (or further_function_deps),
+    e.g. mbf_func.md5sum(2) - as opposed to the md5 sidecar of an output file"""
+    filename = Path(filename)
+    return filename.name.endswith(".md5sum2") or (
+        filename.name.endswith(".md5sum") and not filename.with_suffix("").exists()
+    )
+
+
+def _copy_finished_build(source, output_path):
+    """Copy a finished prebuild (but it's mbf.done and function hashes,
+    which belong to the local invariants) to output_path,
+    and verify the copy"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    source = Path(source)
+    output_path = Path(output_path)
+    files = [
+        fn
+        for fn in source.glob("**/*")
+        if fn.is_file()
+        and fn.name not in ("mbf.done", ".mbf_last_access")
+        and not (fn.parent == source and _is_function_storage(fn))
+    ]
+
+    def copy(fn):
+        target = output_path / fn.relative_to(source)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(fn, target)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(copy, files))
+    verify_md5_sums(output_path)
+
+
 class PrebuildManager:
-    def __init__(self, prebuilt_path, hostname=None):
+    def __init__(
+        self,
+        prebuilt_path,
+        hostname=None,
+        version_index_filename=None,
+        local_cache_path=None,
+        local_cache_size=None,
+        lease_expiry=900,
+        local_cache_min_age=3600,
+    ):
+        """@version_index_filename: optional json file to persist the
+        (host, name) -> versions index between processes
+
+        @local_cache_path: if set, finished prebuilds found on other hosts
+        are copied (and verified) there, and used from there.
+        @local_cache_size: size budget in bytes for the local cache,
+        least recently used prebuilds are evicted beyond it - except those
+        resolved by this manager, or used within @local_cache_min_age seconds
+        (by other processes).
+        Within a pipegraph, the copy is made by the prebuild's job.
+
+        @lease_expiry: seconds after which a build lease of a host
+        that stopped updating it is considered abandoned
+        """
+        self.lease_expiry = lease_expiry
         self.prebuilt_path = Path(prebuilt_path)
+        self.local_cache_path = (
+            Path(local_cache_path).absolute() if local_cache_path else None
+        )
+        self.local_cache_size = local_cache_size
+        self.local_cache_min_age = local_cache_min_age
+        # local cache paths resolved by this manager, see _evict_local_cache
+        self._paths_in_use = set()
         self.hostname = hostname if hostname else socket.gethostname()
         (self.prebuilt_path / self.hostname).mkdir(exist_ok=True)
+        self.version_index_filename = (
+            Path(version_index_filename) if version_index_filename else None
+        )
+        # (host, name) -> (mtime_ns of prebuilt_path/host/name, {version: done})
+        self._version_index = {}
+        self._hosts = None  # (mtime_ns of prebuilt_path, [hosts])
+        if self.version_index_filename and self.version_index_filename.exists():
+            try:
+                for host, name, mtime, versions in json.loads(
+                    self.version_index_filename.read_text()
+                ):
+                    self._version_index[host, name] = (mtime, versions)
+            except ValueError:  # pragma: no cover - corrupt index, just rescan
+                pass
+
+    def _get_hosts(self):
+        mtime = os.stat(self.prebuilt_path).st_mtime_ns
+        if self._hosts is None or self._hosts[0] != mtime:
+            self._hosts = (
+                mtime,
+                sorted(
+                    p.name
+                    for p in os.scandir(self.prebuilt_path)
+                    if p.is_dir() and not p.name.startswith(".")
+                ),
+            )
+        return self._hosts[1]
+
+    def _scan_host(self, host, name):
+        """Return {version: done} for host/name,
+        rescanning only if the directory changed"""
+        path = self.prebuilt_path / host / name
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return {}
+        cached = self._version_index.get((host, name))
+        if cached is not None and cached[0] == mtime:
+            versions = dict(cached[1])
+            for v, done in versions.items():
+                if not done:  # might have finished since
+                    versions[v] = (path / v / "mbf.done").exists()
+        else:
+            versions = {
+                v.name: (path / v.name / "mbf.done").exists()
+                for v in os.scandir(path)
+                if v.is_dir()
+            }
+        if cached is None or cached != (mtime, versions):
+            self._version_index[host, name] = (mtime, versions)
+            self._version_index_changed = True
+        return versions
 
     def _find_versions(self, name):
-        result = {}
-        dirs_to_consider = [
-            p
-            for p in self.prebuilt_path.glob("*")
-            if (p / name).exists() and p.name != self.hostname
-        ]
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._version_index_changed = False
+        hosts = [h for h in self._get_hosts() if h != self.hostname]
         # prefer versions from this host - must be last!
-        dirs_to_consider.append(self.prebuilt_path / self.hostname)
-        for p in dirs_to_consider:
-            for v in (p / name).glob("*"):
-                if (v / "mbf.done").exists():
-                    result[v.name] = v
+        hosts.append(self.hostname)
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            found = list(pool.map(lambda host: self._scan_host(host, name), hosts))
+        result = {}
+        for host, versions in zip(hosts, found):
+            for v, done in versions.items():
+                if done:
+                    result[v] = self.prebuilt_path / host / name / v
+        if self._version_index_changed and self.version_index_filename:
+            self._save_version_index()
         return result
 
-    def prebuild(  # noqa: C901
+    def _save_version_index(self):
+        # per process - several processes (on several hosts) may share the index
+        tf = self.version_index_filename.with_name(
+            self.version_index_filename.name
+            + ".temp_%s_%i" % (self.hostname, os.getpid())
+        )
+        try:
+            tf.write_text(
+                json.dumps(
+                    [
+                        [host, name, mtime, versions]
+                        for (host, name), (mtime, versions) in self._version_index.items()
+                    ]
+                )
+            )
+            os.replace(tf, self.version_index_filename)
+        except OSError:  # pragma: no cover - the index is just an optimization
+            try:
+                tf.unlink()
+            except OSError:
+                pass
+
+    def _local_cache_target(self, output_path):
+        return self.local_cache_path / output_path.relative_to(self.prebuilt_path)
+
+    def _replicate_to_local_cache(self, output_path):
+        """Copy a finished prebuild into the local cache (once),
+        verify it against it's .md5sum files and return the local path"""
+        target = self._local_cache_target(output_path)
+        if not (target / "mbf.done").exists():
+            temp = target.with_name(target.name + ".copying_%i" % os.getpid())
+            if temp.exists():  # pragma: no cover
+                shutil.rmtree(temp)
+            temp.parent.mkdir(parents=True, exist_ok=True)
+            copy_tree(output_path, temp)
+            try:
+                verify_md5_sums(temp)
+            except ValueError:
+                shutil.rmtree(temp)
+                raise
+            if target.exists():  # pragma: no cover - a half finished copy
+                shutil.rmtree(target)
+            temp.rename(target)
+        touch_last_access(target)
+        if self.local_cache_size is not None:
+            self._evict_local_cache(keep=target)
+        return target
+
+    def inventory(self):
+        """All finished prebuilds across hosts as a DataFrame -
+        one row per prebuild, with the build cost recorded in it's
+        mbf_manifest.json (NaN for builds predating manifests)"""
+        import pandas as pd
+        from concurrent.futures import ThreadPoolExecutor
+
+        paths = []
+        for host in self._get_hosts():
+            paths.extend(find_prebuilt_directories(self.prebuilt_path / host))
+
+        def describe(path):
+            parts = path.relative_to(self.prebuilt_path).parts
+            row = {
+                "host": parts[0],
+                "name": "/".join(parts[1:-1]),
+                "version": parts[-1],
+                "path": path,
+                "last_access": get_last_access(path),
+            }
+            try:
+                manifest = json.loads((path / "mbf_manifest.json").read_text())
+            except (OSError, ValueError):
+                manifest = {}
+            for key in (
+                "build_host",
+                "built",
+                "wall_time",
+                "cpu_time",
+                "max_rss_self",
+                "max_rss_children",
+            ):
+                row[key] = manifest.get(key, None)
+            if "output_size" in manifest:
+                row["output_size"] = manifest["output_size"]
+            elif "outputs" in manifest:
+                row["output_size"] = sum(manifest["outputs"].values())
+            else:
+                row["output_size"] = None
+            row["input_count"] = (
+                len(manifest["input_checksums"])
+                if manifest.get("input_checksums") is not None
+                else None
+            )
+            return row
+
+        columns = [
+            "host",
+            "name",
+            "version",
+            "path",
+            "last_access",
+            "build_host",
+            "built",
+            "wall_time",
+            "cpu_time",
+            "max_rss_self",
+            "max_rss_children",
+            "output_size",
+            "input_count",
+        ]
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            rows = list(pool.map(describe, paths))
+        return pd.DataFrame(rows, columns=columns)
+
+    def export_archive(self, name, version, archive_filename, compresslevel=1):
+        """Pack the finished prebuild name/version (from any host) into one
+        zip archive - outputs, md5 sidecars, function hashes and mbf.done
+        (which is stored last)"""
+        import zipfile
+
+        available_versions = self._find_versions(name)
+        if version not in available_versions:
+            raise ValueError("No finished prebuild %s %s found" % (name, version))
+        source = available_versions[version]
+        files = sorted(
+            fn for fn in source.glob("**/*") if fn.is_file() and fn.name != "mbf.done"
+        )
+        files.append(source / "mbf.done")
+        archive_filename = Path(archive_filename)
+        temp = archive_filename.with_name(archive_filename.name + ".temp")
+        with zipfile.ZipFile(
+            temp,
+            "w",
+            compression=zipfile.ZIP_DEFLATED,
+            allowZip64=True,
+            compresslevel=compresslevel,
+        ) as zf:
+            zf.writestr(
+                "mbf_export.json",
+                json.dumps(
+                    {
+                        "name": name,
+                        "version": str(version),
+                        "host": source.relative_to(self.prebuilt_path).parts[0],
+                    }
+                ),
+            )
+            for fn in files:
+                zf.write(fn, str(fn.relative_to(source)))
+        temp.rename(archive_filename)
+        return archive_filename
+
+    def import_archive(self, archive_filename, max_workers=8):
+        """Unpack an export_archive into this host's prebuilt directory,
+        extracting and md5 verifying in parallel. mbf.done is written last.
+        Returns the prebuild's path"""
+        import zipfile
+        from concurrent.futures import ThreadPoolExecutor
+
+        archive_filename = Path(archive_filename)
+        with zipfile.ZipFile(archive_filename) as zf:
+            info = json.loads(zf.read("mbf_export.json").decode("utf-8"))
+            members = [
+                x
+                for x in zf.namelist()
+                if x not in ("mbf_export.json", "mbf.done") and not x.endswith("/")
+            ]
+            if "mbf.done" not in zf.namelist():
+                raise ValueError("%s contained no mbf.done" % archive_filename)
+        target = self.prebuilt_path / self.hostname / info["name"] / info["version"]
+        if (target / "mbf.done").exists():
+            return target
+        if target.exists():
+            raise ValueError(
+                "%s existed but was not finished - manual cleanup needed" % target
+            )
+        temp = target.with_name(target.name + ".importing_%i" % os.getpid())
+        if temp.exists():  # pragma: no cover
+            shutil.rmtree(temp)
+        temp.mkdir(parents=True)
+
+        def extract(chunk):
+            # ZipFile objects are not thread safe - one per worker
+            with zipfile.ZipFile(archive_filename) as zf:
+                for member in chunk:
+                    zf.extract(member, temp)
+
+        chunks = [members[ii::max_workers] for ii in range(max_workers)]
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(extract, chunks))
+            verify_md5_sums(temp)
+            with zipfile.ZipFile(archive_filename) as zf:
+                zf.extract("mbf.done", temp)
+        except Exception:
+            shutil.rmtree(temp)
+            raise
+        temp.rename(target)
+        touch_last_access(target)
+        return target
+
+    def _evict_local_cache(self, keep):
+        """Remove least recently used prebuilds from the local cache
+        until it fits local_cache_size.
+
+        Never touches prebuilds resolved by this manager - jobs declared
+        on them might not have run yet"""
+        evict_least_recently_used(
+            find_prebuilt_directories(self.local_cache_path),
+            self.local_cache_size,
+            protected=set(self._paths_in_use) | {keep},
+            min_age=self.local_cache_min_age,
+        )
+
+    def garbage_collect(self, size_budget, min_age=30 * 24 * 3600, dry_run=False):
+        """Remove the least recently used prebuilds (of all hosts)
+        until the prebuilt tree fits @size_budget bytes.
+
+        Prebuilds used (resolved by prebuild()) within the last @min_age
+        seconds are kept regardless.
+        Returns [(path, size)] of the removed ones.
+        """
+        return evict_least_recently_used(
+            find_prebuilt_directories(self.prebuilt_path),
+            size_budget,
+            min_age=min_age,
+            dry_run=dry_run,
+        )
+
+    def _resolve_version(
         self,
         name,
         version,
-        input_files,
-        output_files,
         calculating_function,
-        minimum_acceptable_version=None,
-        maximum_acceptable_version=None,
-        further_function_deps={},
+        minimum_acceptable_version,
+        maximum_acceptable_version,
     ):
-        """Create a job that will prebuilt the files if necessary
-
-        @further_function_deps is a dictionary name => func,
-        and will end up as PrebuildFunctionInvariantFileStoredExploding
-        in the correct directory
-
-        """
+        """Find the (version, output_path) to use -
+        either an existing compatible build, or this host's path for version"""
         if minimum_acceptable_version is None:
             minimum_acceptable_version = version
 
@@ -312,15 +1101,13 @@ class PrebuildManager:
                 new_source,
                 new_funchash,
                 new_closure,
-            ) = ppg.FunctionInvariant._hash_function(calculating_function)
+            ) = _hash_function_cached(calculating_function)
 
             for v, p in acceptable_versions:
-                func_md5sum_path = p / "mbf_func.md5sum"
-                func_md5sum_path2 = p / "mbf_func.md5sum2"
-                try:
-                    func_md5sum = json.loads(func_md5sum_path2.read_text())
-                except OSError:
-                    func_md5sum = func_md5sum_path.read_text()
+                stored = _read_stored_function_hash(p / "mbf_func.md5sum")
+                if stored is None:
+                    raise FileNotFoundError(p / "mbf_func.md5sum")
+                func_md5sum = stored[0]
                 ok = False
                 try:
                     new = ppg.FunctionInvariant._compare_new_and_old(
@@ -336,16 +1123,93 @@ class PrebuildManager:
                 version, output_path = ok_versions[-1]
             else:  # no version that is within the acceptable range and had the same build function
                 output_path = self.prebuilt_path / self.hostname / name / version
+        return version, output_path
 
+    def _prepare(
+        self,
+        name,
+        version,
+        output_files,
+        calculating_function,
+        minimum_acceptable_version,
+        maximum_acceptable_version,
+    ):
+        """Resolve version, output_path, normalized output_files and build lease
+        for a prebuild - and the path of another host's finished build
+        that has yet to be replicated to output_path in the local cache
+        (see _replicate_to_local_cache), or None"""
+        version, output_path = self._resolve_version(
+            name,
+            version,
+            calculating_function,
+            minimum_acceptable_version,
+            maximum_acceptable_version,
+        )
+        replicate_from = None
+        if (
+            self.local_cache_path is not None
+            and output_path.relative_to(self.prebuilt_path).parts[0] != self.hostname
+            and (output_path / "mbf.done").exists()
+        ):
+            target = self._local_cache_target(output_path)
+            self._paths_in_use.add(target)
+            if (target / "mbf.done").exists():
+                touch_last_access(target)
+            else:
+                # copying (and verifying) takes a while - leave it to the
+                # job, or whoever needs the files right now
+                replicate_from = output_path
+            output_path = target
+        elif (output_path / "mbf.done").exists():
+            touch_last_access(output_path)
+        lease = _BuildLease(
+            self.prebuilt_path, self.hostname, name, version, self.lease_expiry
+        )
         if isinstance(output_files, (str, Path)):
             output_files = [output_files]
         output_files = [Path(of) for of in output_files]
+        return version, output_path, output_files, lease, replicate_from
+
+    def prebuild(  # noqa: C901
+        self,
+        name,
+        version,
+        input_files,
+        output_files,
+        calculating_function,
+        minimum_acceptable_version=None,
+        maximum_acceptable_version=None,
+        further_function_deps={},
+    ):
+        """Create a job that will prebuilt the files if necessary
+
+        @further_function_deps is a dictionary name => func,
+        and will end up as PrebuildFunctionInvariantFileStoredExploding
+        in the correct directory
+
+        """
+        version, output_path, output_files, lease, replicate_from = self._prepare(
+            name,
+            version,
+            output_files,
+            calculating_function,
+            minimum_acceptable_version,
+            maximum_acceptable_version,
+        )
         if ppg.inside_ppg():
             job = PrebuildJob(output_files, calculating_function, output_path)
-            job.depends_on(_PrebuildFileInvariantsExploding(output_path, input_files))
+            job.input_invariant = _PrebuildFileInvariantsExploding(
+                output_path, input_files
+            )
+            job.depends_on(job.input_invariant)
             job.version = version
+            job.lease = lease
+            if replicate_from is not None:
+                job.replicate = lambda: self._replicate_to_local_cache(replicate_from)
             return job
         else:
+            if replicate_from is not None:
+                self._replicate_to_local_cache(replicate_from)
             for of in output_files:
                 if not (output_path / of).exists():
                     raise ValueError(
@@ -353,44 +1217,208 @@ class PrebuildManager:
                         % (output_path / of).absolute()
                     )
 
-            class DummyJob:
-                """just enough of the Jobs interface to ignore the various calls
-                and allow finding the msgpack jobs
-                """
+            return DummyJob(output_path, output_files)
 
-                def __init__(self, output_path, filenames):
-                    self.output_path = output_path
-                    self.filenames = PrebuildJob._normalize_output_files(
-                        filenames, output_path
-                    )
-                    # self.job_id = ":".join(sorted(str(x) for x in filenames))
+    def build(
+        self,
+        name,
+        version,
+        input_files,
+        output_files,
+        calculating_function,
+        minimum_acceptable_version=None,
+        maximum_acceptable_version=None,
+        further_function_deps=None,
+    ):
+        """Build a prebuild right now, without a pypipegraph.
 
-                def depends_on(self, _other_job):  # pragma: no cover
-                    return self
+        Same arguments as prebuild. Finished builds are protected by the
+        same invariants (calculating function, further_function_deps,
+        input file checksums) - changes raise UpstreamChangedError.
+        Returns a DummyJob.
+        """
+        version, output_path, output_files, lease, replicate_from = self._prepare(
+            name,
+            version,
+            output_files,
+            calculating_function,
+            minimum_acceptable_version,
+            maximum_acceptable_version,
+        )
+        if replicate_from is not None:
+            self._replicate_to_local_cache(replicate_from)
+        for of in output_files:
+            if of.is_absolute():
+                raise ValueError("output_files must be relative")
+        output_path.mkdir(parents=True, exist_ok=True)
+        filenames = PrebuildJob._normalize_output_files(output_files, output_path)
+        done = filenames[-1].exists()
 
-                def depends_on_func(self, _name, _func):  # pragma: no cover
-                    return self
+        function_deps = {"mbf_func": calculating_function}
+        if further_function_deps:
+            function_deps.update(further_function_deps)
+        for func_name, func in function_deps.items():
+            storage_filename = output_path / ("%s.md5sum" % (func_name,))
+            if not done:  # nothing was built with the old function yet
+                for fn in [
+                    storage_filename,
+                    storage_filename.with_name(storage_filename.name + "2"),
+                ]:
+                    if fn.exists():
+                        fn.unlink()
+            _check_function_invariant(storage_filename, func)
 
-                def depends_on_file(self, _filename):  # pragma: no cover
-                    return self
+        input_files = [str(x) for x in input_files]
+        inputs_filename = output_path / "mbf_inputs.json"
+        old = None
+        if done and inputs_filename.exists():
+            old = [tuple(x) for x in json.loads(inputs_filename.read_text())]
+        checksums, _report = calc_input_checksums(
+            input_files,
+            old,
+            _PrebuildFileInvariantsExploding.checksum_algorithm,
+            _PrebuildFileInvariantsExploding.checksum_workers,
+        )
+        if old:
+            compare_input_checksums(input_files, old, checksums, name)
 
-                def name_file(self, output_filename):
-                    """Adjust path of output_filename by job path"""
-                    return self.output_path / output_filename
+        if not done:
+            _run_calculation(
+                calculating_function, output_path, filenames, lease, checksums
+            )
+            for fn in filenames:
+                if not fn.exists():
+                    raise ValueError("%s was not created by %s" % (fn, name))
+        try:
+            inputs_filename.write_text(json.dumps(checksums))
+        except OSError:  # e.g. a read only replicated build
+            pass
+        job = DummyJob(output_path, output_files)
+        job.version = version
+        return job
 
-                def find_file(self, output_filename):
-                    """Search for a file named output_filename in the job's known created files"""
-                    of = self.name_file(output_filename)
-                    for fn in self.filenames:
-                        if of.resolve() == Path(fn).resolve():
-                            return of
-                    else:
-                        raise KeyError("file not found: %s" % output_filename)
+    def build_many(self, prebuilds, processes=None):
+        """Run self.build for each kwargs dict in @prebuilds,
+        in a pool of @processes worker processes (default: one per core).
 
-                def __iter__(self):
-                    yield self
+        Workers are forked, so calculating functions need not be picklable.
+        Returns the DummyJobs in the order of @prebuilds.
+        """
+        global _pending_builds
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
 
-            return DummyJob(output_path, output_files)
+        prebuilds = list(prebuilds)
+        _pending_builds = [(self, kwargs) for kwargs in prebuilds]
+        try:
+            with ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context("fork")
+            ) as pool:
+                return list(pool.map(_build_pending, range(len(prebuilds))))
+        finally:
+            _pending_builds = None
+
+
+_pending_builds = None
+
+
+def _build_pending(index):
+    """ProcessPool entry point for PrebuildManager.build_many"""
+    manager, kwargs = _pending_builds[index]
+    return manager.build(**kwargs)
+
+
+def _check_function_invariant(storage_filename, func):
+    """PrebuildFunctionInvariantFileStoredExploding for use without a pypipegraph"""
+    new_hash, status = _compare_stored_function_hash(storage_filename, func)
+    if status == "changed":
+        _raise_function_changed(storage_filename, new_hash)
+
+
+class DummyJob:
+    """just enough of the Jobs interface to ignore the various calls
+    and allow finding the msgpack jobs
+    """
+
+    def __init__(self, output_path, filenames):
+        self.output_path = output_path
+        self.filenames = PrebuildJob._normalize_output_files(
+            filenames, output_path
+        )
+        # self.job_id = ":".join(sorted(str(x) for x in filenames))
+
+    def depends_on(self, _other_job):  # pragma: no cover
+        return self
+
+    def depends_on_func(self, _name, _func):  # pragma: no cover
+        return self
+
+    def depends_on_file(self, _filename):  # pragma: no cover
+        return self
+
+    def name_file(self, output_filename):
+        """Adjust path of output_filename by job path"""
+        return self.output_path / output_filename
+
+    def find_file(self, output_filename):
+        """Search for a file named output_filename in the job's known created files"""
+        of = self.name_file(output_filename)
+        for fn in self.filenames:
+            if of.resolve() == Path(fn).resolve():
+                return of
+        else:
+            raise KeyError("file not found: %s" % output_filename)
+
+    def prefetch(self, max_bytes=None):
+        """See PrebuildJob.prefetch"""
+        return _prefetch_output_path(self.output_path, max_bytes)
+
+    def __iter__(self):
+        yield self
+
+
+def _prefetch_output_path(output_path, max_bytes=None):
+    """prefetch_files on all (non bookkeeping) files of a finished prebuild"""
+    output_path = Path(output_path)
+    if not (output_path / "mbf.done").exists():
+        return None
+    filenames = [
+        fn
+        for fn in sorted(output_path.glob("**/*"))
+        if fn.is_file() and not _is_bookkeeping_file(fn)
+    ]
+    return prefetch_files(filenames, max_bytes)
+
+
+def _is_bookkeeping_file(filename):
+    """md5 sidecars, mbf.done & co - not part of a prebuild's payload"""
+    name = Path(filename).name
+    return (
+        ".md5sum" in name
+        or name in ("mbf.done", "mbf_manifest.json", "mbf_inputs.json")
+        or name.startswith(".")
+    )
+
+
+def _output_tree_sizes(output_path):
+    """relative path -> size of all (non bookkeeping) files below output_path"""
+    result = {}
+    for root, _dirs, files in os.walk(output_path):
+        for fn in files:
+            if not _is_bookkeeping_file(fn):
+                full = os.path.join(root, fn)
+                result[os.path.relpath(full, output_path)] = os.path.getsize(full)
+    return dict(sorted(result.items()))
+
+
+def find_prebuilt_directories(path):
+    """All finished prebuild directories (those containing mbf.done) below path"""
+    result = []
+    for root, dirs, files in os.walk(path):
+        if "mbf.done" in files:
+            result.append(Path(root))
+            dirs[:] = []  # no nested prebuilds
+    return result
 
 
 _global_manager = None
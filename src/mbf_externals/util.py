@@ -1,5 +1,8 @@
 import functools
 import natsort
+import os
+import threading
+import time
 from pathlib import Path
 
 
@@ -97,30 +100,308 @@ class UpstreamChangedError(ValueError):
     pass
 
 
-def download_file(url, file_object):
-    """Download an url"""
+def download_file(url, file_object, use_mirror=True):
+    """Download an url.
+
+    If a download mirror is configured (see get_download_mirror),
+    it is consulted first, and populated on a miss
+    """
     if isinstance(file_object, (str, Path)):
         raise ValueError("download_file needs a file-object not a name")
 
+    mirror = get_download_mirror() if use_mirror and not url.endswith("/") else None
     try:
-        if url.startswith("ftp"):
-            return download_ftp(url, file_object)
-        else:
-            return download_http(url, file_object)
+        if mirror is not None:
+            return _download_via_mirror(mirror, url, file_object)
+        return _download_file(url, file_object)
     except Exception as e:
         raise ValueError("Could not download %s, exception: %s" % (repr(url), e))
 
 
-def download_http(url, file_object):
-    """Download a file from http"""
-    import requests
+def _download_file(url, file_object):
+    if url.startswith("ftp"):
+        return download_ftp(url, file_object)
+    else:
+        return download_http(url, file_object)
+
+
+_download_mirror = None
+
+
+def set_download_mirror(mirror):
+    """Use @mirror (a directory, or a http(s) url of a read only copy of one)
+    as content addressed download cache. None to disable"""
+    global _download_mirror
+    _download_mirror = str(mirror) if mirror is not None else None
+
+
+def get_download_mirror():
+    """The download mirror - set_download_mirror, or
+    environment variable MBF_EXTERNAL_DOWNLOAD_MIRROR"""
+    if _download_mirror is not None:
+        return _download_mirror
+    return os.environ.get("MBF_EXTERNAL_DOWNLOAD_MIRROR", None)
+
+
+def _download_via_mirror(mirror, url, file_object):
+    """Mirror layout:
+        by_url/<sha256 of url> -> text file with the sha256 of the content
+        by_hash/<sha256 of content> -> the content
+    """
+    import hashlib
+    import io
     import shutil
+    import tempfile
+
+    url_key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    if mirror.startswith("http://") or mirror.startswith("https://"):
+        import requests
 
-    r = requests.get(url, stream=True)
+        mirror = mirror.rstrip("/")
+        with tempfile.TemporaryFile() as tf:
+            try:
+                index = io.BytesIO()
+                download_http(mirror + "/by_url/" + url_key, index)
+                content_hash = index.getvalue().decode("utf-8").strip()
+                download_http(mirror + "/by_hash/" + content_hash, tf)
+            except (ValueError, requests.exceptions.RequestException):
+                # miss or mirror unreachable - it's read only, go upstream
+                return _download_file(url, file_object)
+            tf.seek(0)
+            if checksum_file_object(tf, "sha256") != content_hash:
+                raise ValueError("Mirror content for %s did not match its hash" % url)
+            tf.seek(0)
+            shutil.copyfileobj(tf, file_object)
+        return
+
+    mirror = Path(mirror)
+    by_url = mirror / "by_url" / url_key
+    if by_url.exists():
+        content = mirror / "by_hash" / by_url.read_text().strip()
+        if content.exists():
+            with open(content, "rb") as op:
+                if checksum_file_object(op, "sha256") != content.name:
+                    raise ValueError(
+                        "Mirror content %s did not match its hash" % content
+                    )
+                op.seek(0)
+                shutil.copyfileobj(op, file_object)
+            return
+    # miss - download into the mirror, then copy
+    (mirror / "by_hash").mkdir(parents=True, exist_ok=True)
+    (mirror / "by_url").mkdir(parents=True, exist_ok=True)
+    tf = tempfile.NamedTemporaryFile(dir=mirror / "by_hash", delete=False)
+    try:
+        with tf:
+            writer = _HashingFileObject(tf, "sha256")
+            _download_file(url, writer)
+        content = mirror / "by_hash" / writer.hexdigest()
+        # NamedTemporaryFile is 0600 - the mirror is meant to be shared
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tf.name, 0o644 & ~umask)
+        os.replace(tf.name, content)
+    except BaseException:
+        if os.path.exists(tf.name):
+            os.unlink(tf.name)
+        raise
+    temp_index = by_url.with_name(by_url.name + ".%i.temp" % os.getpid())
+    temp_index.write_text(content.name)
+    os.replace(temp_index, by_url)
+    with open(content, "rb") as op:
+        shutil.copyfileobj(op, file_object)
+
+
+class _HashingFileObject:
+    """Pass writes through to file_object, hashing them on the way"""
+
+    def __init__(self, file_object, algorithm="md5"):
+        self.file_object = file_object
+        self.hasher = get_hasher(algorithm)
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.file_object.write(data)
+
+    def flush(self):
+        self.file_object.flush()
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+def checksum_file_object(file_object, algorithm="md5", block_size=16 * 1024 * 1024):
+    """Hexdigest of the remaining content of a (binary) file object"""
+    h = get_hasher(algorithm)
+    while True:
+        block = file_object.read(block_size)
+        if not block:
+            break
+        h.update(block)
+    return h.hexdigest()
+
+
+def download_http(
+    url,
+    file_object,
+    segments=4,
+    min_segment_size=16 * 1024 * 1024,
+    retries=5,
+    retry_delay=0.5,
+    timeout=(30, 120),
+):
+    """Download a file from http.
+
+    If the server supports byte ranges, large files are fetched in
+    @segments parallel range requests, and interrupted transfers
+    are resumed (up to @retries times per segment) instead of restarted.
+    Retries back off exponentially, starting at @retry_delay seconds.
+    The final size is checked against Content-Length.
+
+    @timeout is (connect, read) in seconds, as for requests - a stalled
+    connection is retried / resumed like a dropped one.
+    """
+    import requests
+
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(retry_delay * 2 ** (attempt - 1))
+        try:
+            r = requests.get(url, stream=True, timeout=timeout)
+            break
+        except requests.exceptions.Timeout as e:  # but not refused connections
+            error = e
+    else:
+        raise error
     if r.status_code != 200:
         raise ValueError("HTTP Error return: %i fetching %s" % (r.status_code, url))
+    try:
+        length = int(r.headers["Content-Length"])
+    except (KeyError, ValueError):
+        length = None
+    # byte ranges only make sense on the unencoded content
+    ranges_ok = (
+        r.headers.get("Accept-Ranges", "").lower() == "bytes"
+        and not r.headers.get("Content-Encoding")
+        and length is not None
+    )
+    if ranges_ok and segments > 1 and length >= 2 * min_segment_size:
+        r.close()
+        _download_http_segments(
+            url, file_object, length, segments, retries, retry_delay, timeout
+        )
+        return
     r.raw.decode_content = True
-    shutil.copyfileobj(r.raw, file_object)
+    written, error = _copy_counting(r.raw, file_object)
+    if error is not None and not ranges_ok:
+        raise error
+    tries = 0
+    while ranges_ok and written < length and tries < retries:
+        # connection dropped - pick up where we left off
+        time.sleep(retry_delay * 2 ** tries)
+        tries += 1
+        more, error = _download_http_range(
+            url, written, length - 1, file_object, timeout
+        )
+        written += more
+    if length is not None and written != length and not r.headers.get(
+        "Content-Encoding"
+    ):
+        raise ValueError(
+            "Download of %s incomplete: %i of %i bytes (%s)"
+            % (url, written, length, error)
+        )
+
+
+def _copy_counting(source, file_object, block_size=1024 * 1024):
+    """copyfileobj from a http response.
+    Returns (bytes copied, the connection error that stopped it or None)"""
+    import requests
+    import urllib3
+
+    written = 0
+    while True:
+        try:
+            block = source.read(block_size)
+        except (
+            requests.exceptions.RequestException,
+            urllib3.exceptions.HTTPError,
+            ConnectionError,
+        ) as e:
+            return written, e
+        if not block:
+            return written, None
+        file_object.write(block)
+        written += len(block)
+
+
+def _download_http_range(url, start, end, file_object, timeout=(30, 120)):
+    """Write bytes start..end (inclusive) of url to file_object.
+    Returns (bytes written, connection error or None)"""
+    import requests
+
+    try:
+        r = requests.get(
+            url,
+            stream=True,
+            headers={
+                "Range": "bytes=%i-%i" % (start, end),
+                "Accept-Encoding": "identity",
+            },
+            timeout=timeout,
+        )
+    except requests.exceptions.RequestException as e:
+        return 0, e
+    if r.status_code != 206:
+        raise ValueError(
+            "HTTP Error return: %i fetching range of %s" % (r.status_code, url)
+        )
+    return _copy_counting(r.raw, file_object)
+
+
+def _download_http_segments(
+    url, file_object, length, segments, retries, retry_delay=0.5, timeout=(30, 120)
+):
+    """Fetch url in parallel range requests into temporary files,
+    then concatenate them into file_object"""
+    import shutil
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    segment_size = -(-length // segments)  # round up
+    bounds = [
+        (start, min(start + segment_size, length) - 1)
+        for start in range(0, length, segment_size)
+    ]
+    with tempfile.TemporaryDirectory(prefix="mbf_download_") as tmp:
+
+        def fetch(ii):
+            start, end = bounds[ii]
+            fn = Path(tmp) / str(ii)
+            error = None
+            with open(fn, "wb") as op:
+                have = 0
+                for attempt in range(retries + 1):
+                    if attempt:
+                        time.sleep(retry_delay * 2 ** (attempt - 1))
+                    more, error = _download_http_range(
+                        url, start + have, end, op, timeout
+                    )
+                    have += more
+                    if have >= end - start + 1:
+                        break
+            if have != end - start + 1:
+                raise ValueError(
+                    "Download of %s failed: bytes %i-%i incomplete after %i retries (%s)"
+                    % (url, start, end, retries, error)
+                )
+            return fn
+
+        with ThreadPoolExecutor(max_workers=segments) as pool:
+            filenames = list(pool.map(fetch, range(len(bounds))))
+        for fn in filenames:
+            with open(fn, "rb") as op:
+                shutil.copyfileobj(op, file_object, 1024 * 1024)
 
 
 def download_ftp(url, file_object):
@@ -147,7 +428,7 @@ def get_page(url):
     from io import BytesIO
 
     tf = BytesIO()
-    download_file(url, tf)
+    download_file(url, tf, use_mirror=False)  # pages change, don't mirror
     tf.seek(0, 0)
     return tf.read().decode("utf-8")
 
@@ -166,19 +447,389 @@ def download_file_and_gunzip(url, unzipped_filename):
             shutil.copyfileobj(gz_in, op)
 
 
-def download_file_and_gzip(url, gzipped_filename):
+def download_file_and_gzip(url, gzipped_filename, threads=2):
+    """Download url and store it gzipped.
+
+    Compresses while downloading (pigz with @threads if available, gzip otherwise)
+    into a temporary file next to gzipped_filename, which is then renamed
+    into place. Returns the md5 of the gzipped file, calculated on the fly.
+    """
     import shutil
     import gzip
-    import tempfile
+    import subprocess
+    import threading
 
-    gzipped_filename = str(gzipped_filename)
-    if not gzipped_filename.endswith(".gz"):  # pragma: no cover
+    gzipped_filename = Path(str(gzipped_filename))
+    if not gzipped_filename.name.endswith(".gz"):  # pragma: no cover
         raise ValueError("output filename did not end with .gz")
 
-    with tempfile.NamedTemporaryFile(suffix="") as tf:
-        with gzip.GzipFile(tf.name, "wb") as gf:
-            download_file(url, gf)
-        shutil.copy(tf.name, gzipped_filename)
+    temp = gzipped_filename.with_name(
+        gzipped_filename.name + ".%i.temp" % os.getpid()
+    )
+    pigz = shutil.which("pigz")
+    try:
+        with open(temp, "wb") as raw:
+            op = _HashingFileObject(raw, "md5")
+            if pigz:
+                p = subprocess.Popen(
+                    [pigz, "-c", "-p", str(threads)],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                )
+                errors = []
+
+                def pump():
+                    try:
+                        shutil.copyfileobj(p.stdout, op, 1024 * 1024)
+                    except Exception as e:  # pragma: no cover
+                        errors.append(e)
+                        while p.stdout.read(1024 * 1024):  # don't block pigz
+                            pass
+
+                reader = threading.Thread(target=pump)
+                reader.start()
+                try:
+                    download_file(url, p.stdin)
+                finally:
+                    p.stdin.close()
+                    reader.join()
+                    p.wait()
+                if errors:  # pragma: no cover
+                    raise errors[0]
+                if p.returncode != 0:  # pragma: no cover
+                    raise ValueError("pigz failed with return code %i" % p.returncode)
+            else:
+                with gzip.GzipFile(fileobj=op, mode="wb") as gf:
+                    download_file(url, gf)
+        os.replace(temp, gzipped_filename)
+    except BaseException:
+        if temp.exists():
+            temp.unlink()
+        raise
+    return op.hexdigest()
+
+
+class FIFOFeeder:
+    """Fill a named pipe from a background thread.
+
+    @feed is called with the (binary) file object of the fifo once
+    a reader has opened it.
+
+    A reader that closes the fifo before all data was written, or that
+    reopens it after the feed ended (and would silently read nothing),
+    ends up as .exception - unless @allow_early_close
+    (default: feed.allow_early_close, see decompressing_feed), for readers
+    that are told to stop early (e.g. STAR --readMapNumber).
+    """
+
+    def __init__(self, fifo_path, feed, allow_early_close=None):
+        self.fifo_path = Path(fifo_path)
+        self.feed = feed
+        if allow_early_close is None:
+            allow_early_close = getattr(feed, "allow_early_close", False)
+        self.allow_early_close = allow_early_close
+        self.exception = None
+        self.thread = None
+        self._finishing = False
+
+    def start(self):
+        import os
+        import threading
+
+        if self.fifo_path.exists() or self.fifo_path.is_symlink():
+            self.fifo_path.unlink()  # left over from a crashed run
+        os.mkfifo(str(self.fifo_path))
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            with open(self.fifo_path, "wb") as op:
+                try:
+                    self.feed(op)
+                    op.flush()
+                finally:
+                    self._replace_fifo()
+        except BrokenPipeError:
+            if not self.allow_early_close:
+                self.exception = ValueError(
+                    f"Reader closed {self.fifo_path} before all data was read"
+                )
+        except Exception as e:
+            self.exception = e
+        self._answer_reopens_with_eof()
+
+    def _replace_fifo(self):
+        """Swap in a fresh fifo, so that the reader still draining the old one
+        is not mistaken for one that reopened it.
+
+        Called while the write end is still open - a reader reopening the
+        old fifo right now gets an EOF, instead of blocking forever"""
+        import os
+
+        if self._finishing:
+            return
+        temp = self.fifo_path.with_name(self.fifo_path.name + ".%i" % os.getpid())
+        try:
+            os.mkfifo(str(temp))
+            os.replace(str(temp), str(self.fifo_path))
+        except OSError:  # pragma: no cover
+            pass
+
+    def _answer_reopens_with_eof(self):
+        """A reader that reopens the fifo (e.g. after sniffing the file type)
+        must not block forever - hand it an EOF, and record an error,
+        since it did not get it's data"""
+        import os
+        import time
+
+        while not self._finishing:
+            try:
+                fd = os.open(str(self.fifo_path), os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:  # no reader yet
+                time.sleep(0.05)
+                continue
+            os.close(fd)
+            if not self._finishing and self.exception is None:
+                self.exception = ValueError(
+                    f"Reader reopened {self.fifo_path} after the data was fed"
+                )
+            time.sleep(0.05)
+
+    def finish(self):
+        """Wait for the feed to end and remove the fifo.
+
+        If the reader never opened (or already closed) the fifo, the feeding
+        thread is released by briefly opening the fifo for reading."""
+        import os
+
+        self._finishing = True
+        while self.thread.is_alive():
+            try:
+                fd = os.open(str(self.fifo_path), os.O_RDONLY | os.O_NONBLOCK)
+                os.close(fd)
+            except OSError:  # pragma: no cover
+                pass
+            self.thread.join(0.1)
+        try:
+            self.fifo_path.unlink()
+        except OSError:  # pragma: no cover
+            pass
+
+
+def decompressing_feed(filename, threads=2, allow_early_close=False):
+    """A FIFOFeeder feed that writes the decompressed contents of a .gz file.
+    Uses pigz if it's available, gzip otherwise.
+
+    @allow_early_close: the reader may stop before the end of the file,
+    see FIFOFeeder"""
+
+    def feed(file_object):
+        import shutil
+        import signal
+        import subprocess
+
+        pigz = shutil.which("pigz")
+        if pigz:
+            cmd = [pigz, "-d", "-c", "-p", str(threads), str(filename)]
+            p = subprocess.Popen(cmd, stdout=file_object)
+            returncode = p.wait()
+            if returncode == -signal.SIGPIPE:
+                # the reader closed the fifo - handled by FIFOFeeder
+                raise BrokenPipeError(f"Reader stopped reading {filename}")
+            elif returncode != 0:
+                raise subprocess.CalledProcessError(returncode, cmd)
+        else:
+            import gzip
+
+            with gzip.GzipFile(filename, "rb") as gz_in:
+                shutil.copyfileobj(gz_in, file_object, 1024 * 1024)
+
+    feed.allow_early_close = allow_early_close
+    return feed
+
+
+def get_hasher(algorithm="md5"):
+    """A hashlib style hash object - any hashlib algorithm,
+    or xxh64/xxh3_64/xxh128 if the xxhash module is installed"""
+    import hashlib
+
+    if algorithm.startswith("xxh"):
+        import xxhash
+
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def checksum_file(filename, algorithm="md5", block_size=16 * 1024 * 1024):
+    """Hexdigest of filename. md5 matches ppg.util.checksum_file,
+    other algorithms are returned as 'algorithm:hexdigest'"""
+    h = get_hasher(algorithm)
+    with open(filename, "rb", buffering=0) as op:
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        while True:
+            read = op.readinto(buffer)
+            if not read:
+                break
+            h.update(view[:read])
+    if algorithm == "md5":
+        return h.hexdigest()
+    return algorithm + ":" + h.hexdigest()
+
+
+def checksum_algorithm(checksum):
+    """Which algorithm produced a checksum_file result"""
+    if ":" in checksum:
+        return checksum[: checksum.find(":")]
+    return "md5"
+
+
+def copy_tree(source, target):
+    """Copy a directory tree - using rsync if available"""
+    import shutil
+    import subprocess
+
+    rsync = shutil.which("rsync")
+    if rsync:
+        Path(target).mkdir(parents=True, exist_ok=True)
+        subprocess.check_call([rsync, "-a", str(source) + "/", str(target) + "/"])
+    else:
+        shutil.copytree(str(source), str(target))
+
+
+def verify_md5_sums(path):
+    """Check every file in path (recursively) that has a .md5sum sidecar
+    against it. Raises ValueError on mismatch"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    to_check = [
+        sidecar.with_name(sidecar.name[: -len(".md5sum")])
+        for sidecar in Path(path).glob("**/*.md5sum")
+    ]
+    to_check = [x for x in to_check if x.exists()]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        checksums = list(pool.map(checksum_file, to_check))
+    for fn, checksum in zip(to_check, checksums):
+        expected = fn.with_name(fn.name + ".md5sum").read_text().strip()
+        if checksum != expected:
+            raise ValueError("md5sum mismatch for %s" % (fn,))
+
+
+def touch_last_access(path):
+    """Record that a (prebuild/unpack) directory was used just now"""
+    try:
+        (Path(path) / ".mbf_last_access").write_text("%.0f" % time.time())
+    except OSError:  # read only file systems etc
+        pass
+
+
+def get_last_access(path):
+    """When was touch_last_access last called on path (or, failing that,
+    when was it last modified)"""
+    path = Path(path)
+    try:
+        return os.stat(path / ".mbf_last_access").st_mtime
+    except OSError:
+        return os.stat(path).st_mtime
+
+
+def get_directory_size(path):
+    """Size of all files below path, in bytes"""
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(root, f)).st_size
+            except OSError:  # pragma: no cover
+                pass
+    return total
+
+
+def evict_least_recently_used(
+    directories, size_budget, protected=(), min_age=0, dry_run=False
+):
+    """Remove directories, least recently used first (see touch_last_access),
+    until their total size fits size_budget (bytes).
+
+    Directories in @protected, or used within the last @min_age seconds
+    are never removed.
+    Returns [(path, size)] of the removed (or, if dry_run, to be removed) ones.
+    """
+    import shutil
+
+    protected = set(Path(x).absolute() for x in protected)
+    entries = [
+        (get_last_access(p), get_directory_size(p), Path(p)) for p in directories
+    ]
+    total = sum(x[1] for x in entries)
+    now = time.time()
+    removed = []
+    for last_access, size, p in sorted(entries, key=lambda x: x[0]):
+        if total <= size_budget:
+            break
+        if p.absolute() in protected or now - last_access < min_age:
+            continue
+        if not dry_run:
+            shutil.rmtree(p)
+        removed.append((p, size))
+        total -= size
+    return removed
+
+
+def get_available_memory():
+    """MemAvailable in bytes (linux), None if unknown"""
+    try:
+        with open("/proc/meminfo") as op:
+            for line in op:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:  # pragma: no cover
+        pass
+    return None  # pragma: no cover
+
+
+# one prefetch at a time - they would just compete for IO
+_prefetch_lock = threading.Lock()
+
+
+def prefetch_files(filenames, max_bytes=None, block_size=16 * 1024 * 1024):
+    """Pull files into the page cache in a background thread
+    (posix_fadvise WILLNEED, falling back to bulk reads).
+
+    Stops once @max_bytes (default: half the available memory) have been
+    scheduled. Returns the (daemon) thread.
+    """
+    if max_bytes is None:
+        available = get_available_memory()
+        max_bytes = available // 2 if available is not None else 0
+    filenames = [Path(x) for x in filenames]
+
+    def prefetch():
+        with _prefetch_lock:
+            budget = max_bytes
+            for fn in filenames:
+                try:
+                    size = fn.stat().st_size
+                    if size > budget:
+                        break
+                    budget -= size
+                    fd = os.open(fn, os.O_RDONLY)
+                    try:
+                        if hasattr(os, "posix_fadvise"):
+                            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+                        else:  # pragma: no cover
+                            while os.read(fd, block_size):
+                                pass
+                    finally:
+                        os.close(fd)
+                except OSError:  # vanished or unreadable - not our problem
+                    continue
+
+    thread = threading.Thread(target=prefetch, daemon=True)
+    thread.start()
+    return thread
 
 
 def write_md5_sum(filepath):
@@ -189,6 +840,102 @@ def write_md5_sum(filepath):
     (filepath.with_name(filepath.name + ".md5sum")).write_text(md5sum)
 
 
+def write_md5_sums(filepaths, max_workers=8):
+    """write_md5_sum for many files in parallel"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    filepaths = [Path(x) for x in filepaths]
+    if len(filepaths) <= 1:
+        for fn in filepaths:
+            write_md5_sum(fn)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(write_md5_sum, filepaths))
+
+
+def md5_sum_is_current(filepath, since=0):
+    """Is there a filepath.md5sum that was written after filepath (and @since)?"""
+    filepath = Path(filepath)
+    sidecar = filepath.with_name(filepath.name + ".md5sum")
+    try:
+        sidecar_time = sidecar.stat().st_mtime
+        return sidecar_time >= max(filepath.stat().st_mtime, since)
+    except FileNotFoundError:
+        return False
+
+
+# (absolute path, mtime_ns, size) -> md5 hexdigest, see read_md5_sum
+_md5_sum_cache = {}
+
+
+def read_md5_sum(filepath):
+    """md5 hexdigest of filepath - taken from a current .md5sum sidecar
+    (see md5_sum_is_current) if there is one, calculated otherwise.
+
+    Results are cached per (path, mtime, size) - declaring many jobs on
+    the same multi-GB fasta hashes it once per process.
+    """
+    from pypipegraph.util import checksum_file
+
+    filepath = Path(filepath).absolute()
+    stat = filepath.stat()
+    key = (str(filepath), stat.st_mtime_ns, stat.st_size)
+    if key not in _md5_sum_cache:
+        if md5_sum_is_current(filepath):
+            _md5_sum_cache[key] = (
+                filepath.with_name(filepath.name + ".md5sum").read_text().strip()
+            )
+        else:
+            _md5_sum_cache[key] = checksum_file(filepath)
+    return _md5_sum_cache[key]
+
+
+class HashingWriter:
+    """Binary file writer that md5-hashes the data on its way to disk
+    and writes the .md5sum sidecar on close - without rereading the file.
+
+    Use as context manager: with HashingWriter(output_path / 'index') as op: ...
+    """
+
+    def __init__(self, filename, mode="wb"):
+        if mode not in ("wb", "xb"):
+            raise ValueError("HashingWriter only supports 'wb' and 'xb'")
+        import hashlib
+
+        self.filename = Path(filename)
+        self._file = open(self.filename, mode)
+        self._hash = hashlib.md5()
+
+    def write(self, data):
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self, write_sidecar=True):
+        if not self._file.closed:
+            self._file.close()
+            if write_sidecar:
+                self.filename.with_name(self.filename.name + ".md5sum").write_text(
+                    self.hexdigest()
+                )
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # no sidecar for half written files
+        self.close(write_sidecar=exc_type is None)
+
+
 def to_string(s, encoding="utf-8"):
     if isinstance(s, str):
         return s
@@ -1,5 +1,7 @@
 from pathlib import Path
+import hashlib
 import pytest
+import pypipegraph as ppg
 from mbf_externals.aligners.subread import Subread
 from mbf_externals.aligners.star import STAR
 from mbf_externals.aligners.bowtie import Bowtie
@@ -85,6 +87,202 @@ class TestSubread:
         new_pipegraph.run()
         assert (Path("out") / "out.bam").exists()
 
+    def test_build_index_prebuild(self, new_pipegraph, per_run_store):
+        from mbf_externals import PrebuildManager
+
+        new_pipegraph.quiet = False
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+        s = Subread(version="1.6.3")
+        data_path = Path(__file__).parent / "sample_data"
+        fasta_md5 = hashlib.md5(
+            hashlib.md5((data_path / "genome.fasta").read_bytes())
+            .hexdigest()
+            .encode("utf-8")
+        ).hexdigest()[:8]
+        build_job = s.build_index_prebuild(
+            data_path / "genome.fasta", None, prebuild_manager=mgr
+        )
+        assert build_job.output_path == Path(
+            "prebuilt/test_host/aligner_indices/Subread/genome.fasta_%s/1.6.3"
+            % fasta_md5
+        )
+        align_job = s.align_job(
+            data_path / "sample.fastq",
+            None,
+            build_job.index_path,
+            "out/out.bam",
+            {"input_type": "dna"},
+        )
+        align_job.depends_on(build_job)
+        new_pipegraph.run()
+        assert (Path("out") / "out.bam").exists()
+        assert (build_job.output_path / "subread_index.reads").exists()
+
+        # another host, compatible version -> reused
+        new_pipegraph.new_pipegraph()
+        mgr = PrebuildManager("prebuilt", "test_host2")
+        s = Subread(version="1.6.4")
+        build_job = s.build_index_prebuild(
+            data_path / "genome.fasta", None, prebuild_manager=mgr
+        )
+        assert build_job.output_path == Path(
+            "prebuilt/test_host/aligner_indices/Subread/genome.fasta_%s/1.6.3"
+            % fasta_md5
+        )
+
+    def test_build_index_prebuild_name_and_closure(
+        self, new_pipegraph, per_test_store
+    ):
+        from mbf_externals import PrebuildManager
+
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+        calls = []
+        org = mgr.prebuild
+
+        def prebuild(*args, **kwargs):
+            calls.append(args)
+            return org(*args, **kwargs)
+
+        mgr.prebuild = prebuild
+        s = Subread(version="_fetching")
+        s.version = "1.6.3"
+        jobs = []
+        for genome in ["genome_a", "genome_b"]:
+            Path(genome).mkdir()
+            (Path(genome) / "genome.fasta").write_text(">chr1\n%s\n" % genome)
+            jobs.append(
+                s.build_index_prebuild(
+                    Path(genome).absolute() / "genome.fasta",
+                    None,
+                    prebuild_manager=mgr,
+                )
+            )
+        # same file name, different genomes -> different indices
+        assert jobs[0].output_path != jobs[1].output_path
+        assert jobs[0].output_path.parent.name.startswith("genome.fasta_")
+        # the build function does not depend on where the genome lives
+        closure = ppg.FunctionInvariant.extract_closure(calls[0][4])
+        assert "genome_a" not in closure
+        assert str(Path(".").absolute()) not in closure
+
+    def test_align_job_prefetches_prebuilt_index(
+        self, new_pipegraph, per_test_store
+    ):
+        from mbf_externals import PrebuildManager
+
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+        Path("genome.fasta").write_text(">chr1\nACGT\n")
+        for aligner, version in [
+            (Subread(version="_fetching"), "1.6.3"),
+            (STAR(version="_fetching"), "2.7.3a"),
+            (Bowtie(version="_fetching"), "1.2.3"),
+        ]:
+            aligner.version = version
+            build_job = aligner.build_index_prebuild(
+                "genome.fasta", None, prebuild_manager=mgr
+            )
+            align_job = aligner.align_job(
+                "sample.fastq",
+                None,
+                build_job.index_path,
+                "out_%s/out.bam" % aligner.name,
+                {"input_type": "dna"} if aligner.name == "Subread" else {},
+            )
+            assert build_job.prefetch_job() in align_job.prerequisites
+            # not for indices that were not declared via build_index_prebuild
+            align_job = aligner.align_job(
+                "sample.fastq",
+                None,
+                "elsewhere",
+                "out2_%s/out.bam" % aligner.name,
+                {"input_type": "dna"} if aligner.name == "Subread" else {},
+            )
+            assert not any(
+                "prebuild_prefetch" in x.job_id for x in align_job.prerequisites
+            )
+
+    def test_collect_alignment_stats(self, new_pipegraph, per_run_store):
+        s = Subread()
+        for ii in range(3):
+            Path(f"sample{ii}").mkdir()
+            Path(f"sample{ii}/stderr.txt").write_text(
+                "header\n"
+                "= Summary =\n"
+                f"Uniquely mapped : {ii}\n"
+                "Multi-mapping : 2\n"
+                "Unmapped : 3\n"
+            )
+        bams = [f"sample{ii}/out.bam" for ii in range(3)] + ["missing/out.bam"]
+        df = s.collect_alignment_stats(bams, cache_filename="stats_cache.json")
+        assert list(df.index) == bams
+        assert list(df["Uniquely mapped"][:3]) == [0, 1, 2]
+        assert str(df["Unmapped"].dtype) == "Int64"
+        assert df.loc["missing/out.bam"].isna().all()
+        assert Path("stats_cache.json").exists()
+
+        s2 = Subread()
+        s2.parse_alignment_stats = None  # everything must come from the cache
+        df2 = s2.collect_alignment_stats(bams, cache_filename="stats_cache.json")
+        assert (df2.fillna(-1) == df.fillna(-1)).all().all()
+
+    def test_align_gzipped_not_via_fifo(self, new_pipegraph, per_run_store):
+        # subread sniffs the input type and then reopens the file,
+        # which a fifo can not serve
+        import gzip
+
+        s = Subread()
+        data_path = Path(__file__).parent / "sample_data"
+        for fn in ["sample_R1_.fastq", "sample_R2_.fastq"]:
+            with gzip.GzipFile(fn + ".gz", "wb") as op:
+                op.write((data_path / fn).read_bytes())
+        index_name = Path("subread_index_dir/srf")
+        build_job = s.build_index_job(data_path / "genome.fasta", None, index_name)
+        align_job = s.align_job(
+            "sample_R1_.fastq.gz",
+            "sample_R2_.fastq.gz",
+            index_name,
+            "out/out.bam",
+            {"input_type": "dna"},
+        )
+        align_job.depends_on(build_job)
+        new_pipegraph.run()
+        assert (Path("out") / "out.bam").exists()
+        cmd = (Path("out") / "cmd.txt").read_text()
+        assert "input_fifo" not in cmd
+        assert "sample_R1_.fastq.gz" in cmd
+
+    def test_fifo_inputs_disabled(self, per_run_store):
+        s = Subread(version="_fetching")
+        assert s._fifo_inputs("out", "a.fastq.gz", "b.fastq.gz") == (
+            "a.fastq.gz",
+            "b.fastq.gz",
+            [],
+        )
+
+    def test_align_preview(self, new_pipegraph, per_run_store):
+        s = Subread()
+        data_path = Path(__file__).parent / "sample_data"
+        index_name = Path("subread_index_dir/srf")
+        build_job = s.build_index_job(data_path / "genome.fasta", None, index_name)
+        align_job = s.align_job(
+            data_path / "sample_R1_.fastq",
+            data_path / "sample_R2_.fastq",
+            index_name,
+            "out/out.bam",
+            {"input_type": "dna"},
+            preview=1,
+        )
+        align_job.depends_on(build_job)
+        assert align_job.output_bam_filename == Path("out/preview_1/out.bam")
+        new_pipegraph.run()
+        assert not (Path("out") / "out.bam").exists()
+        assert Path("out/preview_1/out.bam").exists()
+        assert len(Path("out/preview_1/sample.fastq").read_text().split("\n")) == 5
+        assert "Uniquely mapped" in Path("out/preview_1/preview_stats.tsv").read_text()
+
     def test_get_index_version_range(self, new_pipegraph, per_run_store):
         s = Subread(version="1.4.3-p1")
         assert s.get_index_version_range() == ("0.1", "1.5.99")
@@ -93,6 +291,33 @@ class TestSubread:
 
 
 class TestSTAR:
+    def test_fifo_inputs(self, per_run_store):
+        s = STAR(version="_fetching")
+        fastq, paired, fifos = s._fifo_inputs("out", "a.fastq.gz", "b.fastq")
+        assert fastq == (Path("out") / "input_fifo.fastq").absolute()
+        assert paired == "b.fastq"
+        assert [x[0] for x in fifos] == [fastq]
+
+    def test_fifo_inputs_read_map_number(self, per_run_store):
+        s = STAR(version="_fetching")
+        _, _, fifos = s._fifo_inputs("out", "a.fastq.gz", None)
+        assert not fifos[0][1].allow_early_close
+        _, _, fifos = s._fifo_inputs(
+            "out", "a.fastq.gz", None, {"--readMapNumber": -1}
+        )
+        assert not fifos[0][1].allow_early_close
+        # STAR stops reading after 1000 reads - not a feeder error
+        _, _, fifos = s._fifo_inputs(
+            "out", "a.fastq.gz", None, {"--readMapNumber": 1000}
+        )
+        assert fifos[0][1].allow_early_close
+
+    def test_fifo_inputs_skipped_with_read_files_command(self, per_run_store):
+        s = STAR(version="_fetching")
+        assert s._fifo_inputs(
+            "out", "a.fastq.gz", None, {"--readFilesCommand": "zcat"}
+        ) == ("a.fastq.gz", None, [])
+
     def test_build_and_align(self, new_pipegraph, per_run_store):
         new_pipegraph.quiet = False
         s = STAR('_latest')
@@ -158,6 +383,29 @@ class TestSTAR:
         with pytest.raises(ValueError):
             s.build_index_job(data_path / "genome.fasta", None, index_name)
 
+    def test_build_index_profiles(self, new_pipegraph, per_run_store):
+        s = STAR()
+        data_path = Path(__file__).parent / "sample_data"
+        assert s.get_index_profile_arguments("fast") == []
+        assert "--genomeSAsparseD" in s.get_index_profile_arguments("low_memory")
+        with pytest.raises(ValueError):
+            s.build_index_job(
+                data_path / "genome.fasta",
+                data_path / "genes.gtf",
+                "star/srf",
+                profile="no_such_profile",
+            )
+        job = s.build_index_job(
+            data_path / "genome.fasta",
+            data_path / "genes.gtf",
+            "star/srf_low",
+            profile="low_memory",
+        )
+        assert job.index_profile == "low_memory"
+        new_pipegraph.run()
+        cmd = Path("star/srf_low/cmd.txt").read_text()
+        assert "'--genomeSAsparseD', '3'" in cmd
+
 
 class TestBowtie:
     def test_build_and_align(self, new_pipegraph, per_run_store):
@@ -180,6 +428,35 @@ class TestBowtie:
         assert (Path("out") / "out.bam").exists()
         assert "'-k', '2'" in (Path("out") / "cmd.txt").read_text()
 
+    def test_collect_alignment_stats(self, new_pipegraph, per_run_store):
+        s = Bowtie(version="_fetching")
+        Path("sample").mkdir()
+        Path("sample/stderr.txt").write_text(
+            "# reads processed: 10\n"
+            "# reads with at least one reported alignment: 6 (60.00%)\n"
+            "# reads that failed to align: 3 (30.00%)\n"
+            "# reads with alignments suppressed due to -m: 1 (10.00%)\n"
+            "Reported 6 alignments\n"
+        )
+        Path("sample2").mkdir()
+        Path("sample2/stderr.txt").write_text(
+            "# reads processed: 10\n"
+            "# reads with at least one reported alignment: 7 (70.00%)\n"
+            "# reads that failed to align: 3 (30.00%)\n"
+            "Reported 7 alignments\n"
+        )
+        df = s.collect_alignment_stats(["sample/out.bam", "sample2/out.bam"])
+        assert df.loc["sample/out.bam"].to_dict() == {
+            "Aligned": 6,
+            "Unmapped": 3,
+            "Suppressed (-m)": 1,
+        }
+        assert df.loc["sample2/out.bam"].to_dict() == {
+            "Aligned": 7,
+            "Unmapped": 3,
+            "Suppressed (-m)": 0,
+        }
+
     def test_build_and_align_paired_end(self, new_pipegraph, per_run_store):
         new_pipegraph.quiet = False
         s = Bowtie()
@@ -146,6 +146,32 @@ class TestExternalStore:
         ).read_text() == "hello world10\n"
         assert (Path(job.filenames[0]).parent / "stderr.txt").read_text() == ""
 
+    def test_get_cores_to_use(self, new_pipegraph, local_store):
+        algo = DummyAlgorithm(version="_latest")
+        available = ppg.util.global_pipegraph.rc.cores_available
+        assert algo.get_cores_to_use() == available
+        assert algo.get_cores_to_use(-1) == available
+        assert algo.get_cores_to_use(1) == 1
+        assert algo.get_cores_to_use(available + 10) == available
+        assert WhateverAlgorithm().get_cores_to_use(4) == 1
+
+    def test_build_prebuild_outside_ppg(self, new_pipegraph, local_store):
+        import os
+        from mbf_externals import PrebuildManager
+
+        algo = DummyAlgorithm(version="_latest")
+        ppg.util.global_pipegraph = None
+        assert algo.get_cores_to_use() == os.cpu_count()
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+
+        def calc(output_path):
+            algo.get_run_func(output_path, [])()
+
+        job = mgr.build("dummy_output", "0.1", [], ["sentinel.txt", "stdout.txt"], calc)
+        assert job.find_file("sentinel.txt").exists()
+        assert job.find_file("stdout.txt").read_text() == "hello world10\n"
+
     def test_algo_get_auto_from_scratch(self, new_pipegraph, local_store):
         algo = DummyAlgorithm(version="_last_used")
         assert algo.version == "0.10"
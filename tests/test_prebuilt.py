@@ -2,7 +2,7 @@ import pytest
 import pypipegraph as ppg
 from pathlib import Path
 from mbf_externals import PrebuildManager
-from mbf_externals.util import UpstreamChangedError
+from mbf_externals.util import UpstreamChangedError, write_md5_sum
 
 
 class TestPrebuilt:
@@ -568,6 +568,402 @@ class TestPrebuilt:
         ppg.run_pipegraph()
         assert Path("prebuild/test_host/partA/0.5/A").read_text() == "0.5"
 
+    def test_input_checksum_algorithm_change(self, new_pipegraph):
+        from mbf_externals.prebuild import _PrebuildFileInvariantsExploding
+
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+        input_files = [Path("one"), Path("two")]
+        input_files[0].write_text("hello")
+        input_files[1].write_text("world")
+
+        def calc(output_path):
+            (output_path / "A").write_text("done")
+
+        mgr.prebuild("partA", "0.1", input_files, "A", calc)
+        new_pipegraph.run()
+        assert Path("prebuilt/test_host/partA/0.1/A").exists()
+
+        # a different algorithm for changed files is not a change by itself
+        _PrebuildFileInvariantsExploding.checksum_algorithm = "sha256"
+        try:
+            new_pipegraph.new_pipegraph()
+            input_files[0].write_text("hello")  # new mtime, same content
+            mgr.prebuild("partA", "0.1", input_files, "A", calc)
+            ppg.util.global_pipegraph.run()
+
+            new_pipegraph.new_pipegraph()
+            input_files[0].write_text("hello!")
+            mgr.prebuild("partA", "0.1", input_files, "A", calc)
+            with pytest.raises(UpstreamChangedError):
+                ppg.util.global_pipegraph.run()
+        finally:
+            _PrebuildFileInvariantsExploding.checksum_algorithm = "md5"
+
+    def test_manifest_with_path_inputs(self, new_pipegraph):
+        import json
+
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+        Path("one").write_text("hello")
+
+        def calc(output_path):
+            (output_path / "A").write_text("done")
+
+        mgr.prebuild("partA", "0.1", [Path("one")], "A", calc)
+        new_pipegraph.run()
+        manifest = json.loads(
+            Path("prebuilt/test_host/partA/0.1/mbf_manifest.json").read_text()
+        )
+        assert manifest["input_checksums"][0][0] == "one"
+        assert manifest["outputs"] == {"A": 4}
+
+    def test_manifest_records_whole_tree(self, new_pipegraph):
+        import json
+        from mbf_externals.util import get_directory_size
+
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+
+        def calc(output_path):
+            (output_path / "index").mkdir()
+            (output_path / "index" / "SA").write_text("A" * 1000)
+            (output_path / "sentinel.txt").write_text("done")
+
+        job = mgr.prebuild("partA", "0.1", [], "sentinel.txt", calc)
+        new_pipegraph.run()
+        manifest = json.loads((job.output_path / "mbf_manifest.json").read_text())
+        assert manifest["outputs"] == {"index/SA": 1000, "sentinel.txt": 4}
+        assert manifest["output_size"] > 1000
+        assert manifest["output_size"] <= get_directory_size(job.output_path)
+
+    def test_local_cache_replication(self, new_pipegraph):
+        import os
+        import shutil
+        import time
+
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "other_host")
+
+        def calc(output_path):
+            (output_path / "A").write_text("A" * 1000)
+
+        mgr.prebuild("partA", "0.1", [], "A", calc)
+        mgr.prebuild("partB", "0.1", [], "A", calc)
+        new_pipegraph.run()
+
+        new_pipegraph.new_pipegraph()
+        mgr = PrebuildManager(
+            "prebuilt", "test_host", local_cache_path="local", local_cache_size=1500
+        )
+        jobA = mgr.prebuild("partA", "0.1", [], "A", calc)
+        assert jobA.output_path == Path("local/other_host/partA/0.1").absolute()
+        # copied by the job, not at declaration
+        assert not Path("local/other_host/partA/0.1/mbf.done").exists()
+
+        # budget only fits one - but partA is in use by this manager
+        mgr.prebuild("partB", "0.1", [], "A", calc)
+        ppg.util.global_pipegraph.run()
+        assert Path(jobA.find_file("A")).read_text() == "A" * 1000
+        assert Path("local/other_host/partA/0.1/mbf.done").exists()
+        assert Path("local/other_host/partB/0.1/A").exists()
+        assert Path("local/other_host/partA/0.1/A").exists()
+
+        # another manager, and partA was last used long ago -> evicted
+        old = time.time() - 24 * 3600
+        os.utime("local/other_host/partA/0.1/.mbf_last_access", (old, old))
+        new_pipegraph.new_pipegraph()
+        mgr = PrebuildManager(
+            "prebuilt", "test_host", local_cache_path="local", local_cache_size=1500
+        )
+        shutil.rmtree("local/other_host/partB/0.1")
+        mgr.prebuild("partB", "0.1", [], "A", calc)
+        ppg.util.global_pipegraph.run()
+        assert Path("local/other_host/partB/0.1/A").exists()
+        assert not Path("local/other_host/partA/0.1").exists()
+
+        # outside of a pipegraph, it's copied right away
+        ppg.util.global_pipegraph = None
+        mgr.build("partA", "0.1", [], "A", calc)
+        assert Path("local/other_host/partA/0.1/mbf.done").exists()
+
+        # corrupted copies are refused
+        new_pipegraph.new_pipegraph()
+        mgr = PrebuildManager("prebuilt", "test_host", local_cache_path="local2")
+        Path("prebuilt/other_host/partA/0.1/A").write_text("B" * 1000)
+        job = mgr.prebuild("partA", "0.1", [], "A", calc)
+        with pytest.raises(ppg.RuntimeError):
+            ppg.util.global_pipegraph.run()
+        assert "md5sum mismatch" in str(job.exception)
+        assert not Path("local2/other_host/partA/0.1/mbf.done").exists()
+
+    def test_garbage_collect(self, new_pipegraph):
+        import os
+        import time
+        from mbf_externals.util import get_directory_size
+
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+
+        def calc(output_path):
+            (output_path / "A").write_text("A" * 1000)
+
+        mgr.prebuild("partA", "0.1", [], "A", calc)
+        mgr.prebuild("partB", "0.1", [], "A", calc)
+        new_pipegraph.run()
+        old = time.time() - 100 * 24 * 3600
+        for p in ["prebuilt/test_host/partA/0.1", "prebuilt/test_host/partB/0.1"]:
+            Path(p + "/.mbf_last_access").touch()
+            os.utime(p + "/.mbf_last_access", (old, old))
+
+        new_pipegraph.new_pipegraph()
+        mgr.prebuild("partB", "0.1", [], "A", calc)  # records the access
+        assert mgr.garbage_collect(0, dry_run=True) == [
+            (
+                Path("prebuilt/test_host/partA/0.1"),
+                get_directory_size("prebuilt/test_host/partA/0.1"),
+            )
+        ]
+        assert Path("prebuilt/test_host/partA/0.1").exists()
+        mgr.garbage_collect(0)
+        assert not Path("prebuilt/test_host/partA/0.1").exists()
+        assert Path("prebuilt/test_host/partB/0.1").exists()  # recently used
+        mgr.garbage_collect(0, min_age=0)
+        assert not Path("prebuilt/test_host/partB/0.1").exists()
+
+    @pytest.mark.parametrize("same_function", [True, False])
+    def test_build_lease_waits_for_other_host(self, new_pipegraph, same_function):
+        import json
+        import threading
+        import time
+        from mbf_externals.prebuild import _BuildLease, _hash_function_cached
+
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+        other_output = Path("prebuilt/other_host/partA/0.1").absolute()
+        other_output.mkdir(parents=True)
+        lease = Path("prebuilt/.leases/partA/0.1.lease")
+        lease.parent.mkdir(parents=True)
+        lease.write_text(
+            json.dumps(
+                {
+                    "host": "other_host",
+                    "pid": 1,
+                    "output_path": str(other_output),
+                    "nonce": "x",
+                }
+            )
+        )
+
+        def calc(output_path):
+            if same_function:
+                raise ValueError("should not be called - other host builds it")
+            (output_path / "A").write_text("built here")
+
+        def other_calc(output_path):  # pragma: no cover
+            pass
+
+        job = mgr.prebuild("partA", "0.1", [], "A", calc)
+        assert job.output_path == Path("prebuilt/test_host/partA/0.1")
+
+        def other_host_builds():
+            time.sleep(1)
+            (other_output / "A").write_text("built elsewhere")
+            write_md5_sum(other_output / "A")
+            (other_output / "mbf_func.md5sum2").write_text("other host's")
+            (other_output / "mbf_manifest.json").write_text(
+                json.dumps(
+                    {
+                        "input_checksums": [],
+                        "function_hash": ppg.FunctionInvariant._compare_new_and_old(
+                            *_hash_function_cached(
+                                calc if same_function else other_calc
+                            ),
+                            False,
+                        ),
+                    }
+                )
+            )
+            (other_output / "mbf.done").write_text("done")
+            Path("prebuilt/.leases/partA/0.1.built").write_text(
+                json.dumps({"output_path": str(other_output)})
+            )
+            lease.unlink()
+
+        _BuildLease.poll_interval = 0.1
+        t = threading.Thread(target=other_host_builds)
+        t.start()
+        try:
+            new_pipegraph.run()
+        finally:
+            t.join()
+            _BuildLease.poll_interval = 10
+        output = Path("prebuilt/test_host/partA/0.1")
+        assert (output / "mbf.done").exists()
+        assert (output / "A.md5sum").exists()
+        # our own function hash, not the other host's
+        assert (output / "mbf_func.md5sum2").read_text() != "other host's"
+        if same_function:  # copied, not rebuild
+            assert Path(job.find_file("A")).read_text() == "built elsewhere"
+        else:
+            assert Path(job.find_file("A")).read_text() == "built here"
+
+    def test_large_input_checksumming_warns(self, new_pipegraph, monkeypatch):
+        from mbf_externals import prebuild
+
+        monkeypatch.setattr(
+            prebuild,
+            "calc_input_checksums",
+            lambda *args: ([], (3, 300 * 1024 * 1024, 2.0)),
+        )
+        invariant = prebuild._PrebuildFileInvariantsExploding("out", [])
+        with pytest.warns(UserWarning, match="300.0 MB"):
+            invariant.calc_checksums(None)
+        assert invariant.checksum_report == (3, 300 * 1024 * 1024, 2.0)
+
+    def test_finished_build_matches(self, new_pipegraph):
+        import json
+        from mbf_externals.prebuild import (
+            _finished_build_matches,
+            _hash_function_cached,
+            calc_input_checksums,
+        )
+
+        def calc(output_path):  # pragma: no cover
+            pass
+
+        Path("built").mkdir()
+        Path("input").write_text("hello")
+        checksums, _ = calc_input_checksums(["input"], None)
+        assert not _finished_build_matches("built", calc, checksums)  # no manifest
+        manifest = {
+            "function_hash": ppg.FunctionInvariant._compare_new_and_old(
+                *_hash_function_cached(calc), False
+            ),
+            # paths & mtimes differ between hosts - only checksums count
+            "input_checksums": [["/elsewhere/input", 0, 5, checksums[0][3]]],
+        }
+        Path("built/mbf_manifest.json").write_text(json.dumps(manifest))
+        assert _finished_build_matches("built", calc, checksums)
+        Path("input").write_text("world")
+        checksums, _ = calc_input_checksums(["input"], None)
+        assert not _finished_build_matches("built", calc, checksums)
+        assert not _finished_build_matches("built", calc, checksums + checksums)
+
+    def test_build_lease(self, new_pipegraph):
+        import os
+        import threading
+        import time
+        from mbf_externals.prebuild import _BuildLease
+
+        Path("prebuilt").mkdir()
+        a = _BuildLease("prebuilt", "host_a", "partA", "0.1", expiry=60)
+        b = _BuildLease("prebuilt", "host_b", "partA", "0.1", expiry=60)
+        assert a.read() is None
+        assert a.acquire("prebuilt/host_a/partA/0.1")
+        assert not b.acquire("prebuilt/host_b/partA/0.1")
+        assert b.read()["host"] == "host_a"
+        # abandoned leases are taken over
+        os.utime(a.filename, (0, 0))
+        assert b.read() is None
+        assert b.acquire("prebuilt/host_b/partA/0.1")
+        # and the old holder can't remove the new lease
+        a.release()
+        assert b.filename.exists()
+        assert b.read()["host"] == "host_b"
+
+        # a failing holder releases without a build - the waiter takes over
+        b.poll_interval = 0.05
+
+        def fail():
+            time.sleep(0.3)
+            b.release()
+
+        t = threading.Thread(target=fail)
+        t.start()
+        c = _BuildLease("prebuilt", "host_c", "partA", "0.1", expiry=60)
+        c.poll_interval = 0.05
+        assert c.wait_or_acquire("prebuilt/host_c/partA/0.1") is None
+        t.join()
+        assert c.held
+        assert c.read()["host"] == "host_c"
+        Path("prebuilt/host_c/partA/0.1").mkdir(parents=True)
+        Path("prebuilt/host_c/partA/0.1/mbf.done").write_text("")
+        c.release("prebuilt/host_c/partA/0.1")
+        assert not c.filename.exists()
+        assert a.wait_or_acquire("prebuilt/host_a/partA/0.1") == Path(
+            "prebuilt/host_c/partA/0.1"
+        ).absolute()
+        assert not a.held
+
+    def test_build_lease_two_processes(self, new_pipegraph):
+        import multiprocessing
+        import time
+        from mbf_externals.prebuild import _BuildLease
+
+        ppg.util.global_pipegraph = None
+        Path("prebuilt").mkdir()
+        Path("calls").write_text("")
+
+        def calc(output_path):
+            with open("calls", "a") as op:
+                op.write("%s\n" % output_path)
+            time.sleep(1)
+            (output_path / "A").write_text("A")
+
+        def build(hostname):
+            _BuildLease.poll_interval = 0.1
+            PrebuildManager("prebuilt", hostname).build("partA", "0.1", [], "A", calc)
+
+        ctx = multiprocessing.get_context("fork")
+        processes = [ctx.Process(target=build, args=(h,)) for h in ("host_a", "host_b")]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        assert [p.exitcode for p in processes] == [0, 0]
+        assert len(Path("calls").read_text().strip().split("\n")) == 1
+        for host in ("host_a", "host_b"):
+            p = Path("prebuilt") / host / "partA" / "0.1"
+            assert (p / "A").read_text() == "A"
+            assert (p / "mbf.done").exists()
+
+    def test_find_versions_index(self, new_pipegraph):
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager(
+            "prebuilt", "test_host", version_index_filename="version_index.json"
+        )
+        Path("prebuilt/other_host/partA/0.1").mkdir(parents=True)
+        Path("prebuilt/other_host/partA/0.1/mbf.done").write_text("")
+        Path("prebuilt/test_host/partA/0.1").mkdir(parents=True)
+        Path("prebuilt/test_host/partA/0.2").mkdir(parents=True)
+        assert mgr._find_versions("partA") == {
+            "0.1": Path("prebuilt/other_host/partA/0.1")
+        }
+        assert Path("version_index.json").exists()
+        assert [x.name for x in Path(".").glob("version_index.json*")] == [
+            "version_index.json"
+        ]  # no temp files left behind
+        # unfinished versions are rechecked
+        Path("prebuilt/test_host/partA/0.2/mbf.done").write_text("")
+        assert mgr._find_versions("partA") == {
+            "0.1": Path("prebuilt/other_host/partA/0.1"),
+            "0.2": Path("prebuilt/test_host/partA/0.2"),
+        }
+        # this host is preferred
+        Path("prebuilt/test_host/partA/0.1/mbf.done").write_text("")
+        assert mgr._find_versions("partA")["0.1"] == Path("prebuilt/test_host/partA/0.1")
+        # new versions show up via the directory mtime
+        Path("prebuilt/other_host/partA/0.3").mkdir(parents=True)
+        Path("prebuilt/other_host/partA/0.3/mbf.done").write_text("")
+        assert "0.3" in mgr._find_versions("partA")
+        # and a fresh manager reads the persisted index
+        mgr2 = PrebuildManager(
+            "prebuilt", "test_host", version_index_filename="version_index.json"
+        )
+        assert ("other_host", "partA") in mgr2._version_index
+        assert mgr2._find_versions("partA") == mgr._find_versions("partA")
+
 
 class TestPrebuiltOutsideOfPPG:
     def test_prebuild(self, new_pipegraph):
@@ -590,3 +986,248 @@ class TestPrebuiltOutsideOfPPG:
 
         with pytest.raises(ValueError):
             mgr.prebuild("partB", "0.5", [], "A", calc_05)
+
+    def test_build(self, new_pipegraph):
+        ppg.util.global_pipegraph = None
+        Path("prebuilt").mkdir()
+        Path("input").write_text("hello")
+        mgr = PrebuildManager("prebuilt", "test_host")
+
+        def calc(output_path):
+            (output_path / "A").write_text(Path("input").read_text())
+
+        job = mgr.build("partA", "0.5", ["input"], "A", calc)
+        assert job.find_file("A").read_text() == "hello"
+        assert Path("prebuilt/test_host/partA/0.5/mbf.done").exists()
+        assert Path("prebuilt/test_host/partA/0.5/A.md5sum").exists()
+        assert Path("prebuilt/test_host/partA/0.5/mbf_func.md5sum2").exists()
+        # done - not rebuild
+        Path("prebuilt/test_host/partA/0.5/A").write_text("shu")
+        mgr.build("partA", "0.5", ["input"], "A", calc)
+        assert Path("prebuilt/test_host/partA/0.5/A").read_text() == "shu"
+
+        def calc_changed(output_path):
+            (output_path / "A").write_text("changed")
+
+        with pytest.raises(UpstreamChangedError):
+            mgr.build("partA", "0.5", ["input"], "A", calc_changed)
+        Path("input").write_text("hello world")
+        with pytest.raises(UpstreamChangedError):
+            mgr.build("partA", "0.5", ["input"], "A", calc)
+
+    def test_build_many(self, new_pipegraph):
+        ppg.util.global_pipegraph = None
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+
+        def calc(output_path):
+            (output_path / "A").write_text(output_path.name)
+
+        jobs = mgr.build_many(
+            [
+                {
+                    "name": "part%i" % ii,
+                    "version": "0.%i" % ii,
+                    "input_files": [],
+                    "output_files": "A",
+                    "calculating_function": calc,
+                }
+                for ii in range(3)
+            ],
+            processes=2,
+        )
+        for ii, job in enumerate(jobs):
+            assert job.find_file("A").read_text() == "0.%i" % ii
+            assert job.version == "0.%i" % ii
+
+    def test_build_hashing_writer_sidecars(self, new_pipegraph):
+        import hashlib
+        from mbf_externals.util import HashingWriter
+
+        ppg.util.global_pipegraph = None
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+
+        def calc(output_path):
+            with HashingWriter(output_path / "A") as op:
+                op.write(b"hello")
+            (output_path / "B").write_text("world")
+
+        mgr.build("partA", "0.5", [], ["A", "B"], calc)
+        p = Path("prebuilt/test_host/partA/0.5")
+        assert (p / "A.md5sum").read_text() == hashlib.md5(b"hello").hexdigest()
+        assert (p / "B.md5sum").read_text() == hashlib.md5(b"world").hexdigest()
+
+    def test_function_hash_memoized(self, new_pipegraph, monkeypatch):
+        from mbf_externals import prebuild
+
+        calls = []
+        org = ppg.FunctionInvariant._get_func_hash
+
+        def counting(key, function):
+            calls.append(function)
+            return org(key, function)
+
+        monkeypatch.setattr(ppg.FunctionInvariant, "_get_func_hash", counting)
+        monkeypatch.setattr(prebuild, "_function_hash_cache", {})
+        ppg.util.global_pipegraph = None
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+
+        def calc(output_path):
+            (output_path / "A").write_text("A")
+
+        for ii in range(3):
+            mgr.build("part%i" % ii, "0.1", [], "A", calc)
+            mgr.build("part%i" % ii, "0.2", [], "A", calc, "0.1")
+        assert len(calls) == 1
+
+        def other(output_path):
+            pass
+
+        prebuild._hash_function_cached(other)
+        assert len(calls) == 2
+        stored = prebuild._read_stored_function_hash(
+            Path("prebuilt/test_host/part0/0.1/mbf_func.md5sum")
+        )
+        assert stored is not None
+        assert not stored[1]
+
+    def test_function_hash_memoized_closures(self, monkeypatch):
+        from mbf_externals import prebuild
+
+        calls = []
+        org = ppg.FunctionInvariant._get_func_hash
+
+        def counting(key, function):
+            calls.append(function)
+            return org(key, function)
+
+        monkeypatch.setattr(ppg.FunctionInvariant, "_get_func_hash", counting)
+        monkeypatch.setattr(prebuild, "_function_hash_cache", {})
+
+        def make(genome_name):
+            def build(output_path):
+                return genome_name
+
+            return build
+
+        hashes = [prebuild._hash_function_cached(make(x)) for x in "abc"]
+        assert len(calls) == 1  # one code object
+        assert len(set(h[2] for h in hashes)) == 3  # closures still differ
+        assert hashes[0] == ppg.FunctionInvariant._hash_function(make("a"))
+        assert len(prebuild._function_hash_cache) == 1
+
+    def test_export_import_archive(self, new_pipegraph):
+        ppg.util.global_pipegraph = None
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "host_a")
+
+        def calc(output_path):
+            (output_path / "A").write_text("A" * 10000)
+            (output_path / "sub").mkdir()
+            (output_path / "sub" / "B").write_text("B")
+
+        mgr.build("aligner/partA", "0.5", [], ["A", "sub/B"], calc)
+        mgr.export_archive("aligner/partA", "0.5", "partA.zip")
+        with pytest.raises(ValueError):
+            mgr.export_archive("aligner/partA", "0.6", "partA.zip")
+
+        Path("other").mkdir()
+        mgr_b = PrebuildManager("other", "host_b")
+        target = mgr_b.import_archive("partA.zip")
+        assert target == Path("other/host_b/aligner/partA/0.5")
+        assert (target / "mbf.done").exists()
+        assert (target / "A").read_text() == "A" * 10000
+        assert (target / "sub" / "B").read_text() == "B"
+        assert (target / "A.md5sum").exists()
+        assert (target / "mbf_func.md5sum2").exists()
+        # importing again is a no-op
+        assert mgr_b.import_archive("partA.zip") == target
+        # and it's found - with the same function
+        job = mgr_b.build("aligner/partA", "0.5", [], ["A", "sub/B"], calc)
+        assert job.output_path == target
+
+    def test_manifest_and_inventory(self, new_pipegraph):
+        import json
+
+        ppg.util.global_pipegraph = None
+        Path("prebuilt").mkdir()
+        Path("input").write_text("hello")
+        mgr = PrebuildManager("prebuilt", "host_a")
+
+        def calc(output_path):
+            (output_path / "A").write_text("A" * 100)
+
+        mgr.build("aligner/partA", "0.5", ["input"], "A", calc)
+        manifest = json.loads(
+            Path("prebuilt/host_a/aligner/partA/0.5/mbf_manifest.json").read_text()
+        )
+        assert manifest["outputs"] == {"A": 100}
+        assert manifest["input_checksums"][0][0] == "input"
+        assert manifest["wall_time"] >= 0
+        assert manifest["max_rss_self"] > 0
+        assert manifest["function_hash"]
+        # a legacy build without manifest
+        Path("prebuilt/host_b/partB/0.1").mkdir(parents=True)
+        Path("prebuilt/host_b/partB/0.1/mbf.done").write_text("")
+
+        df = PrebuildManager("prebuilt", "host_a").inventory()
+        df = df.set_index("name")
+        assert set(df.index) == {"aligner/partA", "partB"}
+        assert df.loc["aligner/partA", "host"] == "host_a"
+        assert df.loc["aligner/partA", "version"] == "0.5"
+        # including md5 sidecars & function hashes
+        assert df.loc["aligner/partA", "output_size"] >= 100
+        assert df.loc["aligner/partA", "output_size"] == manifest["output_size"]
+        assert df.loc["aligner/partA", "input_count"] == 1
+        assert df.loc["partB", "host"] == "host_b"
+        assert df.loc["partB", "wall_time"] is None or df["wall_time"].isnull()["partB"]
+
+    def test_prefetch_job(self, new_pipegraph, monkeypatch):
+        from mbf_externals import prebuild
+
+        def fake_prefetch(output_path, max_bytes=None):
+            # runs in the forked job process - leave a trace on disk
+            Path("prefetched").write_text(str(output_path))
+            return None
+
+        monkeypatch.setattr(prebuild, "_prefetch_output_path", fake_prefetch)
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+
+        def calc(output_path):
+            (output_path / "A").write_text("A")
+
+        job = mgr.prebuild("partA", "0.5", [], "A", calc)
+        prefetch_job = job.prefetch_job()
+        assert job in prefetch_job.prerequisites
+        assert job.prefetch_job() is prefetch_job
+
+        def consume():
+            Path("consumed.txt").write_text((job.output_path / "A").read_text())
+
+        consumer = ppg.FileGeneratingJob("consumed.txt", consume).depends_on(
+            job, prefetch_job
+        )
+        new_pipegraph.run()
+        assert Path("consumed.txt").read_text() == "A"
+        assert Path("prefetched").read_text() == str(job.output_path)
+        assert not Path(prefetch_job.job_id).exists()  # a temp file
+        assert consumer.was_run
+
+    def test_prefetch(self, new_pipegraph):
+        ppg.util.global_pipegraph = None
+        Path("prebuilt").mkdir()
+        mgr = PrebuildManager("prebuilt", "test_host")
+
+        def calc(output_path):
+            (output_path / "index").mkdir()
+            (output_path / "index" / "SA").write_text("A" * 1000)
+
+        job = mgr.build("partA", "0.5", [], "index/SA", calc)
+        thread = job.prefetch()
+        thread.join(10)
+        assert not thread.is_alive()
+        Path("prebuilt/test_host/partA/0.5/mbf.done").unlink()
+        assert job.prefetch() is None
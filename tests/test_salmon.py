@@ -0,0 +1,425 @@
+from mbf_externals.aligners.salmon import Salmon
+from pathlib import Path
+import ast
+import io
+import pytest
+
+
+def test_write_fasta_buffers():
+    records = [("t%i" % ii, "ACGT" * ii) for ii in range(100)]
+    op = io.StringIO()
+    Salmon._write_fasta(iter(records), op, buffer_size=50)
+    should = "".join(f">{name}\n{seq}\n" for name, seq in records)
+    assert op.getvalue() == should
+
+
+def test_collect_quant(tmp_path):
+    from mbf_externals.aligners.salmon import collect_quant
+
+    for ii, name in enumerate(["a", "b"]):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "quant.sf").write_text(
+            "Name\tLength\tEffectiveLength\tTPM\tNumReads\n"
+            f"t1\t100\t80.5\t{ii}.5\t{ii}\n"
+            f"t2\t200\t180.5\t{ii + 10}.5\t{ii + 10}\n"
+        )
+    (tmp_path / "mapping").write_text("t1\tg1\nt2\tg1\n")
+    dirs = [tmp_path / "a", tmp_path / "b"]
+    res = collect_quant(dirs)
+    assert list(res["TPM"].columns) == ["a", "b"]
+    assert list(res["TPM"].index) == ["t1", "t2"]
+    assert res["NumReads"].loc["t2", "b"] == 11
+    assert res["TPM"].dtypes.tolist() == ["float64", "float64"]
+
+    genes = collect_quant(dirs, gene_transcript_mapping=tmp_path / "mapping")
+    assert genes["NumReads"].loc["g1", "b"] == 12
+
+    pytest.importorskip("pyarrow")
+    cache = tmp_path / "cache.parquet"
+    first = collect_quant(dirs, cache_filename=cache)
+    assert cache.exists()
+    (tmp_path / "b" / "quant.sf").write_text(
+        "Name\tLength\tEffectiveLength\tTPM\tNumReads\n"
+        "t1\t100\t80.5\t5\t50\n"
+        "t2\t200\t180.5\t5\t60\n"
+    )
+    second = collect_quant(dirs, cache_filename=cache)
+    assert (second["NumReads"]["a"] == first["NumReads"]["a"]).all()
+    assert second["NumReads"].loc["t2", "b"] == 60
+
+
+def _is_memmap(array):
+    import numpy as np
+
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def test_read_alevin_binary(tmp_path):
+    import gzip
+    import numpy as np
+    from mbf_externals.aligners.salmon import read_alevin
+
+    pytest.importorskip("scipy")
+    alevin = tmp_path / "alevin"
+    alevin.mkdir()
+    (alevin / "quants_mat_rows.txt").write_text("AAAA\nCCCC\nGGGG\n")
+    genes = ["g%i" % ii for ii in range(10)]
+    (alevin / "quants_mat_cols.txt").write_text("\n".join(genes) + "\n")
+    dense = np.zeros((3, 10), dtype=np.float32)
+    dense[0, [0, 9]] = [1, 2.5]
+    dense[2, 3] = 7
+    with gzip.open(alevin / "quants_mat.gz", "wb") as op:
+        for row in dense:
+            op.write(np.packbits(row > 0).tobytes())
+            op.write(row[row > 0].astype("<f4").tobytes())
+
+    matrix, barcodes, found_genes = read_alevin(tmp_path)
+    assert list(barcodes) == ["AAAA", "CCCC", "GGGG"]
+    assert list(found_genes) == genes
+    assert (matrix.toarray() == dense).all()
+    assert (alevin / "csr_cache" / "meta.json").exists()
+
+    matrix, barcodes, found_genes = read_alevin(tmp_path)  # now from the cache
+    # csr_matrix wraps the arrays (copy=False) - walk down to the memmap
+    assert _is_memmap(matrix.data)
+    assert _is_memmap(matrix.indices)
+    assert _is_memmap(matrix.indptr)
+    assert (matrix.toarray() == dense).all()
+
+
+class _FakeLane:
+    name = "lane"
+
+    def get_aligner_input_filenames(self):
+        return "a.fastq"
+
+    def prepare_input(self):
+        import pypipegraph as ppg
+
+        return ppg.ParameterInvariant("fake_lane_input", "a.fastq")
+
+
+class _FakeGenome:
+    name = "fake_genome"
+
+    def build_index(self, aligner):
+        import pypipegraph as ppg
+
+        return ppg.ParameterInvariant("fake_genome_index", "index")
+
+
+def test_cores_capped_at_available(new_pipegraph, per_test_store):
+    import pypipegraph as ppg
+
+    salmon = Salmon(None, version="_fetching")
+    available = ppg.util.global_pipegraph.rc.cores_available
+    salmon.default_cores = available + 10
+    job = salmon.run_quant_on_raw_lane(_FakeLane(), _FakeGenome(), "A")
+    assert job.cores_needed == available
+    job = salmon.run_quant_on_raw_lane(_FakeLane(), _FakeGenome(), "A", cores=1)
+    assert job.cores_needed == 1
+
+
+class _FakePrebuildGenome:
+    name = "fake_genome"
+
+    def build_index(self, aligner):
+        raise AssertionError("should have used the passed index_job")
+
+    def find_file(self, name):
+        from pathlib import Path
+
+        return Path(name).absolute()
+
+    def __init__(self, prebuild_manager):
+        self.prebuild_manager = prebuild_manager
+
+    def job_transcripts(self):
+        raise AssertionError("prebuilds can not depend on genome jobs")
+
+
+def test_quant_with_prebuilt_index(new_pipegraph, per_test_store):
+    from pathlib import Path
+    from mbf_externals.prebuild import PrebuildManager, PrebuildJob
+
+    Path("cdna.fasta").write_text(">t1\nACGT\n")
+    Path("genes.gtf").write_text("")
+    Path("genome.fasta").write_text(">1\nACGT\n")
+    Path("prebuilt").mkdir()
+    mgr = PrebuildManager("prebuilt", "test_host")
+    salmon = Salmon(None, version="_fetching")
+    salmon.version = "1.0.0"
+    genome = _FakePrebuildGenome(mgr)
+    index_job = salmon.build_index_prebuild(genome, prebuild_manager=mgr)
+    assert isinstance(index_job, PrebuildJob)
+    assert "salmon_indices/fake_genome/k31_" in str(index_job.output_path)
+    assert set(index_job.input_invariant.filenames) == set(
+        Path(x).absolute() for x in ("cdna.fasta", "genes.gtf", "genome.fasta")
+    )
+    # a different transcript selection is a different index
+    Path("genes.gtf").write_text("# changed\n")
+    assert (
+        salmon.build_index_prebuild(genome, prebuild_manager=mgr).output_path
+        != index_job.output_path
+    )
+    Path("genes.gtf").write_text("")
+
+    job = salmon.run_quant_on_raw_lane(_FakeLane(), genome, "A", index_job=index_job)
+    assert index_job in job.prerequisites
+    # prefetched by a job of it's own, ahead of the consumers
+    assert index_job.prefetch_job() in job.prerequisites
+    job, qc_job = salmon.run_alevin_on_sample(
+        _FakeLane(), genome, "chromium", index_job=index_job
+    )
+    assert index_job in job.prerequisites
+    assert index_job.prefetch_job() in job.prerequisites
+
+    cmds = []
+    salmon.get_run_func = lambda output_path, cmd, ncores: lambda: cmds.append(cmd)
+
+    class Lane:
+        def get_aligner_input_filenames(self):
+            return ["a.fastq"]
+
+    salmon.run_quant("out", Lane(), genome, "A", index_job=index_job)
+    assert str(index_job.output_path / "index") in cmds[-1]
+
+
+def _write_genome_files(tmp_path):
+    """t1 is in cdna.fasta, t2 (two exons, - strand) only in genome.fasta"""
+    (tmp_path / "genome.fasta").write_text(">1\nAAAACCCCGGGGTTTT\n")
+    (tmp_path / "cdna.fasta").write_text(">t1\nAAAA\n")
+    gtf = [
+        ("gene", 1, 16, "+", 'gene_id "g1"; gene_name "MT-a"; gene_biotype "rRNA";'),
+        ("transcript", 1, 4, "+", 'gene_id "g1"; transcript_id "t1"; '
+            'transcript_biotype "rRNA";'),
+        ("exon", 1, 4, "+", 'gene_id "g1"; transcript_id "t1";'),
+        ("transcript", 5, 16, "-", 'gene_id "g1"; transcript_id "t2"; '
+            'transcript_biotype "protein_coding";'),
+        ("exon", 13, 16, "-", 'gene_id "g1"; transcript_id "t2";'),
+        ("exon", 5, 6, "-", 'gene_id "g1"; transcript_id "t2";'),
+    ]
+    (tmp_path / "genes.gtf").write_text(
+        "#!genome-build test\n"
+        + "".join(
+            f"1\ttest\t{kind}\t{start}\t{stop}\t.\t{strand}\t.\t{attrs}\n"
+            for (kind, start, stop, strand, attrs) in gtf
+        )
+    )
+
+
+def test_genome_files_from_gtf(tmp_path):
+    from mbf_externals.aligners.salmon import _GenomeFiles
+
+    _write_genome_files(tmp_path)
+    genome = _GenomeFiles(
+        "fake_genome",
+        tmp_path / "cdna.fasta",
+        tmp_path / "genes.gtf",
+        tmp_path / "genome.fasta",
+    )
+    assert genome.find_file("genes.gtf") == tmp_path / "genes.gtf"
+    assert genome.df_genes.loc["g1", "name"] == "MT-a"
+    assert genome.df_genes.loc["g1", "biotype"] == "rRNA"
+    assert list(genome.df_transcripts.index) == ["t1", "t2"]
+    assert list(genome.df_transcripts["gene_stable_id"]) == ["g1", "g1"]
+    assert list(genome.df_transcripts["biotype"]) == ["rRNA", "protein_coding"]
+    assert genome.transcripts["t1"].mrna == "AAAA"
+    # CC + TTTT, reverse complemented
+    assert genome.transcripts["t2"].mrna == "AAAAGG"
+    salmon = Salmon(None, version="_fetching")
+    selected = genome.df_transcripts["gene_stable_id"]
+    assert list(salmon._iter_transcript_sequences(genome, selected)) == [
+        ("t1", "AAAA"),
+        ("t2", "AAAAGG"),
+    ]
+
+
+def test_index_version_range(per_test_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    salmon = Salmon(None, version="_fetching")
+    salmon.version = "1.0.0"
+    assert salmon.get_index_version_range() == ("1.0", None)
+    salmon.version = "1.4.0"
+    assert salmon.get_index_version_range() == ("1.0", None)
+    salmon.version = "0.14.1"
+    assert salmon.get_index_version_range() == ("0.1", "0.99.99")
+
+
+# stands in for 'salmon index' - copies the --transcripts input into the index
+_FAKE_SALMON_INDEX = """
+import sys, pathlib
+args = sys.argv[1:]
+index = pathlib.Path(args[args.index("-i") + 1])
+transcripts = pathlib.Path(args[args.index("--transcripts") + 1]).read_text()
+index.mkdir(parents=True, exist_ok=True)
+(index / "transcripts.fasta").write_text(transcripts)
+with open(index.parent / "runs.txt", "a") as op:
+    op.write("run\\n")
+"""
+
+
+class _FakeIndexGenome:
+    name = "fake_genome"
+
+    def __init__(self, path):
+        import pandas as pd
+
+        self.path = path
+        self.df_transcripts = pd.DataFrame(
+            {"gene_stable_id": ["g1", "g2"], "biotype": ["protein_coding"] * 2},
+            index=["t1", "t2"],
+        )
+        self.df_genes = pd.DataFrame(
+            {"name": ["MT-a", "b"], "biotype": ["protein_coding", "rRNA"]},
+            index=["g1", "g2"],
+        )
+        self.transcripts = {}
+
+    def find_file(self, name):
+        return self.path / name
+
+
+def _fake_index_salmon(monkeypatch):
+    import sys
+
+    salmon = Salmon(None, version="_fetching")
+    monkeypatch.setattr(salmon.store, "unpack_version", lambda name, version: None)
+    monkeypatch.setattr(
+        salmon,
+        "build_cmd",
+        lambda output_directory, ncores, arguments: [
+            sys.executable,
+            "-c",
+            _FAKE_SALMON_INDEX,
+        ]
+        + arguments,
+    )
+    return salmon
+
+
+def test_build_index_skips_unchanged_transcripts(
+    no_pipegraph, per_test_store, tmp_path, monkeypatch
+):
+    pytest.importorskip("pysam")
+    monkeypatch.chdir(tmp_path)
+    salmon = _fake_index_salmon(monkeypatch)
+    genome = _FakeIndexGenome(tmp_path)
+    (tmp_path / "cdna.fasta").write_text(">t1\nACGT\n>t2\nGGCC\n")
+    output = tmp_path / "index_out"
+    salmon.build_index_from_genome(genome, output)
+    assert (output / "runs.txt").read_text().count("run") == 1
+    assert (output / "index" / "transcripts.fasta").read_text() == (
+        ">t1\nACGT\n>t2\nGGCC\n"
+    )
+    assert (output / "mt.genes").read_text() == "g1\n"
+    assert (output / "rrna.genes").read_text() == "g2\n"
+
+    salmon.build_index_from_genome(genome, output)  # nothing changed
+    assert (output / "runs.txt").read_text().count("run") == 1
+
+    # same size, different sequence
+    (tmp_path / "cdna.fasta").write_text(">t1\nACGA\n>t2\nGGCC\n")
+    salmon.build_index_from_genome(genome, output)
+    assert (output / "runs.txt").read_text().count("run") == 2
+    assert "ACGA" in (output / "index" / "transcripts.fasta").read_text()
+
+
+class _FileOnlyGenome:
+    name = "fake_genome"
+
+    def __init__(self, path):
+        self.path = path
+
+    def find_file(self, name):
+        return self.path / name
+
+
+def test_build_index_prebuild_runs(new_pipegraph, per_test_store, monkeypatch):
+    import pypipegraph as ppg
+    from mbf_externals.prebuild import PrebuildManager
+
+    path = Path("genome").absolute()
+    path.mkdir()
+    _write_genome_files(path)
+    Path("prebuilt").mkdir()
+    mgr = PrebuildManager("prebuilt", "test_host")
+    salmon = _fake_index_salmon(monkeypatch)
+    salmon.version = "1.0.0"
+    index_job = salmon.build_index_prebuild(
+        _FileOnlyGenome(path), prebuild_manager=mgr
+    )
+    ppg.run_pipegraph()
+    output = index_job.output_path
+    assert (output / "index" / "transcripts.fasta").read_text() == (
+        ">t1\nAAAA\n>t2\nAAAAGG\n"
+    )
+    assert (output / "mt.genes").read_text() == "g1\n"
+    assert (output / "rrna.genes").read_text() == "g1\n"
+
+
+def _run_with_timeout(func, timeout=60):
+    """Run func in a thread - a hanging fifo must fail the test, not block it"""
+    import threading
+
+    result = {}
+
+    def inner():
+        try:
+            func()
+        except Exception as e:
+            result["exception"] = e
+
+    t = threading.Thread(target=inner, daemon=True)
+    t.start()
+    t.join(timeout)
+    assert not t.is_alive(), "hung"
+    return result.get("exception")
+
+
+def test_build_index_via_fifo(no_pipegraph, per_test_store, tmp_path, monkeypatch):
+    pytest.importorskip("pysam")
+    monkeypatch.chdir(tmp_path)
+    salmon = _fake_index_salmon(monkeypatch)
+    assert salmon.index_via_fifo
+    genome = _FakeIndexGenome(tmp_path)
+    genome.df_transcripts.loc["t3"] = ["g2", "protein_coding"]
+    genome.transcripts = {"t3": type("Transcript", (), {"mrna": "TTTT"})}
+    (tmp_path / "cdna.fasta").write_text(">t1\nACGT\n>t2\nGGCC\n")
+    output = tmp_path / "index_out"
+    e = _run_with_timeout(lambda: salmon.build_index_from_genome(genome, output))
+    assert e is None
+    assert (output / "index" / "transcripts.fasta").read_text() == (
+        ">t1\nACGT\n>t2\nGGCC\n>t3\nTTTT\n"
+    )
+    cmd = ast.literal_eval((output / "cmd.txt").read_text())
+    fifo = Path(cmd[cmd.index("--transcripts") + 1])
+    assert fifo.parent.name.startswith("mbf_salmon_")
+    assert not fifo.parent.exists()  # fifo and it's temp dir are gone
+    assert (output / "transcripts.hash").exists()
+
+
+def test_build_index_via_fifo_writer_fails(
+    no_pipegraph, per_test_store, tmp_path, monkeypatch
+):
+    pytest.importorskip("pysam")
+    monkeypatch.chdir(tmp_path)
+    salmon = _fake_index_salmon(monkeypatch)
+    genome = _FakeIndexGenome(tmp_path)
+    # t3 is neither in the fasta nor in genome.transcripts - the feed dies
+    genome.df_transcripts.loc["t3"] = ["g2", "protein_coding"]
+    (tmp_path / "cdna.fasta").write_text(">t1\nACGT\n>t2\nGGCC\n")
+    output = tmp_path / "index_out"
+    e = _run_with_timeout(lambda: salmon.build_index_from_genome(genome, output))
+    assert isinstance(e, ValueError)
+    assert "Feeding" in str(e)
+    assert "t3" in str(e)
+    assert not (output / "transcripts.hash").exists()
+    assert not (output / "sentinel.txt").exists()
+    cmd = ast.literal_eval((output / "cmd.txt").read_text())
+    fifo = Path(cmd[cmd.index("--transcripts") + 1])
+    assert not fifo.parent.exists()
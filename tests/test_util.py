@@ -70,3 +70,368 @@ def test_download_file_and_gzip(no_pipegraph):
         with gzip.GzipFile("test.gz") as op:
             actual = op.read().decode("utf-8")
         assert actual == should
+
+
+def test_download_file_and_gzip_single_pass(no_pipegraph, monkeypatch):
+    import shutil
+    from mbf_externals.util import checksum_file
+
+    should = b"hello world\n" * 10000
+    for pigz in [True, False]:
+        if not pigz:
+            monkeypatch.setattr(shutil, "which", lambda _name: None)
+        with requests_mock.Mocker() as m:
+            m.get("http://test.com", content=should)
+            md5 = download_file_and_gzip("http://test.com", "test.gz")
+        assert md5 == checksum_file("test.gz")
+        with gzip.GzipFile("test.gz") as op:
+            assert op.read() == should
+        assert [x.name for x in Path(".").glob("test.gz*")] == ["test.gz"]
+        with requests_mock.Mocker() as m:
+            m.get("http://test.com", status_code=404)
+            with pytest.raises(ValueError):
+                download_file_and_gzip("http://test.com", "test2.gz")
+        assert not list(Path(".").glob("test2.gz*"))
+
+
+def test_checksum_file(tmp_path):
+    import hashlib
+    from mbf_externals.util import checksum_file, checksum_algorithm
+
+    fn = tmp_path / "data"
+    data = b"hello world" * 100000
+    fn.write_bytes(data)
+    assert checksum_file(fn) == hashlib.md5(data).hexdigest()
+    assert checksum_file(fn, block_size=1000) == hashlib.md5(data).hexdigest()
+    b2 = checksum_file(fn, "blake2b")
+    assert b2 == "blake2b:" + hashlib.blake2b(data).hexdigest()
+    assert checksum_algorithm(b2) == "blake2b"
+    assert checksum_algorithm(checksum_file(fn)) == "md5"
+
+
+def test_hashing_writer(tmp_path):
+    import hashlib
+    from mbf_externals.util import HashingWriter, md5_sum_is_current
+
+    fn = tmp_path / "data"
+    with HashingWriter(fn) as op:
+        op.write(b"hello ")
+        op.writelines([b"world"] * 3)
+    assert fn.read_bytes() == b"hello worldworldworld"
+    assert (tmp_path / "data.md5sum").read_text() == hashlib.md5(
+        b"hello worldworldworld"
+    ).hexdigest()
+    assert md5_sum_is_current(fn)
+
+    fn2 = tmp_path / "broken"
+    with pytest.raises(KeyError):
+        with HashingWriter(fn2) as op:
+            op.write(b"half")
+            raise KeyError()
+    assert not (tmp_path / "broken.md5sum").exists()
+    assert not md5_sum_is_current(fn2)
+    with pytest.raises(ValueError):
+        HashingWriter(tmp_path / "x", "ab")
+
+
+def test_read_md5_sum_is_cached(tmp_path, monkeypatch):
+    import hashlib
+    import pypipegraph.util
+    from mbf_externals.util import read_md5_sum
+
+    calls = []
+    org = pypipegraph.util.checksum_file
+
+    def counting_checksum_file(filename):
+        calls.append(filename)
+        return org(filename)
+
+    monkeypatch.setattr(pypipegraph.util, "checksum_file", counting_checksum_file)
+    fn = tmp_path / "data"
+    fn.write_bytes(b"hello")
+    assert read_md5_sum(fn) == hashlib.md5(b"hello").hexdigest()
+    assert read_md5_sum(fn) == hashlib.md5(b"hello").hexdigest()
+    assert len(calls) == 1
+    fn.write_bytes(b"hello world")  # size changed
+    assert read_md5_sum(fn) == hashlib.md5(b"hello world").hexdigest()
+    assert len(calls) == 2
+
+
+def test_prefetch_files(tmp_path):
+    from mbf_externals.util import prefetch_files, get_available_memory
+
+    assert get_available_memory() > 0
+    a = tmp_path / "a"
+    a.write_bytes(b"a" * 1000)
+    thread = prefetch_files([a, tmp_path / "does_not_exist"])
+    thread.join(10)
+    assert not thread.is_alive()
+    thread = prefetch_files([a], max_bytes=10)  # over budget - nothing to do
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def _range_handler(data, fail_once, accept_ranges=True, stall=0):
+    """A http.server handler class serving @data,
+    honoring byte ranges and dropping the connection half way once
+    for each range start in @fail_once - after stalling for @stall seconds"""
+    import http.server
+    import time
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        seen_ranges = []
+
+        def do_GET(self):
+            rng = self.headers.get("Range")
+            self.seen_ranges.append(rng)
+            if rng and accept_ranges:
+                start, end = [int(x) for x in rng[len("bytes=") :].split("-")]
+                body = data[start : end + 1]
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", "bytes %i-%i/%i" % (start, end, len(data))
+                )
+            else:
+                start = 0
+                body = data
+                self.send_response(200)
+            if accept_ranges:
+                self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if start in fail_once:
+                fail_once.remove(start)
+                self.wfile.write(body[: len(body) // 2])
+                if stall:
+                    self.wfile.flush()
+                    time.sleep(stall)
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def range_server():
+    import http.server
+    import threading
+
+    servers = []
+
+    def start(data, fail_once=(), accept_ranges=True, stall=0):
+        handler = _range_handler(data, set(fail_once), accept_ranges, stall)
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return "http://127.0.0.1:%i/file" % server.server_address[1], handler
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_download_http_parallel_ranges(range_server):
+    import io
+
+    data = os.urandom(100000)
+    # second segment fails once and is resumed
+    url, handler = range_server(data, fail_once=[25000])
+    op = io.BytesIO()
+    download_http(url, op, segments=4, min_segment_size=1000)
+    assert op.getvalue() == data
+    ranges = [x for x in handler.seen_ranges if x]
+    assert len(ranges) == 5
+    assert "bytes=0-24999" in ranges
+    assert "bytes=25000-49999" in ranges
+
+
+def test_download_http_resumes_single_stream(range_server, monkeypatch):
+    import io
+    import time
+
+    delays = []
+    monkeypatch.setattr(time, "sleep", delays.append)
+    data = os.urandom(10000)
+    url, handler = range_server(data, fail_once=[0])
+    op = io.BytesIO()
+    download_http(url, op, retry_delay=0.25)  # too small to split
+    assert delays == [0.25]
+    assert op.getvalue() == data
+    assert handler.seen_ranges[0] is None
+    # resumed via a range request - where exactly it picks up depends on
+    # how much of the truncated response urllib3 hands out
+    assert len(handler.seen_ranges) == 2
+    assert handler.seen_ranges[1].startswith("bytes=")
+    assert handler.seen_ranges[1].endswith("-9999")
+
+
+def test_download_http_resumes_stalled_stream(range_server):
+    import io
+    import time
+
+    data = os.urandom(10000)
+    url, handler = range_server(data, fail_once=[0], stall=30)
+    op = io.BytesIO()
+    start = time.time()
+    download_http(url, op, retry_delay=0.01, timeout=(5, 0.5))
+    assert time.time() - start < 10
+    assert op.getvalue() == data
+    assert len(handler.seen_ranges) == 2
+    assert handler.seen_ranges[1].endswith("-9999")
+
+
+def test_download_http_without_ranges_fails_on_truncation(range_server):
+    import io
+    from mbf_externals.util import download_file
+
+    data = os.urandom(10000)
+    url, handler = range_server(data, fail_once=[0], accept_ranges=False)
+    with pytest.raises(ValueError):
+        download_file(url, io.BytesIO())
+
+
+def test_download_mirror_directory(tmp_path):
+    import io
+    import hashlib
+    from mbf_externals.util import download_file, set_download_mirror
+
+    mirror = tmp_path / "mirror"
+    set_download_mirror(mirror)
+    try:
+        with requests_mock.Mocker() as m:
+            m.get("http://test.com/file", content=b"hello world")
+            op = io.BytesIO()
+            download_file("http://test.com/file", op)
+            assert op.getvalue() == b"hello world"
+        content_hash = hashlib.sha256(b"hello world").hexdigest()
+        assert (mirror / "by_hash" / content_hash).read_bytes() == b"hello world"
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = (mirror / "by_hash" / content_hash).stat().st_mode & 0o777
+        assert mode == 0o644 & ~umask
+        assert mode & 0o044 == 0o044 & ~umask  # readable by others
+        with requests_mock.Mocker() as m:
+            m.get("http://test.com/file", status_code=404)
+            op = io.BytesIO()
+            download_file("http://test.com/file", op)  # served from the mirror
+            assert op.getvalue() == b"hello world"
+            # unless told otherwise
+            with pytest.raises(ValueError):
+                download_file("http://test.com/file", io.BytesIO(), use_mirror=False)
+        (mirror / "by_hash" / content_hash).write_bytes(b"corrupted")
+        with pytest.raises(ValueError):
+            download_file("http://test.com/file", io.BytesIO())
+    finally:
+        set_download_mirror(None)
+
+
+def test_download_mirror_http():
+    import io
+    import hashlib
+    from mbf_externals.util import download_file, set_download_mirror
+
+    url_key = hashlib.sha256(b"http://test.com/file").hexdigest()
+    content_hash = hashlib.sha256(b"hello world").hexdigest()
+    set_download_mirror("http://mirror.local/")
+    try:
+        with requests_mock.Mocker() as m:
+            m.get("http://mirror.local/by_url/" + url_key, text=content_hash)
+            m.get("http://mirror.local/by_hash/" + content_hash, content=b"hello world")
+            other_key = hashlib.sha256(b"http://test.com/other").hexdigest()
+            m.get("http://mirror.local/by_url/" + other_key, status_code=404)
+            m.get("http://test.com/file", status_code=404)
+            m.get("http://test.com/other", content=b"upstream")
+            op = io.BytesIO()
+            download_file("http://test.com/file", op)
+            assert op.getvalue() == b"hello world"
+            op = io.BytesIO()
+            download_file("http://test.com/other", op)  # mirror miss
+            assert op.getvalue() == b"upstream"
+    finally:
+        set_download_mirror(None)
+
+
+def _read_fifo(path, sniff=None):
+    """Read path (or only @sniff bytes of it) in a thread"""
+    import threading
+
+    seen = []
+
+    def reader():
+        with open(path, "rb") as op:
+            seen.append(op.read(sniff) if sniff else op.read())
+
+    t = threading.Thread(target=reader, daemon=True)
+    t.start()
+    t.join(10)
+    assert not t.is_alive()
+    return seen
+
+
+def test_fifo_feeder_early_close_is_an_error(tmp_path):
+    import time
+    from mbf_externals.util import FIFOFeeder
+
+    def feed(op):
+        for _ in range(1000):
+            op.write(b"x" * 65536)
+
+    feeder = FIFOFeeder(tmp_path / "fifo", feed).start()
+    # sniff & close, then reopen - like subread does
+    assert _read_fifo(feeder.fifo_path, 10) == [b"x" * 10]
+    for _ in range(100):
+        if feeder.exception is not None:
+            break
+        time.sleep(0.1)
+    assert "closed" in str(feeder.exception)
+    # the reopen gets an EOF (instead of hanging)
+    assert _read_fifo(feeder.fifo_path) == [b""]
+    feeder.finish()
+    assert "closed" in str(feeder.exception)
+    assert not feeder.fifo_path.exists()
+
+    feeder = FIFOFeeder(tmp_path / "fifo", feed, allow_early_close=True).start()
+    assert _read_fifo(feeder.fifo_path, 10) == [b"x" * 10]
+    feeder.finish()
+    assert feeder.exception is None
+
+
+def test_fifo_feeder_reopen_is_an_error(tmp_path):
+    from mbf_externals.util import FIFOFeeder
+
+    feeder = FIFOFeeder(tmp_path / "fifo", lambda op: op.write(b"hello")).start()
+    assert _read_fifo(feeder.fifo_path) == [b"hello"]
+    assert feeder.exception is None
+    assert _read_fifo(feeder.fifo_path) == [b""]
+    feeder.finish()
+    assert "reopened" in str(feeder.exception)
+
+    feeder = FIFOFeeder(tmp_path / "fifo", lambda op: op.write(b"hello")).start()
+    assert _read_fifo(feeder.fifo_path) == [b"hello"]
+    feeder.finish()
+    assert feeder.exception is None
+
+
+def test_decompressing_feed_reader_stops_early(tmp_path, monkeypatch):
+    from mbf_externals.util import FIFOFeeder, decompressing_feed
+
+    # stands in for pigz - endless output, killed by SIGPIPE
+    pigz = tmp_path / "pigz"
+    pigz.write_text("#!/bin/sh\nexec yes\n")
+    pigz.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path) + os.pathsep + os.environ["PATH"])
+    fn = tmp_path / "sample.fastq.gz"
+    for allow_early_close in (False, True):
+        feed = decompressing_feed(fn, allow_early_close=allow_early_close)
+        feeder = FIFOFeeder(tmp_path / "fifo", feed).start()
+        assert _read_fifo(feeder.fifo_path, 4) == [b"y\ny\n"]
+        feeder.finish()
+        if allow_early_close:
+            assert feeder.exception is None
+        else:
+            assert "closed" in str(feeder.exception)